@@ -0,0 +1,286 @@
+"""
+Per-view query metrics.
+
+``QueryMetricsMiddleware`` samples ``QUERY_METRICS_SAMPLE_RATE`` of the
+requests. For a sampled request, every query run on its behalf is timed
+by a ``backend.querytiming.QueryTimer``, so queries from the report
+query pool count as well. Per view the registry keeps request,
+query, database time, serialization time, render time (encoding the
+response body) and response size totals, which ``metrics_view`` exports
+in the Prometheus text format, along with the families apps add through
+``register_collector``. Serialization time is the time spent in
+outermost ``serializer.data`` calls, including the queries they trigger;
+it is measured by wrapping ``BaseSerializer.data``, which the middleware
+does once when sampling is on. Requests running more queries than their
+view's budget (``QUERY_BUDGETS``, else ``QUERY_BUDGET_DEFAULT``) are
+logged with their most repeated statement, which is usually the N+1.
+
+Unsampled requests cost one random draw. When sampling is off the
+middleware returns straight away and the timer is not installed at
+all. Counters are kept per process, so with several workers
+each one must be scraped separately.
+"""
+import hmac
+import logging
+import random
+import threading
+import time
+from collections import Counter
+from asgiref.sync import iscoroutinefunction, markcoroutinefunction
+from django.conf import settings
+from django.http import Http404, HttpResponse
+from rest_framework.serializers import BaseSerializer
+from .querytiming import QueryTimer
+
+logger = logging.getLogger(__name__)
+
+# Upper bounds of the queries-per-request histogram buckets
+QUERY_BUCKETS = (1, 2, 5, 10, 20, 50, 100, 200)
+
+timer = QueryTimer('query-metrics')
+
+
+class RequestStats:
+    """Queries and timings of one sampled request."""
+    
+    def __init__(self):
+        self.started = time.perf_counter()
+        self.queries = 0
+        self.db_seconds = 0.0
+        self.serialize_seconds = 0.0
+        self.render_seconds = 0.0
+        self.statements = Counter()
+        self._lock = threading.Lock()
+        self._serializing = False
+    
+    def record(self, alias, sql, params, many, seconds):
+        # Report queries may run on several pool threads at once
+        with self._lock:
+            self.queries += 1
+            self.db_seconds += seconds
+            self.statements[sql] += 1
+
+
+def _timed_data(data):
+    def timed(serializer):
+        stats = timer.current()
+        # Nested serializers run inside the outer call and are not counted twice
+        if stats is None or stats._serializing:
+            return data(serializer)
+        stats._serializing = True
+        started = time.perf_counter()
+        try:
+            return data(serializer)
+        finally:
+            stats.serialize_seconds += time.perf_counter() - started
+            stats._serializing = False
+    timed.metrics_wrapped = True
+    return timed
+
+
+def install_serializer_timing():
+    data = BaseSerializer.data
+    if not getattr(data.fget, 'metrics_wrapped', False):
+        BaseSerializer.data = property(_timed_data(data.fget))
+
+
+class ViewMetrics:
+    __slots__ = ('requests', 'queries', 'buckets', 'db_seconds', 'serialize_seconds', 'render_seconds',
+                 'seconds', 'response_bytes', 'over_budget')
+    
+    def __init__(self):
+        self.requests = self.queries = self.response_bytes = self.over_budget = 0
+        self.db_seconds = self.serialize_seconds = self.render_seconds = self.seconds = 0.0
+        self.buckets = [0] * len(QUERY_BUCKETS)
+
+
+class Registry:
+    """Totals per ``(view name, method)`` for this process."""
+    
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._views = {}
+    
+    def observe(self, view, method, stats, seconds, response_bytes, over_budget):
+        with self._lock:
+            metrics = self._views.get((view, method))
+            if metrics is None:
+                metrics = self._views[(view, method)] = ViewMetrics()
+            metrics.requests += 1
+            metrics.queries += stats.queries
+            for i, bound in enumerate(QUERY_BUCKETS):
+                if stats.queries <= bound:
+                    metrics.buckets[i] += 1
+            metrics.db_seconds += stats.db_seconds
+            metrics.serialize_seconds += stats.serialize_seconds
+            metrics.render_seconds += stats.render_seconds
+            metrics.seconds += seconds
+            metrics.response_bytes += response_bytes
+            metrics.over_budget += over_budget
+    
+    def snapshot(self):
+        with self._lock:
+            return {key: _copy(metrics) for key, metrics in self._views.items()}
+    
+    def clear(self):
+        with self._lock:
+            self._views.clear()
+
+
+def _copy(metrics):
+    copy = ViewMetrics()
+    for name in ViewMetrics.__slots__:
+        value = getattr(metrics, name)
+        setattr(copy, name, list(value) if isinstance(value, list) else value)
+    return copy
+
+
+registry = Registry()
+
+# Functions adding app-specific metric families to every scrape
+_collectors = []
+
+
+def register_collector(collect):
+    """
+    Call ``collect(family)`` on every scrape; ``family(name, kind, help_text,
+    samples)`` writes one metric family. Apps register from ``ready()``.
+    """
+    if collect not in _collectors:
+        _collectors.append(collect)
+
+
+def query_budget(view):
+    return settings.QUERY_BUDGETS.get(view, settings.QUERY_BUDGET_DEFAULT)
+
+
+class QueryMetricsMiddleware:
+    sync_capable = True
+    async_capable = True
+    
+    def __init__(self, get_response):
+        self.get_response = get_response
+        self.async_mode = iscoroutinefunction(get_response)
+        if self.async_mode:
+            markcoroutinefunction(self)
+        if settings.QUERY_METRICS_SAMPLE_RATE > 0:
+            timer.install()
+            install_serializer_timing()
+    
+    def _sampled(self):
+        rate = settings.QUERY_METRICS_SAMPLE_RATE
+        return rate > 0 and (rate >= 1 or random.random() < rate)
+    
+    def __call__(self, request):
+        if self.async_mode:
+            return self.__acall__(request)
+        if not self._sampled():
+            return self.get_response(request)
+        stats = request._query_metrics = RequestStats()
+        with timer.collecting(stats):
+            response = self.get_response(request)
+        self._finish(request, response, stats)
+        return response
+    
+    async def __acall__(self, request):
+        if not self._sampled():
+            return await self.get_response(request)
+        stats = request._query_metrics = RequestStats()
+        with timer.collecting(stats):
+            response = await self.get_response(request)
+        self._finish(request, response, stats)
+        return response
+    
+    def process_template_response(self, request, response):
+        # Called right before DRF responses are rendered
+        stats = getattr(request, '_query_metrics', None)
+        if stats is not None:
+            started = time.perf_counter()
+            
+            def rendered(response):
+                stats.render_seconds += time.perf_counter() - started
+            
+            response.add_post_render_callback(rendered)
+        return response
+    
+    def _finish(self, request, response, stats):
+        seconds = time.perf_counter() - stats.started
+        match = request.resolver_match
+        view = match.view_name if match else 'unresolved'
+        if response.streaming:
+            response_bytes = int(response.get('Content-Length') or 0)
+        else:
+            response_bytes = len(response.content)
+        budget = query_budget(view)
+        over_budget = stats.queries > budget
+        registry.observe(view, request.method, stats, seconds, response_bytes, over_budget)
+        if over_budget:
+            statement, repeats = stats.statements.most_common(1)[0]
+            logger.warning(
+                '%s %s (%s) ran %d queries, budget %d; %.1f ms in the database. '
+                'Most repeated (%dx): %.300s',
+                request.method, request.path, view, stats.queries, budget,
+                stats.db_seconds * 1000, repeats, statement,
+            )
+
+
+def _escape(value):
+    return str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+
+def _labels(**labels):
+    return '{' + ','.join(f'{name}="{_escape(value)}"' for name, value in labels.items()) + '}'
+
+
+def render_metrics():
+    """All metrics in the Prometheus text exposition format."""
+    lines = []
+
+    def family(name, kind, help_text, samples):
+        lines.append(f'# HELP {name} {help_text}')
+        lines.append(f'# TYPE {name} {kind}')
+        lines.extend(f'{name}{suffix} {value}' for suffix, value in samples)
+
+    views = sorted(registry.snapshot().items())
+
+    def per_view(attribute):
+        return [(_labels(view=view, method=method), getattr(metrics, attribute)) for (view, method), metrics in views]
+
+    family('medixhub_metrics_sample_rate', 'gauge', 'Fraction of requests measured.',
+           [('', settings.QUERY_METRICS_SAMPLE_RATE)])
+    family('medixhub_http_requests_total', 'counter', 'Sampled requests.', per_view('requests'))
+
+    histogram = []
+    for (view, method), metrics in views:
+        for bound, count in zip(QUERY_BUCKETS, metrics.buckets):
+            histogram.append((f'_bucket{_labels(view=view, method=method, le=bound)}', count))
+        histogram.append((f'_bucket{_labels(view=view, method=method, le="+Inf")}', metrics.requests))
+        histogram.append((f'_sum{_labels(view=view, method=method)}', metrics.queries))
+        histogram.append((f'_count{_labels(view=view, method=method)}', metrics.requests))
+    family('medixhub_db_queries', 'histogram', 'Database queries per sampled request.', histogram)
+
+    family('medixhub_db_seconds_total', 'counter', 'Time spent in database queries.', per_view('db_seconds'))
+    family('medixhub_serialize_seconds_total', 'counter', 'Time spent in serializer.data, queries included.',
+           per_view('serialize_seconds'))
+    family('medixhub_render_seconds_total', 'counter', 'Time spent rendering response bodies.',
+           per_view('render_seconds'))
+    family('medixhub_http_request_seconds_total', 'counter', 'Time spent handling sampled requests.',
+           per_view('seconds'))
+    family('medixhub_http_response_bytes_total', 'counter', 'Response body bytes.', per_view('response_bytes'))
+    family('medixhub_query_budget_exceeded_total', 'counter', 'Sampled requests over their query budget.',
+           per_view('over_budget'))
+
+    for collect in _collectors:
+        collect(family)
+    return '\n'.join(lines) + '\n'
+
+
+def metrics_view(request):
+    """Prometheus scrape endpoint; needs ``Authorization: Bearer <METRICS_TOKEN>``."""
+    token = settings.METRICS_TOKEN
+    if not token:
+        raise Http404
+    header = request.headers.get('Authorization', '')
+    if not hmac.compare_digest(header.encode(), f'Bearer {token}'.encode()):
+        return HttpResponse('Forbidden', status=403, content_type='text/plain')
+    return HttpResponse(render_metrics(), content_type='text/plain; version=0.0.4; charset=utf-8')
@@ -0,0 +1,301 @@
+"""
+PostgreSQL monthly range partitioning for append-only history tables.
+
+Partitions are named ``<table>_pYYYY_MM`` and cover one calendar month in
+UTC. Every partitioned table also has a ``<table>_default`` partition so
+inserts never fail when maintenance has fallen behind; rows that land
+there are moved into the proper partition when it is created.
+
+PostgreSQL requires the partition key in every primary key and unique
+constraint, so the converted tables use ``(id, <column>)`` as primary
+key and lose database-level foreign keys pointing *to* them. Ids still
+come from a single sequence and stay unique. Other unique indexes that
+include the partition key are kept as they are, and unique constraints
+are recreated as constraints under their own name. Unique indexes that
+lack the partition key become plain indexes, and unique constraints
+that lack it (such as ``sales_sale.invoice_number``) get it appended.
+Their uniqueness is then enforced by a guard: an unpartitioned
+``<table>_<columns>_uniq`` table holding one row per value, kept in step
+by a trigger on the parent. Rows of dropped partitions keep their values
+reserved.
+
+``sales_saleitem`` is partitioned on its own ``created_at`` rather than
+on the sale date, which it does not store. Items are created in the
+transaction that creates their sale, so ``created_at`` trails
+``sale_date`` by at most ``SALE_ITEM_LAG``. Queries that filter items
+by sale date add the matching ``created_at`` range so the planner can
+prune partitions (see ``SaleItemQuerySet.sold_between``).
+"""
+import re
+from datetime import date, timedelta
+from django.db import transaction
+
+# table -> partition key column
+PARTITIONED_TABLES = {
+    'sales_sale': 'sale_date',
+    'sales_saleitem': 'created_at',
+    'inventory_stocktransaction': 'created_at',
+}
+
+PARTITION_NAME = re.compile(r'_p(\d{4})_(\d{2})$')
+
+# Upper bound on how long after its sale a sale item is created
+SALE_ITEM_LAG = timedelta(hours=1)
+
+# Set while ensure_partitions moves rows, which keep their values
+MOVING_SETTING = 'partitioning.moving_rows'
+
+
+def month_start(day):
+    return date(day.year, day.month, 1)
+
+
+def add_months(day, months):
+    index = day.year * 12 + day.month - 1 + months
+    return date(index // 12, index % 12 + 1, 1)
+
+
+def partition_name(table, month):
+    return f'{table}_p{month.year:04d}_{month.month:02d}'
+
+
+def _bounds(month):
+    return f"'{month.isoformat()} 00:00:00+00'", f"'{add_months(month, 1).isoformat()} 00:00:00+00'"
+
+
+def convert_to_partitioned(connection, table, column, months_ahead=3):
+    """
+    Rebuild ``table`` as a table partitioned by month on ``column``.
+
+    Existing rows are copied into monthly partitions; indexes, check and
+    outgoing foreign key constraints are recreated on the new parent.
+    """
+    qn = connection.ops.quote_name
+    legacy = f'{table}_legacy'
+    sequence = f'{table}_id_seq'
+
+    with connection.cursor() as cursor:
+        cursor.execute(
+            "SELECT conname, pg_get_constraintdef(oid) FROM pg_constraint "
+            "WHERE conrelid = %s::regclass AND contype IN ('c', 'f')",
+            [table],
+        )
+        constraints = cursor.fetchall()
+        cursor.execute(
+            "SELECT pg_get_indexdef(ix.indexrelid), ix.indisunique, ix.indpred IS NOT NULL, "
+            "ARRAY(SELECT a.attname FROM unnest(ix.indkey) WITH ORDINALITY k(attnum, n) "
+            "LEFT JOIN pg_attribute a ON a.attrelid = ix.indrelid AND a.attnum = k.attnum "
+            "WHERE k.n <= ix.indnkeyatts ORDER BY k.n), "
+            "(SELECT conname FROM pg_constraint WHERE conindid = ix.indexrelid AND contype = 'u') "
+            "FROM pg_index ix WHERE ix.indrelid = %s::regclass AND NOT ix.indisprimary",
+            [table],
+        )
+        indexes = cursor.fetchall()
+        for definition, unique, partial, columns, constraint in indexes:
+            if unique and column not in columns and (partial or None in columns):
+                raise ValueError(f'Cannot keep unique index on {table} without {column}: {definition}')
+        cursor.execute(f'SELECT MIN({qn(column)}), MAX({qn(column)}) FROM {qn(table)}')
+        first, last = cursor.fetchone()
+
+        cursor.execute(f'ALTER TABLE {qn(table)} RENAME TO {qn(legacy)}')
+        cursor.execute(
+            f'CREATE TABLE {qn(table)} (LIKE {qn(legacy)} INCLUDING DEFAULTS) '
+            f'PARTITION BY RANGE ({qn(column)})'
+        )
+        cursor.execute(f'CREATE SEQUENCE {qn(sequence + "_new")}')
+        cursor.execute(
+            f"ALTER TABLE {qn(table)} ALTER COLUMN id SET DEFAULT nextval('{sequence}_new')"
+        )
+
+        today = month_start(date.today())
+        month = month_start(first.date()) if first else today
+        end = max(month_start(last.date()) if last else today, today)
+        end = add_months(end, months_ahead)
+        while month <= end:
+            _create_partition(cursor, qn, table, month)
+            month = add_months(month, 1)
+        cursor.execute(f'CREATE TABLE {qn(table + "_default")} PARTITION OF {qn(table)} DEFAULT')
+
+        cursor.execute(f'INSERT INTO {qn(table)} SELECT * FROM {qn(legacy)}')
+        cursor.execute(
+            f"SELECT setval('{sequence}_new', COALESCE((SELECT MAX(id) FROM {qn(legacy)}), 0) + 1, false)"
+        )
+        cursor.execute(f'DROP TABLE {qn(legacy)} CASCADE')
+
+        cursor.execute(f'ALTER SEQUENCE {qn(sequence + "_new")} RENAME TO {qn(sequence)}')
+        cursor.execute(f'ALTER SEQUENCE {qn(sequence)} OWNED BY {qn(table)}.id')
+        cursor.execute(f'ALTER TABLE {qn(table)} ADD PRIMARY KEY (id, {qn(column)})')
+
+        for definition, unique, partial, columns, constraint in indexes:
+            if constraint:
+                keys = ', '.join(qn(name) for name in unique_key(columns, column))
+                cursor.execute(f'ALTER TABLE {qn(table)} ADD CONSTRAINT {qn(constraint)} UNIQUE ({keys})')
+            elif unique and column not in columns:
+                # Unique indexes cannot omit the partition key; keep a
+                # plain index for lookups and a guard for uniqueness.
+                cursor.execute(definition.replace('CREATE UNIQUE INDEX', 'CREATE INDEX', 1))
+            else:
+                cursor.execute(definition)
+            if unique and column not in columns:
+                add_unique_guard(connection, table, columns)
+        for name, definition in constraints:
+            cursor.execute(f'ALTER TABLE {qn(table)} ADD CONSTRAINT {qn(name)} {definition}')
+
+
+def unique_key(columns, column):
+    """Columns of a unique constraint on ``columns`` of a table partitioned on ``column``."""
+    return columns if column in columns else [*columns, column]
+
+
+def guard_name(table, columns):
+    return f'{table}_{"_".join(columns)}_uniq'
+
+
+def add_unique_guard(connection, table, columns):
+    """
+    Enforce uniqueness of ``columns`` on partitioned ``table``.
+
+    Creates the guard table, fills it from the existing rows (failing on
+    duplicates) and installs the trigger keeping it in step. Does nothing
+    if the guard already exists.
+    """
+    qn = connection.ops.quote_name
+    guard = guard_name(table, columns)
+    names = ', '.join(qn(name) for name in columns)
+    old = ', '.join(f'OLD.{qn(name)}' for name in columns)
+    new = ', '.join(f'NEW.{qn(name)}' for name in columns)
+    present = ' AND '.join(f'{qn(name)} IS NOT NULL' for name in columns)
+
+    with connection.cursor() as cursor:
+        cursor.execute('SELECT to_regclass(%s) IS NOT NULL', [guard])
+        if cursor.fetchone()[0]:
+            return
+        cursor.execute(f'CREATE TABLE {qn(guard)} AS SELECT {names} FROM {qn(table)} WITH NO DATA')
+        cursor.execute(f'ALTER TABLE {qn(guard)} ADD CONSTRAINT {qn(guard + "_key")} UNIQUE ({names})')
+        cursor.execute(f'INSERT INTO {qn(guard)} SELECT {names} FROM {qn(table)} WHERE {present}')
+        # Rows with a NULL column are left out, as a unique index would
+        cursor.execute(
+            f'CREATE FUNCTION {qn(guard)}() RETURNS trigger LANGUAGE plpgsql AS $$\n'
+            f'BEGIN\n'
+            f"    IF TG_OP = 'TRUNCATE' THEN\n"
+            f'        TRUNCATE {qn(guard)};\n'
+            f'        RETURN NULL;\n'
+            f'    END IF;\n'
+            f"    IF current_setting('{MOVING_SETTING}', true) = 'on' THEN\n"
+            f'        RETURN NULL;\n'
+            f'    END IF;\n'
+            f"    IF TG_OP = 'UPDATE' AND ROW({old}) IS NOT DISTINCT FROM ROW({new}) THEN\n"
+            f'        RETURN NULL;\n'
+            f'    END IF;\n'
+            f"    IF TG_OP IN ('UPDATE', 'DELETE') THEN\n"
+            f'        DELETE FROM {qn(guard)} WHERE ({names}) = ({old});\n'
+            f'    END IF;\n'
+            f"    IF TG_OP IN ('INSERT', 'UPDATE') AND {' AND '.join(f'NEW.{qn(name)} IS NOT NULL' for name in columns)} THEN\n"
+            f'        INSERT INTO {qn(guard)} ({names}) VALUES ({new});\n'
+            f'    END IF;\n'
+            f'    RETURN NULL;\n'
+            f'END\n'
+            f'$$'
+        )
+        cursor.execute(
+            f'CREATE TRIGGER {qn(guard)} AFTER INSERT OR UPDATE OF {names} OR DELETE ON {qn(table)} '
+            f'FOR EACH ROW EXECUTE FUNCTION {qn(guard)}()'
+        )
+        cursor.execute(
+            f'CREATE TRIGGER {qn(guard + "_truncate")} AFTER TRUNCATE ON {qn(table)} '
+            f'FOR EACH STATEMENT EXECUTE FUNCTION {qn(guard)}()'
+        )
+
+
+def drop_unique_guard(connection, table, columns):
+    qn = connection.ops.quote_name
+    guard = qn(guard_name(table, columns))
+    with connection.cursor() as cursor:
+        cursor.execute(f'DROP TRIGGER IF EXISTS {qn(guard_name(table, columns) + "_truncate")} ON {qn(table)}')
+        cursor.execute(f'DROP TRIGGER IF EXISTS {guard} ON {qn(table)}')
+        cursor.execute(f'DROP FUNCTION IF EXISTS {guard}()')
+        cursor.execute(f'DROP TABLE IF EXISTS {guard}')
+
+
+def _create_partition(cursor, qn, table, month):
+    lower, upper = _bounds(month)
+    cursor.execute(
+        f'CREATE TABLE {qn(partition_name(table, month))} PARTITION OF {qn(table)} '
+        f'FOR VALUES FROM ({lower}) TO ({upper})'
+    )
+
+
+def list_partitions(connection, table):
+    """Return ``{month: partition name}`` for the monthly partitions of ``table``."""
+    with connection.cursor() as cursor:
+        cursor.execute(
+            "SELECT c.relname FROM pg_inherits i JOIN pg_class c ON c.oid = i.inhrelid "
+            "WHERE i.inhparent = %s::regclass",
+            [table],
+        )
+        names = [row[0] for row in cursor.fetchall()]
+
+    partitions = {}
+    for name in names:
+        match = PARTITION_NAME.search(name)
+        if match:
+            partitions[date(int(match.group(1)), int(match.group(2)), 1)] = name
+    return partitions
+
+
+def ensure_partitions(connection, table, column, months_ahead=3):
+    """Create missing partitions up to ``months_ahead`` months from now."""
+    qn = connection.ops.quote_name
+    default = qn(f'{table}_default')
+    existing = list_partitions(connection, table)
+    created = []
+
+    month = month_start(date.today())
+    if existing:
+        month = min(month, max(existing))
+    end = add_months(month_start(date.today()), months_ahead)
+
+    with connection.cursor() as cursor:
+        while month <= end:
+            if month not in existing:
+                lower, upper = _bounds(month)
+                cursor.execute(
+                    f'SELECT EXISTS (SELECT 1 FROM {default} '
+                    f'WHERE {qn(column)} >= {lower} AND {qn(column)} < {upper})'
+                )
+                if cursor.fetchone()[0]:
+                    # Rows for this month were routed to the default
+                    # partition; move them into the new one.
+                    with transaction.atomic(using=connection.alias):
+                        cursor.execute(f'ALTER TABLE {qn(table)} DETACH PARTITION {default}')
+                        _create_partition(cursor, qn, table, month)
+                        # The moved rows are already in the unique guards
+                        cursor.execute('SELECT set_config(%s, %s, true)', [MOVING_SETTING, 'on'])
+                        cursor.execute(
+                            f'WITH moved AS (DELETE FROM {default} '
+                            f'WHERE {qn(column)} >= {lower} AND {qn(column)} < {upper} RETURNING *) '
+                            f'INSERT INTO {qn(table)} SELECT * FROM moved'
+                        )
+                        cursor.execute('SELECT set_config(%s, %s, true)', [MOVING_SETTING, 'off'])
+                        cursor.execute(f'ALTER TABLE {qn(table)} ATTACH PARTITION {default} DEFAULT')
+                else:
+                    _create_partition(cursor, qn, table, month)
+                created.append(partition_name(table, month))
+            month = add_months(month, 1)
+    return created
+
+
+def detach_partitions(connection, table, before, drop=False):
+    """Detach (and optionally drop) partitions for months before ``before``."""
+    qn = connection.ops.quote_name
+    detached = []
+
+    with connection.cursor() as cursor:
+        for month, name in sorted(list_partitions(connection, table).items()):
+            if month >= month_start(before):
+                continue
+            cursor.execute(f'ALTER TABLE {qn(table)} DETACH PARTITION {qn(name)}')
+            if drop:
+                cursor.execute(f'DROP TABLE {qn(name)}')
+            detached.append(name)
+    return detached
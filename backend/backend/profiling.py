@@ -0,0 +1,281 @@
+"""
+On-demand request profiling.
+
+With ``PROFILING_ENABLED`` an admin can add ``?_profile=1`` to any
+request. The response body is then replaced by a JSON report of the
+request. The report holds the top functions by cumulative time and
+every query with its timing; the slowest queries come with their
+``EXPLAIN`` plans. Queries from the report query pool are included.
+``?_profile=sample`` uses a stack sampler instead of cProfile. The
+sampler barely slows the request down and returns collapsed stacks
+("a;b;c count" lines) that flame graph tools read directly. When
+``PROFILING_DIR`` is set, each profile is also written there: the
+cProfile data as ``.prof`` (pstats, snakeviz), the stacks as
+``.collapsed`` and the report as ``.json``.
+
+One request per process is profiled at a time. Only the thread that
+runs the view is profiled, so work on other threads only shows as time
+spent waiting; under ASGI that is the event loop thread, and sync views
+show up as the wait for their worker thread. Queries are timed by a
+``backend.querytiming.QueryTimer`` and are complete either way. For
+everyone else the parameter is ignored, and with profiling disabled the
+middleware is not loaded at all.
+"""
+import cProfile
+import io
+import json
+import pstats
+import sys
+import threading
+import time
+from collections import Counter
+from contextlib import contextmanager
+from pathlib import Path
+from asgiref.sync import iscoroutinefunction, markcoroutinefunction, sync_to_async
+from django.conf import settings
+from django.core.exceptions import MiddlewareNotUsed
+from django.core.serializers.json import DjangoJSONEncoder
+from django.db import connections
+from django.http import JsonResponse
+from django.utils import timezone
+from rest_framework.exceptions import APIException
+from rest_framework.request import Request
+from rest_framework.settings import api_settings
+from .querytiming import QueryTimer
+
+PARAMETER = '_profile'
+SAMPLE_INTERVAL = 0.005
+TOP_FUNCTIONS = 60
+TOP_STATEMENTS = 10
+EXPLAINABLE = ('SELECT', 'WITH')
+
+timer = QueryTimer('profiling')
+_running = threading.Lock()
+
+
+class QueryLog:
+    """Every query of a profiled request, with parameters kept for EXPLAIN."""
+    
+    def __init__(self):
+        self.queries = []
+        self._lock = threading.Lock()
+    
+    def record(self, alias, sql, params, many, seconds):
+        with self._lock:
+            self.queries.append((alias, sql, params, many, seconds))
+
+
+class StackSampler:
+    """Samples one thread's stack every ``interval`` seconds from a helper thread."""
+    
+    def __init__(self, thread_id, interval=SAMPLE_INTERVAL):
+        self.thread_id = thread_id
+        self.interval = interval
+        self.stacks = Counter()
+        self._stop = threading.Event()
+        self._thread = threading.Thread(target=self._run, name='profile-sampler', daemon=True)
+    
+    def start(self):
+        self._thread.start()
+    
+    def stop(self):
+        self._stop.set()
+        self._thread.join()
+    
+    def _run(self):
+        while not self._stop.wait(self.interval):
+            frame = sys._current_frames().get(self.thread_id)
+            names = []
+            while frame is not None:
+                code = frame.f_code
+                names.append(f"{frame.f_globals.get('__name__', '?')}.{getattr(code, 'co_qualname', code.co_name)}")
+                frame = frame.f_back
+            if names:
+                self.stacks[';'.join(reversed(names))] += 1
+    
+    def collapsed(self):
+        return '\n'.join(f'{stack} {count}' for stack, count in self.stacks.most_common())
+
+
+def is_allowed(request):
+    """
+    Whether the request carries an admin's credentials. The outcome is
+    handed on to the view, which then does not authenticate again.
+    """
+    drf_request = Request(request, authenticators=[auth() for auth in api_settings.DEFAULT_AUTHENTICATION_CLASSES])
+    try:
+        user = drf_request.user
+    except APIException:
+        return False
+    if not user.is_authenticated:
+        return False
+    # DRF's Request uses these instead of running its authenticators
+    request._force_auth_user, request._force_auth_token = user, drf_request.auth
+    return user.is_superuser or getattr(user, 'is_admin', False)
+
+
+def explain(alias, sql, params):
+    """The plan of a query as text, or the reason there is none."""
+    if not sql.lstrip().upper().startswith(EXPLAINABLE):
+        return None
+    try:
+        with connections[alias].cursor() as cursor:
+            cursor.execute(f'EXPLAIN {sql}', params)
+            return '\n'.join(row[0] for row in cursor.fetchall())
+    except Exception as exc:
+        return f'EXPLAIN failed: {exc}'
+
+
+def query_report(log):
+    queries = log.queries
+    statements = {}
+    for alias, sql, params, many, seconds in queries:
+        count, total = statements.get(sql, (0, 0.0))
+        statements[sql] = (count + 1, total + seconds)
+    slowest = sorted(queries, key=lambda query: query[4], reverse=True)[:settings.PROFILING_EXPLAIN_QUERIES]
+    return {
+        'count': len(queries),
+        'seconds': round(sum(query[4] for query in queries), 6),
+        'slowest': [
+            {
+                'alias': alias,
+                'sql': sql,
+                'seconds': round(seconds, 6),
+                'plan': None if many else explain(alias, sql, params),
+            }
+            for alias, sql, params, many, seconds in slowest
+        ],
+        'repeated': [
+            {'sql': sql, 'count': count, 'seconds': round(total, 6)}
+            for sql, (count, total) in sorted(statements.items(), key=lambda item: item[1][1], reverse=True)[:TOP_STATEMENTS]
+            if count > 1
+        ],
+        'statements': [
+            {'sql': sql, 'seconds': round(seconds, 6)}
+            for alias, sql, params, many, seconds in queries
+        ],
+    }
+
+
+def save(report, profile=None, sampler=None):
+    """Write the profile files to ``PROFILING_DIR``; returns their names."""
+    directory = Path(settings.PROFILING_DIR)
+    directory.mkdir(parents=True, exist_ok=True)
+    view = (report['view'] or 'unresolved').replace(':', '-').replace('/', '-')
+    stem = f"{timezone.now():%Y%m%dT%H%M%S%f}-{report['method'].lower()}-{view}"
+    names = []
+    if profile is not None:
+        profile.dump_stats(directory / f'{stem}.prof')
+        names.append(f'{stem}.prof')
+    if sampler is not None:
+        (directory / f'{stem}.collapsed').write_text(sampler.collapsed() + '\n')
+        names.append(f'{stem}.collapsed')
+    names.append(f'{stem}.json')
+    report['files'] = names
+    (directory / f'{stem}.json').write_text(json.dumps(report, indent=2, cls=DjangoJSONEncoder))
+    return names
+
+
+class ProfiledRequest:
+    """One ``?_profile`` request: its profiler, query log and report."""
+    
+    def __init__(self, request, mode):
+        # Views that validate their query parameters should not see ours
+        request.GET = request.GET.copy()
+        del request.GET[PARAMETER]
+        self.request = request
+        self.log = QueryLog()
+        self.sampler = StackSampler(threading.get_ident()) if mode == 'sample' else None
+        self.profile = cProfile.Profile() if self.sampler is None else None
+        self.seconds = None
+    
+    @contextmanager
+    def running(self):
+        started = time.perf_counter()
+        if self.sampler is not None:
+            self.sampler.start()
+        else:
+            self.profile.enable()
+        try:
+            with timer.collecting(self.log):
+                yield
+        finally:
+            if self.sampler is not None:
+                self.sampler.stop()
+            else:
+                self.profile.disable()
+            self.seconds = time.perf_counter() - started
+    
+    def report(self, response):
+        """The report replacing ``response``."""
+        match = self.request.resolver_match
+        report = {
+            'method': self.request.method,
+            'path': self.request.get_full_path(),
+            'view': match.view_name if match else None,
+            'status': response.status_code,
+            'seconds': round(self.seconds, 6),
+            'profiled_at': timezone.now(),
+            'mode': 'sample' if self.sampler is not None else 'cprofile',
+            'queries': query_report(self.log),
+        }
+        if self.profile is not None:
+            output = io.StringIO()
+            pstats.Stats(self.profile, stream=output).sort_stats('cumulative').print_stats(TOP_FUNCTIONS)
+            report['functions'] = output.getvalue()
+        else:
+            report['samples'] = sum(self.sampler.stacks.values())
+            report['collapsed'] = self.sampler.collapsed()
+        if settings.PROFILING_DIR:
+            save(report, self.profile, self.sampler)
+        return JsonResponse(report, encoder=DjangoJSONEncoder)
+
+
+def busy():
+    return JsonResponse({'error': 'Another request is being profiled, try again shortly'}, status=409)
+
+
+class ProfilingMiddleware:
+    """Profiles ``?_profile=1`` requests of admins; see the module docstring."""
+    
+    sync_capable = True
+    async_capable = True
+    
+    def __init__(self, get_response):
+        if not settings.PROFILING_ENABLED:
+            raise MiddlewareNotUsed
+        self.get_response = get_response
+        self.async_mode = iscoroutinefunction(get_response)
+        if self.async_mode:
+            markcoroutinefunction(self)
+        timer.install()
+    
+    def __call__(self, request):
+        if self.async_mode:
+            return self.__acall__(request)
+        mode = request.GET.get(PARAMETER)
+        if mode is None or not is_allowed(request):
+            return self.get_response(request)
+        if not _running.acquire(blocking=False):
+            return busy()
+        try:
+            profiled = ProfiledRequest(request, mode)
+            with profiled.running():
+                response = self.get_response(request)
+            return profiled.report(response)
+        finally:
+            _running.release()
+    
+    async def __acall__(self, request):
+        mode = request.GET.get(PARAMETER)
+        if mode is None or not await sync_to_async(is_allowed)(request):
+            return await self.get_response(request)
+        if not _running.acquire(blocking=False):
+            return busy()
+        try:
+            profiled = ProfiledRequest(request, mode)
+            with profiled.running():
+                response = await self.get_response(request)
+            return await sync_to_async(profiled.report)(response)
+        finally:
+            _running.release()
@@ -10,6 +10,7 @@ For the full list of settings and their values, see
 https://docs.djangoproject.com/en/6.0/ref/settings/
 """
 
+import os
 from pathlib import Path
 from datetime import timedelta
 from decouple import config
@@ -39,6 +40,7 @@ INSTALLED_APPS = [
     'django.contrib.sessions',
     'django.contrib.messages',
     'django.contrib.staticfiles',
+    'django.contrib.postgres',
 
     # Third party apps
     'rest_framework',
@@ -56,6 +58,7 @@ INSTALLED_APPS = [
 ]
 
 MIDDLEWARE = [
+    'backend.metrics.QueryMetricsMiddleware',
     'django.middleware.security.SecurityMiddleware',
     'django.contrib.sessions.middleware.SessionMiddleware',
     'django.middleware.common.CommonMiddleware',
@@ -63,6 +66,7 @@ MIDDLEWARE = [
     'django.contrib.auth.middleware.AuthenticationMiddleware',
     'django.contrib.messages.middleware.MessageMiddleware',
     'django.middleware.clickjacking.XFrameOptionsMiddleware',
+    'backend.profiling.ProfilingMiddleware',
 ]
 
 ROOT_URLCONF = 'backend.urls'
@@ -97,10 +101,49 @@ DATABASES = {
         'PASSWORD': config('DB_PASSWORD', default='postgres'),
         'HOST': config('DB_HOST', default='localhost'),
         'PORT': config('DB_PORT', default='5432'),
+        'CONN_MAX_AGE': config('DB_CONN_MAX_AGE', default=60, cast=int),
+        'CONN_HEALTH_CHECKS': True,
     }
 }
 
 
+# Cache
+# Point CACHE_BACKEND/CACHE_LOCATION at a shared cache (e.g. Redis) when
+# running more than one worker process. Report results are invalidated
+# through this cache, so a per-process cache fails the system checks
+# unless DEBUG is on.
+
+CACHES = {
+    'default': {
+        'BACKEND': config('CACHE_BACKEND', default='django.core.cache.backends.locmem.LocMemCache'),
+        'LOCATION': config('CACHE_LOCATION', default='medixhub'),
+    }
+}
+
+
+# Password hashing
+# The first hasher is used for new passwords; passwords stored with any
+# other hasher or iteration count are rehashed on the next login.
+
+PASSWORD_HASHERS = [
+    config('PASSWORD_HASHER', default='users.hashing.PBKDF2PasswordHasher'),
+    'django.contrib.auth.hashers.PBKDF2PasswordHasher',
+    'django.contrib.auth.hashers.PBKDF2SHA1PasswordHasher',
+    'django.contrib.auth.hashers.Argon2PasswordHasher',
+    'django.contrib.auth.hashers.BCryptSHA256PasswordHasher',
+    'django.contrib.auth.hashers.ScryptPasswordHasher',
+]
+
+# PBKDF2 iterations for users.hashing.PBKDF2PasswordHasher (0 keeps Django's default)
+PASSWORD_HASH_ITERATIONS = config('PASSWORD_HASH_ITERATIONS', default=0, cast=int)
+
+# Password checks and hashing run on a pool of PASSWORD_HASH_WORKERS threads
+# (0 hashes on the request thread); once PASSWORD_HASH_QUEUE_SIZE more are
+# waiting, further logins get a 503
+PASSWORD_HASH_WORKERS = config('PASSWORD_HASH_WORKERS', default=os.cpu_count() or 2, cast=int)
+PASSWORD_HASH_QUEUE_SIZE = config('PASSWORD_HASH_QUEUE_SIZE', default=64, cast=int)
+
+
 # Password validation
 # https://docs.djangoproject.com/en/6.0/ref/settings/#auth-password-validators
 
@@ -149,7 +192,7 @@ AUTH_USER_MODEL = 'users.User'
 # REST Framework Configuration
 REST_FRAMEWORK = {
     'DEFAULT_AUTHENTICATION_CLASSES': (
-        'rest_framework_simplejwt.authentication.JWTAuthentication',
+        'users.authentication.CachedJWTAuthentication',
     ),
     'DEFAULT_PERMISSION_CLASSES': (
         'rest_framework.permissions.IsAuthenticated',
@@ -161,8 +204,31 @@ REST_FRAMEWORK = {
         'rest_framework.filters.SearchFilter',
         'rest_framework.filters.OrderingFilter',
     ),
+    'DEFAULT_THROTTLE_CLASSES': (
+        'users.throttling.UserBucketThrottle',
+        'users.throttling.ScopedBucketThrottle',
+    ),
+    # Token buckets: `num/period` refills num tokens per period with room
+    # for a burst of num. `<scope>.<role>` overrides a scope for one role.
+    'DEFAULT_THROTTLE_RATES': {
+        'anon': '60/min',
+        'user': '600/min',
+        'user.admin': '1200/min',
+        'auth': '10/min',
+        'pos': '300/min',
+        'reports': '20/min',
+        'reports.admin': '60/min',
+    },
+    # Reverse proxies in front of the app. Anonymous requests are throttled
+    # by client IP, taken from X-Forwarded-For only this many hops back;
+    # 0 uses the socket address and ignores the header.
+    'NUM_PROXIES': config('NUM_PROXIES', default=0, cast=int),
 }
 
+# Where throttle buckets live: LocalBucketStore limits each worker process
+# on its own, CacheBucketStore shares buckets through the default cache
+THROTTLE_STORE = config('THROTTLE_STORE', default='users.throttling.LocalBucketStore')
+
 # JWT Settings
 SIMPLE_JWT = {
     'ACCESS_TOKEN_LIFETIME': timedelta(hours=1),
@@ -174,8 +240,18 @@ SIMPLE_JWT = {
     'AUTH_HEADER_TYPES': ('Bearer',),
     'USER_ID_FIELD': 'id',
     'USER_ID_CLAIM': 'user_id',
+    'TOKEN_OBTAIN_SERIALIZER': 'users.serializers.RoleTokenObtainPairSerializer',
+    'TOKEN_REFRESH_SERIALIZER': 'users.serializers.VersionedTokenRefreshSerializer',
 }
 
+# Seconds an authenticated user row is served from the cache
+AUTH_USER_CACHE_TTL = config('AUTH_USER_CACHE_TTL', default=60, cast=int)
+
+# Minimum seconds between checks for revocations made by other processes
+# (0 checks on every request). Checks read a version from the shared
+# cache; with a per-process cache they query the RevokedToken table.
+TOKEN_REVOCATION_SYNC_INTERVAL = config('TOKEN_REVOCATION_SYNC_INTERVAL', default=5, cast=float)
+
 # CORS Settings
 CORS_ALLOWED_ORIGINS = [
     "http://localhost:3000",
@@ -197,5 +273,51 @@ TWILIO_ACCOUNT_SID = config('TWILIO_ACCOUNT_SID', default='')
 TWILIO_AUTH_TOKEN = config('TWILIO_AUTH_TOKEN', default='')
 TWILIO_PHONE_NUMBER = config('TWILIO_PHONE_NUMBER', default='')
 
+# Link emailed to imported patients; {uid} and {token} are filled in
+PATIENT_INVITE_URL = config('PATIENT_INVITE_URL', default='http://localhost:3000/accept-invite/{uid}/{token}/')
+# Seconds an invite link stays valid (default 30 days)
+PATIENT_INVITE_TIMEOUT = config('PATIENT_INVITE_TIMEOUT', default=60 * 60 * 24 * 30, cast=int)
+
+# Square profile picture thumbnails rendered on upload ({name: pixels})
+PROFILE_THUMBNAIL_SIZES = {'small': 64, 'medium': 256}
+PROFILE_THUMBNAIL_FORMAT = 'WEBP'
+PROFILE_THUMBNAIL_WORKERS = config('PROFILE_THUMBNAIL_WORKERS', default=2, cast=int)
+
 # Low Stock Alert Threshold
-LOW_STOCK_THRESHOLD = 20
\ No newline at end of file
+LOW_STOCK_THRESHOLD = 20
+
+# Counters kept per top-sellers summary; reported counts overestimate by
+# at most (total quantity in the window) / TOP_SELLERS_CAPACITY
+TOP_SELLERS_CAPACITY = 200
+
+# With REPORT_CONCURRENT_QUERIES, report sub-queries (dashboard sections,
+# sales report parts) run in parallel on a pool of REPORT_QUERY_WORKERS
+# threads, each opening its own database connection for the run. Off by
+# default: each report then briefly needs several connections at once.
+REPORT_CONCURRENT_QUERIES = config('REPORT_CONCURRENT_QUERIES', default=False, cast=bool)
+REPORT_QUERY_WORKERS = config('REPORT_QUERY_WORKERS', default=8, cast=int)
+
+# Closed sales months older than SALES_ARCHIVE_AFTER_MONTHS are moved to
+# compressed Parquet files under SALES_ARCHIVE_DIR by `archive_sales`
+SALES_ARCHIVE_DIR = config('SALES_ARCHIVE_DIR', default=str(BASE_DIR / 'archive'))
+SALES_ARCHIVE_AFTER_MONTHS = config('SALES_ARCHIVE_AFTER_MONTHS', default=24, cast=int)
+
+# Per-view query metrics (backend.metrics). QUERY_METRICS_SAMPLE_RATE of
+# the requests are measured; 0 turns the instrumentation off. Sampled
+# requests running more queries than their view's budget are logged.
+# /internal/metrics/ serves Prometheus metrics to METRICS_TOKEN bearers.
+QUERY_METRICS_SAMPLE_RATE = config('QUERY_METRICS_SAMPLE_RATE', default=0.0, cast=float)
+QUERY_BUDGET_DEFAULT = config('QUERY_BUDGET_DEFAULT', default=50, cast=int)
+QUERY_BUDGETS = {
+    # view name -> queries
+}
+METRICS_TOKEN = config('METRICS_TOKEN', default='')
+
+# On-demand profiling (backend.profiling): with PROFILING_ENABLED, admins
+# add ?_profile=1 (cProfile) or ?_profile=sample (stack sampler) to a
+# request to get a profile with SQL timings and the EXPLAIN plans of the
+# PROFILING_EXPLAIN_QUERIES slowest queries. Profiles are also written to
+# PROFILING_DIR when it is set.
+PROFILING_ENABLED = config('PROFILING_ENABLED', default=False, cast=bool)
+PROFILING_DIR = config('PROFILING_DIR', default='')
+PROFILING_EXPLAIN_QUERIES = config('PROFILING_EXPLAIN_QUERIES', default=5, cast=int)
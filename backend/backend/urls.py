@@ -3,20 +3,24 @@ from django.urls import path, include
 from django.conf import settings
 from django.conf.urls.static import static
 from rest_framework.routers import DefaultRouter
-from rest_framework_simplejwt.views import TokenObtainPairView, TokenRefreshView
+from .metrics import metrics_view
 
 # Import ViewSets
-from users.views import UserViewSet
+from users.views import UserViewSet, DuplicateCandidateViewSet, LoginView, RefreshView, LogoutView, AcceptInviteView
 from inventory.views import CategoryViewSet, ManufacturerViewSet, DrugViewSet, StockTransactionViewSet
 from prescriptions.views import PrescriptionViewSet
 from sales.views import SaleViewSet, PaymentHistoryViewSet
-from reports.views import DashboardView, InventoryReportView, SalesReportView
+from reports.views import (
+    DashboardView, InventoryReportView, SalesReportView, SalesTimeSeriesView, SalesHistoryView, ReportJobViewSet,
+    async_dashboard_view, async_sales_report_view
+)
 
 # Create router
 router = DefaultRouter()
 
 # Register routes
 router.register(r'users', UserViewSet, basename='user')
+router.register(r'duplicate-candidates', DuplicateCandidateViewSet, basename='duplicate-candidate')
 router.register(r'categories', CategoryViewSet, basename='category')
 router.register(r'manufacturers', ManufacturerViewSet, basename='manufacturer')
 router.register(r'drugs', DrugViewSet, basename='drug')
@@ -24,22 +28,32 @@ router.register(r'stock-transactions', StockTransactionViewSet, basename='stock-
 router.register(r'prescriptions', PrescriptionViewSet, basename='prescription')
 router.register(r'sales', SaleViewSet, basename='sale')
 router.register(r'payment-history', PaymentHistoryViewSet, basename='payment-history')
+router.register(r'reports/jobs', ReportJobViewSet, basename='report-job')
 
 urlpatterns = [
     # Admin
     path('admin/', admin.site.urls),
     
     # Authentication
-    path('api/auth/login/', TokenObtainPairView.as_view(), name='token_obtain_pair'),
-    path('api/auth/refresh/', TokenRefreshView.as_view(), name='token_refresh'),
+    path('api/auth/login/', LoginView.as_view(), name='token_obtain_pair'),
+    path('api/auth/refresh/', RefreshView.as_view(), name='token_refresh'),
+    path('api/auth/logout/', LogoutView.as_view(), name='token_logout'),
+    path('api/auth/accept-invite/', AcceptInviteView.as_view(), name='accept-invite'),
     
     # Reports
     path('api/reports/dashboard/', DashboardView.as_view(), name='dashboard'),
     path('api/reports/inventory/', InventoryReportView.as_view(), name='inventory-report'),
     path('api/reports/sales/', SalesReportView.as_view(), name='sales-report'),
+    path('api/reports/sales/timeseries/', SalesTimeSeriesView.as_view(), name='sales-timeseries'),
+    path('api/reports/sales/history/', SalesHistoryView.as_view(), name='sales-history'),
+    path('api/reports/async/dashboard/', async_dashboard_view, name='async-dashboard'),
+    path('api/reports/async/sales/', async_sales_report_view, name='async-sales-report'),
     
     # API routes
     path('api/', include(router.urls)),
+    
+    # Monitoring
+    path('internal/metrics/', metrics_view, name='metrics'),
 ]
 
 # Serve media files in development
@@ -3,3 +3,7 @@ from django.apps import AppConfig
 
 class InventoryConfig(AppConfig):
     name = 'inventory'
+    
+    def ready(self):
+        from . import signals
+        signals.connect()
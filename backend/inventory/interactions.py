@@ -0,0 +1,139 @@
+"""
+Drug interaction and duplicate-therapy checks.
+
+Interaction pairs are held in a per-process dict keyed by the ordered pair
+of normalized generic names, so a check is a handful of dict lookups and
+never touches the database. The dict is rebuilt lazily when the version
+stored under ``INDEX_VERSION_KEY`` in the shared cache changes, which
+happens whenever a ``DrugInteraction`` is saved, deleted or bulk imported.
+"""
+import re
+import threading
+import time
+from itertools import combinations
+from django.core.cache import cache
+
+INDEX_VERSION_KEY = 'inventory:interactions_version'
+
+# Findings at these severities must be acknowledged before saving
+BLOCKING_SEVERITIES = ('MAJOR', 'CONTRAINDICATED')
+DUPLICATE_SEVERITY = 'MODERATE'
+SEVERITY_RANK = {'CONTRAINDICATED': 0, 'MAJOR': 1, 'MODERATE': 2, 'MINOR': 3}
+
+_COMPONENT_SEPARATORS = re.compile(r'\s*[/+,]\s*|\s+and\s+')
+
+_index = {}
+_index_version = None
+_index_lock = threading.Lock()
+
+
+def normalize_generic(name):
+    return ' '.join((name or '').lower().split())
+
+
+def generic_components(drug):
+    """Normalized generic names making up ``drug`` (combination products have several)."""
+    names = _COMPONENT_SEPARATORS.split(normalize_generic(drug.generic_name or drug.name))
+    return frozenset(name for name in names if name)
+
+
+def index_version():
+    return cache.get_or_set(INDEX_VERSION_KEY, time.time_ns(), timeout=None)
+
+
+def invalidate_index():
+    """Make every process rebuild its interaction index on next use."""
+    try:
+        cache.incr(INDEX_VERSION_KEY)
+    except ValueError:
+        cache.set(INDEX_VERSION_KEY, time.time_ns(), timeout=None)
+
+
+def get_index():
+    """``{(generic_a, generic_b): (severity, description)}`` for the current version."""
+    global _index, _index_version
+    version = index_version()
+    if version == _index_version:
+        return _index
+
+    with _index_lock:
+        if version != _index_version:
+            from .models import DrugInteraction
+            _index = {
+                (a, b): (severity, description)
+                for a, b, severity, description in DrugInteraction.objects.values_list(
+                    'generic_a', 'generic_b', 'severity', 'description'
+                ).iterator()
+            }
+            _index_version = version
+    return _index
+
+
+def check_interactions(drugs, existing=()):
+    """
+    Interactions and duplicate therapies among ``drugs`` and between
+    ``drugs`` and ``existing`` (drugs the patient is already taking).
+
+    Returns a list of findings, most severe first.
+    """
+    index = get_index()
+    drugs = list({drug.pk: drug for drug in drugs}.values())
+    new_ids = {drug.pk for drug in drugs}
+    existing = [drug for drug in {drug.pk: drug for drug in existing}.values() if drug.pk not in new_ids]
+    components = {drug.pk: generic_components(drug) for drug in drugs + existing}
+
+    pairs = list(combinations(drugs, 2)) + [(new, old) for new in drugs for old in existing]
+    findings = []
+    for first, second in pairs:
+        shared = components[first.pk] & components[second.pk]
+        if shared:
+            findings.append(_finding(
+                'DUPLICATE_THERAPY', DUPLICATE_SEVERITY, first, second,
+                f"Both contain {', '.join(sorted(shared))}",
+            ))
+        for a in components[first.pk]:
+            for b in components[second.pk]:
+                hit = index.get((a, b) if a < b else (b, a))
+                if hit:
+                    findings.append(_finding('INTERACTION', hit[0], first, second, hit[1]))
+
+    findings.sort(key=lambda finding: SEVERITY_RANK[finding['severity']])
+    return findings
+
+
+def has_blocking(findings):
+    return any(finding['severity'] in BLOCKING_SEVERITIES for finding in findings)
+
+
+def active_patient_drugs(patient):
+    """Drugs on the patient's valid, not yet completed prescriptions."""
+    return active_drugs_by_patient([patient.pk]).get(patient.pk, [])
+
+
+def active_drugs_by_patient(patient_ids):
+    """``{patient_id: [Drug]}`` for many patients in one query."""
+    from django.db.models import F
+    from prescriptions.models import OPEN_STATUSES, Prescription
+    from .models import Drug
+    prescriptions = Prescription.objects.valid().filter(patient_id__in=patient_ids, status__in=OPEN_STATUSES)
+    drugs = (
+        Drug.objects.filter(prescription_items__prescription__in=prescriptions)
+        .annotate(patient_id=F('prescription_items__prescription__patient_id'))
+        .only('id', 'name', 'generic_name')
+        .distinct()
+    )
+    by_patient = {}
+    for drug in drugs:
+        by_patient.setdefault(drug.patient_id, []).append(drug)
+    return by_patient
+
+
+def _finding(kind, severity, first, second, description):
+    return {
+        'type': kind,
+        'severity': severity,
+        'drugs': [first.pk, second.pk],
+        'drug_names': [first.name, second.name],
+        'description': description,
+    }
+
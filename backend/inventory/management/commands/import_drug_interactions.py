@@ -0,0 +1,63 @@
+import csv
+import json
+from django.core.management.base import BaseCommand, CommandError
+from django.db import transaction
+from inventory.interactions import invalidate_index, normalize_generic
+from inventory.models import DrugInteraction
+
+SEVERITIES = {severity for severity, _ in DrugInteraction.SEVERITIES}
+
+
+class Command(BaseCommand):
+    help = 'Bulk load drug interaction pairs from a CSV or JSON Lines file.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('path', help='File with generic_a, generic_b, severity and description columns.')
+        parser.add_argument('--format', choices=['csv', 'jsonl'], default=None,
+                            help='Input format (default: guessed from the file extension).')
+        parser.add_argument('--source', default='',
+                            help='Dataset name stored on every imported row.')
+        parser.add_argument('--replace', action='store_true',
+                            help='Delete existing interactions before importing.')
+        parser.add_argument('--batch-size', type=int, default=5000)
+
+    def handle(self, *args, **options):
+        fmt = options['format'] or ('jsonl' if options['path'].endswith(('.jsonl', '.ndjson')) else 'csv')
+
+        pairs = {}
+        skipped = 0
+        with open(options['path'], newline='', encoding='utf-8') as handle:
+            rows = csv.DictReader(handle) if fmt == 'csv' else (json.loads(line) for line in handle if line.strip())
+            for row in rows:
+                a = normalize_generic(row.get('generic_a'))
+                b = normalize_generic(row.get('generic_b'))
+                severity = (row.get('severity') or '').strip().upper()
+                if not a or not b or a == b or severity not in SEVERITIES:
+                    skipped += 1
+                    continue
+                # Last row wins when a dataset lists the same pair twice
+                pairs[tuple(sorted((a, b)))] = DrugInteraction(
+                    generic_a=min(a, b),
+                    generic_b=max(a, b),
+                    severity=severity,
+                    description=row.get('description') or '',
+                    source=options['source'],
+                )
+
+        if not pairs:
+            raise CommandError('No valid interaction rows found')
+
+        with transaction.atomic():
+            if options['replace']:
+                DrugInteraction.objects.all().delete()
+            DrugInteraction.objects.bulk_create(
+                pairs.values(),
+                batch_size=options['batch_size'],
+                update_conflicts=True,
+                unique_fields=['generic_a', 'generic_b'],
+                update_fields=['severity', 'description', 'source', 'updated_at'],
+            )
+            # bulk_create bypasses signals
+            transaction.on_commit(invalidate_index)
+
+        self.stdout.write(f'Imported {len(pairs)} interaction(s), skipped {skipped} invalid row(s)')
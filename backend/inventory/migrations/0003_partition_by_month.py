@@ -0,0 +1,19 @@
+from django.db import migrations
+from backend.partitioning import convert_to_partitioned
+
+
+def partition_tables(apps, schema_editor):
+    if schema_editor.connection.vendor != 'postgresql':
+        return
+    convert_to_partitioned(schema_editor.connection, 'inventory_stocktransaction', 'created_at')
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('inventory', '0002_initial'),
+    ]
+
+    operations = [
+        migrations.RunPython(partition_tables),
+    ]
@@ -0,0 +1,30 @@
+# Generated by Django 6.0 on 2026-10-19 04:10
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('inventory', '0003_partition_by_month'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='DrugInteraction',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('generic_a', models.CharField(max_length=200)),
+                ('generic_b', models.CharField(max_length=200)),
+                ('severity', models.CharField(choices=[('MINOR', 'Minor'), ('MODERATE', 'Moderate'), ('MAJOR', 'Major'), ('CONTRAINDICATED', 'Contraindicated')], max_length=20)),
+                ('description', models.TextField(blank=True)),
+                ('source', models.CharField(blank=True, max_length=100)),
+                ('created_at', models.DateTimeField(auto_now_add=True)),
+                ('updated_at', models.DateTimeField(auto_now=True)),
+            ],
+            options={
+                'ordering': ['generic_a', 'generic_b'],
+                'constraints': [models.UniqueConstraint(fields=('generic_a', 'generic_b'), name='unique_drug_interaction_pair'), models.CheckConstraint(condition=models.Q(('generic_a__lt', models.F('generic_b'))), name='drug_interaction_pair_ordered')],
+            },
+        ),
+    ]
@@ -147,4 +147,41 @@ class StockTransaction(models.Model):
     
     def save(self, *args, **kwargs):
         self.total_amount = self.quantity * self.unit_price
-        super().save(*args, **kwargs)
\ No newline at end of file
+        super().save(*args, **kwargs)
+
+
+class DrugInteraction(models.Model):
+    """Known interaction between two generic drug names."""
+    
+    SEVERITIES = [
+        ('MINOR', 'Minor'),
+        ('MODERATE', 'Moderate'),
+        ('MAJOR', 'Major'),
+        ('CONTRAINDICATED', 'Contraindicated'),
+    ]
+    
+    # Normalized generic names, stored with generic_a < generic_b so each
+    # pair has exactly one row
+    generic_a = models.CharField(max_length=200)
+    generic_b = models.CharField(max_length=200)
+    severity = models.CharField(max_length=20, choices=SEVERITIES)
+    description = models.TextField(blank=True)
+    source = models.CharField(max_length=100, blank=True)
+    
+    created_at = models.DateTimeField(auto_now_add=True)
+    updated_at = models.DateTimeField(auto_now=True)
+    
+    class Meta:
+        ordering = ['generic_a', 'generic_b']
+        constraints = [
+            models.UniqueConstraint(fields=['generic_a', 'generic_b'], name='unique_drug_interaction_pair'),
+            models.CheckConstraint(condition=models.Q(generic_a__lt=models.F('generic_b')), name='drug_interaction_pair_ordered'),
+        ]
+    
+    def __str__(self):
+        return f"{self.generic_a} + {self.generic_b} ({self.severity})"
+    
+    def save(self, *args, **kwargs):
+        from .interactions import normalize_generic
+        self.generic_a, self.generic_b = sorted((normalize_generic(self.generic_a), normalize_generic(self.generic_b)))
+        super().save(*args, **kwargs)
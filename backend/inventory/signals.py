@@ -0,0 +1,13 @@
+from django.db import transaction
+from django.db.models.signals import post_save, post_delete
+from .interactions import invalidate_index
+from .models import DrugInteraction
+
+
+def invalidate_interaction_index(sender, **kwargs):
+    transaction.on_commit(invalidate_index)
+
+
+def connect():
+    post_save.connect(invalidate_interaction_index, sender=DrugInteraction, dispatch_uid='inventory-interaction-save')
+    post_delete.connect(invalidate_interaction_index, sender=DrugInteraction, dispatch_uid='inventory-interaction-delete')
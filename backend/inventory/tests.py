@@ -1,3 +1,153 @@
+import tempfile
+from datetime import date, timedelta
+from decimal import Decimal
+from pathlib import Path
+from django.core.cache import cache
+from django.core.management import CommandError, call_command
 from django.test import TestCase
+from rest_framework.test import APIClient
+from prescriptions.models import Prescription
+from prescriptions.tests import make_user
+from .interactions import check_interactions, has_blocking
+from .models import Drug, DrugInteraction
 
-# Create your tests here.
+
+def make_drug(name, generic_name, stock=50):
+    return Drug.objects.create(name=name, generic_name=generic_name, dosage_form='TABLET', strength='10mg',
+                               sku=name.upper(), quantity_in_stock=stock, unit_price=Decimal('1.00'),
+                               selling_price=Decimal('2.00'))
+
+
+class InteractionTestCase(TestCase):
+
+    def setUp(self):
+        cache.clear()
+        self.warfarin = make_drug('Coumadin', 'Warfarin')
+        self.aspirin = make_drug('Aspro', 'aspirin')
+        self.augmentin = make_drug('Augmentin', 'Amoxicillin / Clavulanic acid')
+        self.amoxil = make_drug('Amoxil', 'amoxicillin')
+        self.paracetamol = make_drug('Panadol', 'paracetamol')
+        DrugInteraction.objects.create(generic_a='warfarin', generic_b='Aspirin', severity='MAJOR',
+                                       description='Bleeding risk')
+        DrugInteraction.objects.create(generic_a='paracetamol', generic_b='warfarin', severity='MINOR',
+                                       description='Raised INR')
+
+
+class CheckInteractionsTests(InteractionTestCase):
+
+    def test_findings(self):
+        findings = check_interactions([self.aspirin, self.paracetamol], existing=[self.warfarin, self.aspirin])
+        self.assertEqual([(f['type'], f['severity'], f['drugs']) for f in findings], [
+            ('INTERACTION', 'MAJOR', [self.aspirin.pk, self.warfarin.pk]),
+            ('INTERACTION', 'MINOR', [self.paracetamol.pk, self.warfarin.pk]),
+        ])
+        self.assertTrue(has_blocking(findings))
+        self.assertFalse(has_blocking(findings[1:]))
+        self.assertEqual(check_interactions([self.paracetamol, self.aspirin]), [])
+    
+    def test_combination_products_are_duplicate_therapy(self):
+        findings = check_interactions([self.augmentin, self.amoxil])
+        self.assertEqual([(f['type'], f['severity'], f['description']) for f in findings],
+                         [('DUPLICATE_THERAPY', 'MODERATE', 'Both contain amoxicillin')])
+        self.assertFalse(has_blocking(findings))
+    
+    def test_index_follows_changes(self):
+        self.assertEqual(check_interactions([self.amoxil, self.paracetamol]), [])
+        with self.captureOnCommitCallbacks(execute=True):
+            interaction = DrugInteraction.objects.create(generic_a='amoxicillin', generic_b='paracetamol',
+                                                         severity='CONTRAINDICATED')
+        self.assertTrue(has_blocking(check_interactions([self.amoxil, self.paracetamol])))
+        with self.captureOnCommitCallbacks(execute=True):
+            interaction.delete()
+        self.assertEqual(check_interactions([self.amoxil, self.paracetamol]), [])
+    
+    def test_import_command(self):
+        path = Path(tempfile.mkdtemp()) / 'interactions.csv'
+        path.write_text(
+            'generic_a,generic_b,severity,description\n'
+            'Paracetamol,Amoxicillin,minor,First\n'
+            'amoxicillin,paracetamol,contraindicated,Last row wins\n'
+            'aspirin,warfarin,moderate,Updated\n'
+            'aspirin,aspirin,major,Same drug\n'
+            'aspirin,ibuprofen,unknown,Bad severity\n'
+        )
+        with self.captureOnCommitCallbacks(execute=True):
+            call_command('import_drug_interactions', str(path), source='test', stdout=open('/dev/null', 'w'))
+        self.assertEqual(
+            list(DrugInteraction.objects.values_list('generic_a', 'generic_b', 'severity', 'description')),
+            [('amoxicillin', 'paracetamol', 'CONTRAINDICATED', 'Last row wins'),
+             ('aspirin', 'warfarin', 'MODERATE', 'Updated'),
+             ('paracetamol', 'warfarin', 'MINOR', 'Raised INR')],
+        )
+        self.assertTrue(has_blocking(check_interactions([self.amoxil, self.paracetamol])))
+        self.assertFalse(has_blocking(check_interactions([self.aspirin, self.warfarin])))
+    
+        path.write_text('generic_a,generic_b,severity,description\n')
+        with self.assertRaisesMessage(CommandError, 'No valid interaction rows found'):
+            call_command('import_drug_interactions', str(path))
+
+
+class InteractionBlockingTests(InteractionTestCase):
+
+    def setUp(self):
+        super().setUp()
+        self.doctor = make_user('doc@example.com', 'DOCTOR')
+        self.patient = make_user('pat@example.com', 'PATIENT')
+        self.pharmacist = make_user('ph@example.com', 'PHARMACIST')
+    
+    def client_for(self, user):
+        client = APIClient()
+        client.force_authenticate(user)
+        return client
+    
+    def prescribe(self, *drugs, acknowledge=False):
+        return self.client_for(self.doctor).post('/api/prescriptions/', {
+            'patient': self.patient.pk, 'doctor': self.doctor.pk, 'diagnosis': 'Test',
+            'valid_until': date.today() + timedelta(days=30), 'acknowledge_interactions': acknowledge,
+            'items': [{'drug': drug.pk, 'quantity': 1, 'dosage': '1 tablet', 'frequency': 'daily',
+                       'duration': '5 days'} for drug in drugs],
+        }, format='json')
+    
+    def sell(self, *drugs, prescription=None, acknowledge=False, customer=None):
+        return self.client_for(self.pharmacist).post('/api/sales/', {
+            'customer': (customer or self.patient).pk, 'prescription': prescription and prescription.pk,
+            'items': [{'drug_id': drug.pk, 'quantity': 1} for drug in drugs],
+            'amount_paid': '10.00', 'payment_method': 'CASH', 'acknowledge_interactions': acknowledge,
+        }, format='json')
+    
+    def test_prescribing_requires_acknowledgement(self):
+        self.assertEqual(self.prescribe(self.warfarin).status_code, 201)
+        response = self.prescribe(self.aspirin)
+        self.assertEqual(response.status_code, 400)
+        self.assertEqual([list(map(int, f['drugs'])) for f in response.data['interactions']],
+                         [[self.aspirin.pk, self.warfarin.pk]])
+        self.assertEqual(Prescription.objects.count(), 1)
+    
+        response = self.prescribe(self.aspirin, acknowledge=True)
+        self.assertEqual(response.status_code, 201)
+        self.assertEqual(response.data['interactions'][0]['severity'], 'MAJOR')
+        # Minor findings are reported without blocking
+        self.assertEqual(self.prescribe(self.paracetamol).status_code, 201)
+    
+    def test_counter_sales_require_acknowledgement(self):
+        self.prescribe(self.warfarin)
+        response = self.sell(self.aspirin)
+        self.assertEqual(response.status_code, 400)
+        self.assertEqual(response.data['interactions'][0]['severity'], 'MAJOR')
+        self.assertEqual(self.sell(self.aspirin, acknowledge=True).status_code, 201)
+    
+    def test_acknowledged_prescription_is_not_blocked_at_the_counter(self):
+        self.assertEqual(self.prescribe(self.warfarin, self.aspirin, acknowledge=True).status_code, 201)
+        prescription = Prescription.objects.get()
+        self.assertEqual(self.sell(self.warfarin, self.aspirin, prescription=prescription).status_code, 201)
+        # Drugs added at the counter are still checked
+        with self.captureOnCommitCallbacks(execute=True):
+            DrugInteraction.objects.create(generic_a='amoxicillin', generic_b='warfarin', severity='MAJOR')
+        response = self.sell(self.warfarin, self.aspirin, self.amoxil, prescription=prescription)
+        self.assertEqual(response.status_code, 400)
+        self.assertEqual([sorted(map(int, f['drugs'])) for f in response.data['interactions']],
+                         [sorted([self.warfarin.pk, self.amoxil.pk])])
+        # Someone else's prescription does not cover the basket
+        other = make_user('other@example.com', 'PATIENT')
+        self.assertEqual(self.sell(self.warfarin, self.aspirin, prescription=prescription, customer=other).status_code,
+                         400)
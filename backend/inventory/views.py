@@ -39,6 +39,7 @@ class DrugViewSet(viewsets.ModelViewSet):
     
     queryset = Drug.objects.all()
     permission_classes = [permissions.IsAuthenticated, IsAdminOrPharmacist]
+    throttle_scope = 'pos'
     filter_backends = [DjangoFilterBackend, SearchFilter, OrderingFilter]
     filterset_fields = ['category', 'manufacturer', 'dosage_form', 'prescription_required', 'is_active']
     search_fields = ['name', 'generic_name', 'brand_name', 'sku', 'barcode']
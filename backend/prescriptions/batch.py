@@ -0,0 +1,122 @@
+import uuid
+from django.contrib.auth import get_user_model
+from django.db import transaction
+from inventory.interactions import active_drugs_by_patient, check_interactions, has_blocking
+from inventory.models import Drug
+from .models import Prescription, PrescriptionItem
+from .relationships import apply_changes, link_state
+from .serializers import BatchPrescriptionSerializer
+
+User = get_user_model()
+
+MAX_BATCH_SIZE = 500
+
+
+def ingest_prescriptions(entries, user):
+    """
+    Validate and create many prescriptions at once.
+
+    Entries are shape-checked individually, then every patient, doctor and
+    drug reference in the batch is resolved with one query per entity type.
+    Valid entries are inserted with two ``bulk_create`` calls inside one
+    transaction; invalid ones are reported without affecting the rest.
+    Returns one result dict per entry, in input order.
+    """
+    results = [None] * len(entries)
+    parsed = []
+    for index, entry in enumerate(entries):
+        serializer = BatchPrescriptionSerializer(data=entry)
+        if not serializer.is_valid():
+            results[index] = _error(index, entry, serializer.errors)
+            continue
+        data = dict(serializer.validated_data)
+        if user.is_doctor:
+            if data.get('doctor', user.pk) != user.pk:
+                results[index] = _error(index, entry, {'doctor': ['Doctors can only submit their own prescriptions']})
+                continue
+            data['doctor'] = user.pk
+        elif 'doctor' not in data:
+            results[index] = _error(index, entry, {'doctor': ['This field is required.']})
+            continue
+        parsed.append((index, entry, data))
+
+    user_ids = {data['patient'] for _, _, data in parsed} | {data['doctor'] for _, _, data in parsed}
+    roles = dict(User.objects.filter(id__in=user_ids, is_active=True).values_list('id', 'role'))
+    drugs = Drug.objects.only('id', 'name', 'generic_name').in_bulk(
+        {item['drug'] for _, _, data in parsed for item in data['items']}
+    )
+    active_drugs = active_drugs_by_patient(
+        {data['patient'] for _, _, data in parsed if roles.get(data['patient']) == 'PATIENT'}
+    )
+
+    accepted = []
+    for index, entry, data in parsed:
+        errors = {}
+        if roles.get(data['patient']) != 'PATIENT':
+            errors['patient'] = [f"Patient {data['patient']} not found"]
+        if roles.get(data['doctor']) != 'DOCTOR':
+            errors['doctor'] = [f"Doctor {data['doctor']} not found"]
+        unknown = sorted({item['drug'] for item in data['items']} - set(drugs))
+        if unknown:
+            errors['items'] = [f'Drugs not found: {unknown}']
+
+        findings = []
+        if not errors:
+            prescribed = [drugs[item['drug']] for item in data['items']]
+            findings = check_interactions(prescribed, active_drugs.get(data['patient'], []))
+            if has_blocking(findings) and not data['acknowledge_interactions']:
+                errors['interactions'] = findings
+
+        if errors:
+            results[index] = _error(index, entry, errors)
+            continue
+
+        # Later entries in the same batch are checked against this one too
+        active_drugs.setdefault(data['patient'], []).extend(prescribed)
+        accepted.append((index, entry, data, findings))
+
+    with transaction.atomic():
+        prescriptions = Prescription.objects.bulk_create([
+            Prescription(
+                prescription_number=f"RX-{uuid.uuid4().hex[:8].upper()}",
+                patient_id=data['patient'],
+                doctor_id=data['doctor'],
+                diagnosis=data['diagnosis'],
+                notes=data['notes'],
+                valid_until=data['valid_until'],
+            )
+            for _, _, data, _ in accepted
+        ])
+        PrescriptionItem.objects.bulk_create([
+            PrescriptionItem(
+                prescription=prescription,
+                drug_id=item['drug'],
+                quantity=item['quantity'],
+                dosage=item['dosage'],
+                frequency=item['frequency'],
+                duration=item['duration'],
+                instructions=item['instructions'],
+            )
+            for prescription, (_, _, data, _) in zip(prescriptions, accepted)
+            for item in data['items']
+        ])
+        apply_changes([(None, link_state(prescription)) for prescription in prescriptions])
+
+    for prescription, (index, entry, _, findings) in zip(prescriptions, accepted):
+        results[index] = {
+            'index': index,
+            'reference': _reference(entry),
+            'status': 'created',
+            'id': prescription.pk,
+            'prescription_number': prescription.prescription_number,
+            'interactions': findings,
+        }
+    return results
+
+
+def _reference(entry):
+    return entry.get('reference') if isinstance(entry, dict) else None
+
+
+def _error(index, entry, errors):
+    return {'index': index, 'reference': _reference(entry), 'status': 'error', 'errors': errors}
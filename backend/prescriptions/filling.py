@@ -0,0 +1,119 @@
+from collections import defaultdict
+from django.db import transaction
+from django.utils import timezone
+from rest_framework import serializers
+from inventory.models import Drug, StockTransaction
+from .models import PrescriptionItem
+from .relationships import apply_changes, link_state
+
+
+def fill_prescription(prescription, fills, user):
+    """
+    Fill prescription items and move the matching stock atomically.
+
+    ``fills`` is a list of ``{'item_id', 'quantity_to_fill'}``. The
+    prescription, its items and their drugs are locked with a single
+    SELECT ... FOR UPDATE; all validation runs against the locked rows and
+    every write is a bulk statement, so the number of queries does not
+    depend on the number of items. Raises ``ValidationError`` without
+    writing anything if any part of the fill is invalid.
+    """
+    requested = defaultdict(int)
+    for fill in fills:
+        requested[fill['item_id']] += fill['quantity_to_fill']
+    if not requested:
+        raise serializers.ValidationError('At least one item is required')
+
+    with transaction.atomic():
+        # Ordering by drug keeps lock acquisition order consistent between
+        # concurrent fills that share drugs.
+        items = list(
+            PrescriptionItem.objects.filter(prescription_id=prescription.pk)
+            .select_related('prescription', 'drug')
+            .select_for_update(of=('self', 'prescription', 'drug'))
+            .order_by('drug_id', 'id')
+        )
+        if not items:
+            raise serializers.ValidationError('Prescription has no items')
+
+        prescription = items[0].prescription
+        _validate(prescription, items, requested)
+        before = link_state(prescription)
+
+        now = timezone.now()
+        stock_moves = defaultdict(int)
+        changed_items = []
+        for item in items:
+            quantity = requested.get(item.id)
+            if quantity:
+                item.quantity_filled += quantity
+                changed_items.append(item)
+                stock_moves[item.drug_id] += quantity
+
+        drugs = {item.drug_id: item.drug for item in changed_items}
+        for drug_id, quantity in stock_moves.items():
+            drugs[drug_id].quantity_in_stock -= quantity
+            drugs[drug_id].updated_at = now
+
+        PrescriptionItem.objects.bulk_update(changed_items, ['quantity_filled'])
+        Drug.objects.bulk_update(drugs.values(), ['quantity_in_stock', 'updated_at'])
+        StockTransaction.objects.bulk_create([
+            StockTransaction(
+                drug=drug,
+                transaction_type='SALE',
+                quantity=stock_moves[drug_id],
+                unit_price=drug.unit_price,
+                total_amount=stock_moves[drug_id] * drug.unit_price,
+                reference_number=prescription.prescription_number,
+                notes='Prescription fill',
+                performed_by=user,
+            )
+            for drug_id, drug in drugs.items()
+        ])
+
+        if all(item.is_fully_filled for item in items):
+            prescription.status = 'FILLED'
+            prescription.filled_date = now
+            prescription.filled_by = user
+        else:
+            prescription.status = 'PARTIALLY_FILLED'
+        prescription.save(update_fields=['status', 'filled_date', 'filled_by', 'updated_at'])
+        apply_changes([(before, link_state(prescription))])
+
+        # Bulk writes skip model signals, so invalidate cached reports here
+        from reports.jobs import bump_data_version
+        transaction.on_commit(bump_data_version)
+
+    return prescription, items
+
+
+def _validate(prescription, items, requested):
+    if prescription.status == 'CANCELLED':
+        raise serializers.ValidationError('Cannot fill cancelled prescription')
+    if prescription.status == 'FILLED':
+        raise serializers.ValidationError('Prescription is already filled')
+    if not prescription.is_valid:
+        raise serializers.ValidationError('Prescription is expired')
+
+    items_by_id = {item.id: item for item in items}
+    unknown = sorted(set(requested) - set(items_by_id))
+    if unknown:
+        raise serializers.ValidationError(
+            f"Items {unknown} do not belong to prescription {prescription.prescription_number}"
+        )
+
+    errors = []
+    needed = defaultdict(int)
+    for item_id, quantity in requested.items():
+        item = items_by_id[item_id]
+        if item.quantity_filled + quantity > item.quantity:
+            errors.append(f"Cannot fill more than prescribed quantity of {item.drug.name}")
+        needed[item.drug_id] += quantity
+
+    drugs = {item.drug_id: item.drug for item in items}
+    for drug_id, quantity in needed.items():
+        if drugs[drug_id].quantity_in_stock < quantity:
+            errors.append(f"Insufficient stock for {drugs[drug_id].name}")
+
+    if errors:
+        raise serializers.ValidationError(errors)
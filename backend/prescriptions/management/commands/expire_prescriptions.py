@@ -0,0 +1,44 @@
+from django.core.management.base import BaseCommand
+from django.db import transaction
+from django.utils import timezone
+from prescriptions.models import Prescription
+from prescriptions.relationships import LinkState, apply_changes
+
+
+class Command(BaseCommand):
+    help = 'Mark pending and partially filled prescriptions past valid_until as EXPIRED.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=1000,
+                            help='Number of prescriptions updated per statement.')
+        parser.add_argument('--dry-run', action='store_true',
+                            help='Only report how many prescriptions would expire.')
+
+    def handle(self, *args, **options):
+        today = timezone.now().date()
+        expired = Prescription.objects.expired(on=today)
+
+        if options['dry_run']:
+            self.stdout.write(f'{expired.count()} prescription(s) would expire')
+            return
+
+        total = 0
+        while True:
+            # Each batch is its own short transaction so the sweep never
+            # holds row locks on a large part of the table.
+            with transaction.atomic():
+                rows = list(
+                    expired.order_by('id').select_for_update(skip_locked=True)
+                    .values_list('id', 'doctor_id', 'patient_id', 'status', 'issue_date')[:options['batch_size']]
+                )
+                if not rows:
+                    break
+                total += Prescription.objects.filter(id__in=[row[0] for row in rows]).update(
+                    status='EXPIRED', updated_at=timezone.now()
+                )
+                apply_changes([
+                    (LinkState(*row[1:]), LinkState(*row[1:3], 'EXPIRED', row[4]))
+                    for row in rows
+                ])
+
+        self.stdout.write(f'Expired {total} prescription(s)')
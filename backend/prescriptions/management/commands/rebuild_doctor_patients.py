@@ -0,0 +1,12 @@
+from django.core.management.base import BaseCommand
+from django.db import transaction
+from prescriptions.relationships import rebuild
+
+
+class Command(BaseCommand):
+    help = 'Recompute the doctor-patient links and counters from prescriptions.'
+
+    def handle(self, *args, **options):
+        with transaction.atomic():
+            links = rebuild()
+        self.stdout.write(f'Rebuilt {links} doctor-patient link(s)')
@@ -0,0 +1,24 @@
+# Generated by Django 6.0 on 2026-10-19 04:08
+
+from django.conf import settings
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('prescriptions', '0002_initial'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name='prescription',
+            name='status',
+            field=models.CharField(choices=[('PENDING', 'Pending'), ('FILLED', 'Filled'), ('PARTIALLY_FILLED', 'Partially Filled'), ('CANCELLED', 'Cancelled'), ('EXPIRED', 'Expired')], default='PENDING', max_length=20),
+        ),
+        migrations.AddIndex(
+            model_name='prescription',
+            index=models.Index(fields=['status', 'valid_until'], name='prescriptio_status_6fd1f5_idx'),
+        ),
+    ]
@@ -0,0 +1,23 @@
+# Generated by Django 6.0 on 2026-10-19 04:12
+
+from django.conf import settings
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('prescriptions', '0003_prescription_expired_status'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='prescription',
+            index=models.Index(fields=['patient', '-issue_date', '-id'], include=('prescription_number', 'status'), name='prescription_patient_issued'),
+        ),
+        migrations.AddIndex(
+            model_name='prescription',
+            index=models.Index(condition=models.Q(('filled_date__isnull', False)), fields=['patient', '-filled_date', '-id'], include=('prescription_number', 'status'), name='prescription_patient_filled'),
+        ),
+    ]
@@ -0,0 +1,70 @@
+# Generated by Django 6.0 on 2026-10-19 04:13
+
+import django.db.models.deletion
+from django.conf import settings
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('prescriptions', '0004_timeline_indexes'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='DoctorPatient',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('total', models.IntegerField(default=0)),
+                ('pending', models.IntegerField(default=0)),
+                ('partially_filled', models.IntegerField(default=0)),
+                ('filled', models.IntegerField(default=0)),
+                ('cancelled', models.IntegerField(default=0)),
+                ('expired', models.IntegerField(default=0)),
+                ('first_prescribed_at', models.DateTimeField(blank=True, null=True)),
+                ('last_prescribed_at', models.DateTimeField(blank=True, null=True)),
+            ],
+        ),
+        migrations.AddIndex(
+            model_name='prescription',
+            index=models.Index(fields=['doctor', '-created_at'], name='prescriptio_doctor__b1eceb_idx'),
+        ),
+        migrations.AddField(
+            model_name='doctorpatient',
+            name='doctor',
+            field=models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='patient_links', to=settings.AUTH_USER_MODEL),
+        ),
+        migrations.AddField(
+            model_name='doctorpatient',
+            name='patient',
+            field=models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='doctor_links', to=settings.AUTH_USER_MODEL),
+        ),
+        migrations.AddIndex(
+            model_name='doctorpatient',
+            index=models.Index(fields=['patient'], name='prescriptio_patient_3ee494_idx'),
+        ),
+        migrations.AddConstraint(
+            model_name='doctorpatient',
+            constraint=models.UniqueConstraint(fields=('doctor', 'patient'), name='unique_doctor_patient'),
+        ),
+        # Backfill links for existing prescriptions
+        migrations.RunSQL(
+            """
+            INSERT INTO prescriptions_doctorpatient
+                (doctor_id, patient_id, total, pending, partially_filled, filled,
+                 cancelled, expired, first_prescribed_at, last_prescribed_at)
+            SELECT doctor_id, patient_id, COUNT(*),
+                   COUNT(*) FILTER (WHERE status = 'PENDING'),
+                   COUNT(*) FILTER (WHERE status = 'PARTIALLY_FILLED'),
+                   COUNT(*) FILTER (WHERE status = 'FILLED'),
+                   COUNT(*) FILTER (WHERE status = 'CANCELLED'),
+                   COUNT(*) FILTER (WHERE status = 'EXPIRED'),
+                   MIN(issue_date), MAX(issue_date)
+            FROM prescriptions_prescription
+            GROUP BY doctor_id, patient_id
+            """,
+            migrations.RunSQL.noop,
+        ),
+    ]
@@ -3,6 +3,27 @@ from django.core.validators import MinValueValidator
 from users.models import User
 from inventory.models import Drug
 
+
+# Statuses that still allow dispensing until ``valid_until`` passes
+OPEN_STATUSES = ['PENDING', 'PARTIALLY_FILLED']
+
+
+class PrescriptionQuerySet(models.QuerySet):
+    """Database-side counterparts of the prescription status properties."""
+    
+    def valid(self, on=None):
+        """Prescriptions for which ``is_valid`` is true on ``on`` (default today)."""
+        from django.utils import timezone
+        on = on or timezone.now().date()
+        return self.filter(status__in=OPEN_STATUSES + ['FILLED'], valid_until__gte=on)
+    
+    def expired(self, on=None):
+        """Open prescriptions whose validity ended before ``on`` (default today)."""
+        from django.utils import timezone
+        on = on or timezone.now().date()
+        return self.filter(status__in=OPEN_STATUSES, valid_until__lt=on)
+
+
 class Prescription(models.Model):
     """Patient prescriptions created by doctors."""
     
@@ -11,6 +32,7 @@ class Prescription(models.Model):
         ('FILLED', 'Filled'),
         ('PARTIALLY_FILLED', 'Partially Filled'),
         ('CANCELLED', 'Cancelled'),
+        ('EXPIRED', 'Expired'),
     ]
     
     # Prescription Info
@@ -34,12 +56,28 @@ class Prescription(models.Model):
     created_at = models.DateTimeField(auto_now_add=True)
     updated_at = models.DateTimeField(auto_now=True)
     
+    objects = PrescriptionQuerySet.as_manager()
+    
     class Meta:
         ordering = ['-created_at']
         indexes = [
             models.Index(fields=['prescription_number']),
             models.Index(fields=['patient', 'status']),
             models.Index(fields=['-created_at']),
+            models.Index(fields=['status', 'valid_until']),
+            models.Index(fields=['doctor', '-created_at']),
+            # Covering indexes for the patient timeline
+            models.Index(
+                fields=['patient', '-issue_date', '-id'],
+                include=['prescription_number', 'status'],
+                name='prescription_patient_issued',
+            ),
+            models.Index(
+                fields=['patient', '-filled_date', '-id'],
+                include=['prescription_number', 'status'],
+                condition=models.Q(filled_date__isnull=False),
+                name='prescription_patient_filled',
+            ),
         ]
     
     def __str__(self):
@@ -48,7 +86,7 @@ class Prescription(models.Model):
     @property
     def is_valid(self):
         from django.utils import timezone
-        return self.valid_until >= timezone.now().date() and self.status != 'CANCELLED'
+        return self.valid_until >= timezone.now().date() and self.status not in ('CANCELLED', 'EXPIRED')
 
 
 class PrescriptionItem(models.Model):
@@ -81,4 +119,37 @@ class PrescriptionItem(models.Model):
     
     @property
     def remaining_quantity(self):
-        return max(0, self.quantity - self.quantity_filled)
\ No newline at end of file
+        return max(0, self.quantity - self.quantity_filled)
+
+
+class DoctorPatient(models.Model):
+    """
+    Maintained doctor-patient relationship with per-status prescription
+    counters. Kept in step by ``prescriptions.relationships``; rebuild
+    with ``manage.py rebuild_doctor_patients`` if it ever drifts.
+    """
+    
+    doctor = models.ForeignKey(User, on_delete=models.CASCADE, related_name='patient_links')
+    patient = models.ForeignKey(User, on_delete=models.CASCADE, related_name='doctor_links')
+    
+    # Prescription counters
+    total = models.IntegerField(default=0)
+    pending = models.IntegerField(default=0)
+    partially_filled = models.IntegerField(default=0)
+    filled = models.IntegerField(default=0)
+    cancelled = models.IntegerField(default=0)
+    expired = models.IntegerField(default=0)
+    
+    first_prescribed_at = models.DateTimeField(null=True, blank=True)
+    last_prescribed_at = models.DateTimeField(null=True, blank=True)
+    
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(fields=['doctor', 'patient'], name='unique_doctor_patient'),
+        ]
+        indexes = [
+            models.Index(fields=['patient']),
+        ]
+    
+    def __str__(self):
+        return f"{self.doctor.get_full_name()} - {self.patient.get_full_name()}"
\ No newline at end of file
@@ -0,0 +1,14 @@
+from rest_framework.pagination import CursorPagination
+
+
+class WorkQueuePagination(CursorPagination):
+    """Stable cursor over the work queue, most urgent first."""
+    
+    ordering = ('valid_until', 'id')
+    page_size = 50
+    page_size_query_param = 'page_size'
+    max_page_size = 200
+    
+    def get_ordering(self, request, queryset, view):
+        # Urgency order is fixed; ignore the viewset's OrderingFilter.
+        return self.ordering
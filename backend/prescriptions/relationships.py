@@ -0,0 +1,98 @@
+"""
+Maintenance of the ``DoctorPatient`` counters.
+
+Every code path that creates, deletes or changes the status, doctor or
+patient of a prescription reports the change here as a pair of link
+states ``(before, after)``; ``None`` stands for "did not exist". All
+changes are folded into per-pair deltas and applied with a single
+``INSERT ... ON CONFLICT DO UPDATE`` in the caller's transaction. The
+same changes feed the per-user counters in ``users.stats``.
+"""
+from collections import Counter, namedtuple
+from django.db import connection
+from users.stats import apply_prescription_changes
+from .models import DoctorPatient
+
+LinkState = namedtuple('LinkState', 'doctor_id patient_id status issued_at')
+
+STATUS_COUNTERS = {
+    'PENDING': 'pending',
+    'PARTIALLY_FILLED': 'partially_filled',
+    'FILLED': 'filled',
+    'CANCELLED': 'cancelled',
+    'EXPIRED': 'expired',
+}
+COUNTERS = ['total'] + list(STATUS_COUNTERS.values())
+
+
+def link_state(prescription):
+    return LinkState(prescription.doctor_id, prescription.patient_id, prescription.status, prescription.issue_date)
+
+
+def apply_changes(changes):
+    """Apply ``(before, after)`` link state pairs to the counters."""
+    deltas = {}
+    issued = {}
+    for before, after in changes:
+        if before == after:
+            continue
+        if before is not None:
+            delta = deltas.setdefault((before.doctor_id, before.patient_id), Counter())
+            delta['total'] -= 1
+            delta[STATUS_COUNTERS[before.status]] -= 1
+        if after is not None:
+            key = (after.doctor_id, after.patient_id)
+            delta = deltas.setdefault(key, Counter())
+            delta['total'] += 1
+            delta[STATUS_COUNTERS[after.status]] += 1
+            if after.issued_at is not None:
+                first, last = issued.get(key, (after.issued_at, after.issued_at))
+                issued[key] = (min(first, after.issued_at), max(last, after.issued_at))
+
+    rows = []
+    # Sorted so concurrent writers lock rows in the same order
+    for key in sorted(deltas):
+        if not any(deltas[key].values()) and key not in issued:
+            continue
+        first, last = issued.get(key, (None, None))
+        rows.append([*key, *(deltas[key][name] for name in COUNTERS), first, last])
+    if rows:
+        _upsert(rows)
+    apply_prescription_changes(changes)
+
+
+def _upsert(rows):
+    qn = connection.ops.quote_name
+    table = qn(DoctorPatient._meta.db_table)
+    columns = ['doctor_id', 'patient_id', *COUNTERS, 'first_prescribed_at', 'last_prescribed_at']
+    placeholders = ', '.join(['(' + ', '.join(['%s'] * len(columns)) + ')'] * len(rows))
+    updates = [f'{qn(name)} = {table}.{qn(name)} + EXCLUDED.{qn(name)}' for name in COUNTERS] + [
+        f'first_prescribed_at = LEAST({table}.first_prescribed_at, EXCLUDED.first_prescribed_at)',
+        f'last_prescribed_at = GREATEST({table}.last_prescribed_at, EXCLUDED.last_prescribed_at)',
+    ]
+    sql = (
+        f'INSERT INTO {table} ({", ".join(qn(name) for name in columns)}) '
+        f'VALUES {placeholders} '
+        f'ON CONFLICT (doctor_id, patient_id) DO UPDATE SET {", ".join(updates)}'
+    )
+    with connection.cursor() as cursor:
+        cursor.execute(sql, [value for row in rows for value in row])
+
+
+def rebuild():
+    """Recompute every link from the prescriptions table."""
+    from .models import Prescription
+    qn = connection.ops.quote_name
+    table = qn(DoctorPatient._meta.db_table)
+    counts = ', '.join(
+        f"COUNT(*) FILTER (WHERE status = '{status}')" for status in STATUS_COUNTERS
+    )
+    with connection.cursor() as cursor:
+        cursor.execute(f'DELETE FROM {table}')
+        cursor.execute(
+            f'INSERT INTO {table} (doctor_id, patient_id, {", ".join(qn(name) for name in COUNTERS)}, '
+            f'first_prescribed_at, last_prescribed_at) '
+            f'SELECT doctor_id, patient_id, COUNT(*), {counts}, MIN(issue_date), MAX(issue_date) '
+            f'FROM {qn(Prescription._meta.db_table)} GROUP BY doctor_id, patient_id'
+        )
+        return cursor.rowcount
@@ -1,4 +1,5 @@
 from rest_framework import serializers
+from django.db import transaction
 from .models import Prescription, PrescriptionItem
 from users.serializers import UserSerializer
 from inventory.serializers import DrugListSerializer
@@ -43,9 +44,30 @@ class PrescriptionListSerializer(serializers.ModelSerializer):
         ]
     
     def get_items_count(self, obj):
+        if hasattr(obj, 'items_count'):
+            return obj.items_count
         return obj.items.count()
 
 
+class WorkQueueSerializer(serializers.ModelSerializer):
+    """Work queue row; counts and fillability come from queryset annotations."""
+    
+    patient_name = serializers.CharField(source='patient.get_full_name', read_only=True)
+    doctor_name = serializers.CharField(source='doctor.get_full_name', read_only=True)
+    items_count = serializers.IntegerField(read_only=True)
+    open_items = serializers.IntegerField(read_only=True)
+    short_items = serializers.IntegerField(read_only=True)
+    fillability = serializers.CharField(read_only=True)
+    
+    class Meta:
+        model = Prescription
+        fields = [
+            'id', 'prescription_number', 'patient', 'patient_name',
+            'doctor', 'doctor_name', 'status', 'issue_date', 'valid_until',
+            'items_count', 'open_items', 'short_items', 'fillability'
+        ]
+
+
 class PrescriptionDetailSerializer(serializers.ModelSerializer):
     """Detailed prescription serializer."""
     
@@ -81,16 +103,32 @@ class PrescriptionCreateSerializer(serializers.ModelSerializer):
     """Serializer for creating prescriptions with items."""
     
     items = PrescriptionItemSerializer(many=True, write_only=True)
+    acknowledge_interactions = serializers.BooleanField(default=False, write_only=True)
+    interactions = serializers.ListField(read_only=True)
     
     class Meta:
         model = Prescription
         fields = [
             'patient', 'doctor', 'diagnosis', 'notes',
-            'valid_until', 'items'
+            'valid_until', 'items', 'acknowledge_interactions', 'interactions'
         ]
     
+    def validate(self, attrs):
+        from inventory.interactions import check_interactions, has_blocking, active_patient_drugs
+        
+        drugs = [item['drug'] for item in attrs['items']]
+        findings = check_interactions(drugs, active_patient_drugs(attrs['patient']))
+        if has_blocking(findings) and not attrs['acknowledge_interactions']:
+            raise serializers.ValidationError({'interactions': findings})
+        self.interaction_findings = findings
+        return attrs
+    
+    @transaction.atomic
     def create(self, validated_data):
+        from .relationships import apply_changes, link_state
+        
         items_data = validated_data.pop('items')
+        validated_data.pop('acknowledge_interactions')
         
         # Generate prescription number
         import uuid
@@ -102,26 +140,43 @@ class PrescriptionCreateSerializer(serializers.ModelSerializer):
         )
         
         # Create prescription items
-        for item_data in items_data:
-            PrescriptionItem.objects.create(
-                prescription=prescription,
-                **item_data
-            )
+        PrescriptionItem.objects.bulk_create([
+            PrescriptionItem(prescription=prescription, **item_data)
+            for item_data in items_data
+        ])
         
+        apply_changes([(None, link_state(prescription))])
+        
+        prescription.interactions = self.interaction_findings
         return prescription
 
 
+class BatchPrescriptionItemSerializer(serializers.Serializer):
+    """Batch item; ``drug`` is resolved by the batch ingester, not per item."""
+    
+    drug = serializers.IntegerField()
+    quantity = serializers.IntegerField(min_value=1)
+    dosage = serializers.CharField(max_length=100)
+    frequency = serializers.CharField(max_length=100)
+    duration = serializers.CharField(max_length=100)
+    instructions = serializers.CharField(required=False, allow_blank=True, default='')
+
+
+class BatchPrescriptionSerializer(serializers.Serializer):
+    """One entry of a batch upload; references are plain ids checked in bulk."""
+    
+    reference = serializers.CharField(max_length=100, required=False, allow_blank=True)
+    patient = serializers.IntegerField()
+    doctor = serializers.IntegerField(required=False)
+    diagnosis = serializers.CharField()
+    notes = serializers.CharField(required=False, allow_blank=True, default='')
+    valid_until = serializers.DateField()
+    items = BatchPrescriptionItemSerializer(many=True, allow_empty=False)
+    acknowledge_interactions = serializers.BooleanField(default=False)
+
+
 class FillPrescriptionSerializer(serializers.Serializer):
     """Serializer for filling prescriptions."""
     
     item_id = serializers.IntegerField()
-    quantity_to_fill = serializers.IntegerField(min_value=1)
-    
-    def validate(self, attrs):
-        try:
-            item = PrescriptionItem.objects.get(id=attrs['item_id'])
-            if item.quantity_filled + attrs['quantity_to_fill'] > item.quantity:
-                raise serializers.ValidationError("Cannot fill more than prescribed quantity")
-        except PrescriptionItem.DoesNotExist:
-            raise serializers.ValidationError("Prescription item not found")
-        return attrs
\ No newline at end of file
+    quantity_to_fill = serializers.IntegerField(min_value=1)
\ No newline at end of file
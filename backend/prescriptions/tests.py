@@ -1,3 +1,469 @@
-from django.test import TestCase
+import re
+import threading
+from datetime import date, timedelta
+from decimal import Decimal
+from unittest import mock
+from io import StringIO
+from django.core.cache import cache
+from django.core.management import call_command
+from django.db import connection
+from django.test import TestCase, TransactionTestCase
+from django.test.utils import CaptureQueriesContext
+from rest_framework import serializers
+from rest_framework.test import APIClient
+from inventory.models import Drug, DrugInteraction, StockTransaction
+from users import stats
+from users.models import User, UserStats
+from .batch import ingest_prescriptions
+from .filling import fill_prescription
+from .models import DoctorPatient, Prescription
+from .relationships import rebuild
+from .views import PrescriptionViewSet
 
-# Create your tests here.
+
+def make_user(email, role):
+    return User.objects.create_user(email=email, password='x', role=role, first_name=role.title(), last_name='User')
+
+
+class PrescriptionTestCase(TestCase):
+    
+    def setUp(self):
+        self.doctor = make_user('doc@example.com', 'DOCTOR')
+        self.other_doctor = make_user('doc2@example.com', 'DOCTOR')
+        self.patient = make_user('pat@example.com', 'PATIENT')
+        self.pharmacist = make_user('ph@example.com', 'PHARMACIST')
+        self.admin = make_user('ad@example.com', 'ADMIN')
+        self.drug = Drug.objects.create(name='Amoxil', dosage_form='CAPSULE', strength='500mg', sku='AMX-500',
+                                        quantity_in_stock=10, unit_price=Decimal('2.00'),
+                                        selling_price=Decimal('3.00'))
+    
+    def client_for(self, user):
+        client = APIClient()
+        client.force_authenticate(user)
+        return client
+    
+    def prescribe(self, quantity=4, doctor=None):
+        response = self.client_for(doctor or self.doctor).post('/api/prescriptions/', {
+            'patient': self.patient.pk, 'doctor': (doctor or self.doctor).pk, 'diagnosis': 'Otitis',
+            'valid_until': date.today() + timedelta(days=30),
+            'items': [{'drug': self.drug.pk, 'quantity': quantity, 'dosage': '1 capsule',
+                       'frequency': '3 times daily', 'duration': '7 days'}],
+        }, format='json')
+        self.assertEqual(response.status_code, 201, response.data)
+        return Prescription.objects.latest('id')
+    
+    def fill(self, prescription, quantity, user=None):
+        item = prescription.items.get()
+        return self.client_for(user or self.pharmacist).post(
+            f'/api/prescriptions/{prescription.pk}/fill/',
+            [{'item_id': item.pk, 'quantity_to_fill': quantity}], format='json',
+        )
+    
+    def links(self):
+        # Links whose prescriptions are all gone keep a row of zeros
+        return {
+            (link.doctor_id, link.patient_id): (
+                link.total, link.pending, link.partially_filled, link.filled, link.cancelled, link.expired,
+            )
+            for link in DoctorPatient.objects.filter(total__gt=0)
+        }
+    
+    def assertMatchesRebuild(self):
+        maintained = self.links()
+        rebuild()
+        self.assertEqual(maintained, self.links())
+
+
+class FillTests(PrescriptionTestCase):
+    
+    def add_item(self, prescription, quantity, drug=None):
+        return prescription.items.create(drug=drug or self.drug, quantity=quantity, dosage='1 capsule',
+                                         frequency='daily', duration='5 days')
+    
+    def assertNothingWritten(self, prescription):
+        self.drug.refresh_from_db()
+        prescription.refresh_from_db()
+        self.assertEqual(self.drug.quantity_in_stock, 10)
+        self.assertEqual(prescription.status, 'PENDING')
+        self.assertFalse(prescription.items.filter(quantity_filled__gt=0).exists())
+        self.assertFalse(StockTransaction.objects.exists())
+    
+    def test_fill_moves_stock(self):
+        prescription = self.prescribe(quantity=4)
+        response = self.fill(prescription, 3)
+        self.assertEqual((response.status_code, response.data['status']), (200, 'PARTIALLY_FILLED'))
+        self.assertEqual(response.data['items'][0]['remaining_quantity'], 1)
+        self.assertEqual(self.fill(prescription, 1).data['status'], 'FILLED')
+        
+        self.drug.refresh_from_db()
+        self.assertEqual(self.drug.quantity_in_stock, 6)
+        self.assertEqual(
+            list(StockTransaction.objects.order_by('id').values_list('transaction_type', 'quantity', 'total_amount')),
+            [('SALE', 3, Decimal('6.00')), ('SALE', 1, Decimal('2.00'))],
+        )
+        prescription.refresh_from_db()
+        self.assertEqual(prescription.filled_by, self.pharmacist)
+        self.assertEqual(self.fill(prescription, 1).status_code, 400)
+    
+    def test_invalid_fills_write_nothing(self):
+        prescription = self.prescribe(quantity=6)
+        item = prescription.items.get()
+        second = self.add_item(prescription, 6)
+        other = self.prescribe().items.get()
+        client = self.client_for(self.pharmacist)
+        for fills, error in [
+            # Repeated entries for one item are added up
+            ([(item, 4), (item, 4)], 'Cannot fill more than prescribed quantity of Amoxil'),
+            # Both items draw on the same drug
+            ([(item, 6), (second, 6)], 'Insufficient stock for Amoxil'),
+            ([(other, 1)], f'Items [{other.pk}] do not belong to prescription {prescription.prescription_number}'),
+        ]:
+            response = client.post(f'/api/prescriptions/{prescription.pk}/fill/', [
+                {'item_id': fill_item.pk, 'quantity_to_fill': quantity} for fill_item, quantity in fills
+            ], format='json')
+            self.assertEqual((response.status_code, response.data), (400, [error]))
+        self.assertNothingWritten(prescription)
+        
+        prescription.status = 'CANCELLED'
+        prescription.save()
+        with self.assertRaisesMessage(serializers.ValidationError, 'Cannot fill cancelled prescription'):
+            fill_prescription(prescription, [{'item_id': item.pk, 'quantity_to_fill': 1}], self.pharmacist)
+    
+    def test_queries_do_not_grow_with_items(self):
+        counts = []
+        for size in (1, 4):
+            prescription = self.prescribe(quantity=1)
+            for i in range(size - 1):
+                drug = Drug.objects.create(name=f'Drug {size}-{i}', dosage_form='TABLET', strength='10mg',
+                                           sku=f'DRG-{size}-{i}', quantity_in_stock=5,
+                                           unit_price=Decimal('1.00'), selling_price=Decimal('2.00'))
+                self.add_item(prescription, 1, drug)
+            fills = [{'item_id': item.pk, 'quantity_to_fill': 1} for item in prescription.items.all()]
+            with CaptureQueriesContext(connection) as queries:
+                self.assertEqual(fill_prescription(prescription, fills, self.pharmacist)[0].status, 'FILLED')
+            counts.append(len(queries))
+        self.assertEqual(counts[0], counts[1])
+
+
+class ConcurrentFillTests(TransactionTestCase):
+    available_apps = ['django.contrib.auth', 'django.contrib.contenttypes', 'users', 'inventory',
+                      'prescriptions', 'sales', 'reports']
+    
+    def test_concurrent_fills_cannot_oversell(self):
+        doctor = make_user('doc@example.com', 'DOCTOR')
+        patient = make_user('pat@example.com', 'PATIENT')
+        pharmacist = make_user('ph@example.com', 'PHARMACIST')
+        drug = Drug.objects.create(name='Amoxil', dosage_form='CAPSULE', strength='500mg', sku='AMX-500',
+                                   quantity_in_stock=10, unit_price=Decimal('2.00'), selling_price=Decimal('3.00'))
+        prescriptions = []
+        for number in ('RX-1', 'RX-2'):
+            prescription = Prescription.objects.create(prescription_number=number, patient=patient, doctor=doctor,
+                                                       diagnosis='Otitis', valid_until=date.today() + timedelta(days=30))
+            prescription.items.create(drug=drug, quantity=6, dosage='1 capsule', frequency='daily', duration='5 days')
+            prescriptions.append(prescription)
+        
+        start = threading.Barrier(len(prescriptions))
+        outcomes = []
+        
+        def fill(prescription):
+            try:
+                start.wait()
+                fill_prescription(prescription, [{'item_id': prescription.items.get().pk, 'quantity_to_fill': 6}],
+                                  pharmacist)
+                outcomes.append('filled')
+            except serializers.ValidationError as exc:
+                outcomes.append(str(exc.detail[0]))
+            finally:
+                connection.close()
+        
+        threads = [threading.Thread(target=fill, args=(prescription,)) for prescription in prescriptions]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        
+        self.assertEqual(sorted(outcomes), ['Insufficient stock for Amoxil', 'filled'])
+        drug.refresh_from_db()
+        self.assertEqual(drug.quantity_in_stock, 4)
+        self.assertEqual(StockTransaction.objects.get().quantity, 6)
+
+
+class ExpiryTests(PrescriptionTestCase):
+    
+    def setUp(self):
+        super().setUp()
+        self.today = date.today()
+        yesterday = self.today - timedelta(days=1)
+        self.by_name = {}
+        for name, status, valid_until in [
+            ('pending', 'PENDING', yesterday),
+            ('partial', 'PARTIALLY_FILLED', yesterday),
+            ('filled', 'FILLED', yesterday),
+            ('cancelled', 'CANCELLED', yesterday),
+            ('current', 'PENDING', self.today),
+        ]:
+            prescription = self.prescribe()
+            Prescription.objects.filter(pk=prescription.pk).update(status=status, valid_until=valid_until)
+            self.by_name[prescription.pk] = name
+        rebuild()
+        stats.rebuild()
+    
+    def names(self, queryset):
+        return sorted(self.by_name[pk] for pk in queryset.values_list('pk', flat=True))
+    
+    def test_valid_and_expired_querysets(self):
+        self.assertEqual(self.names(Prescription.objects.valid()), ['current'])
+        self.assertEqual(self.names(Prescription.objects.valid(on=self.today - timedelta(days=1))),
+                         ['current', 'filled', 'partial', 'pending'])
+        self.assertEqual(self.names(Prescription.objects.expired()), ['partial', 'pending'])
+        self.assertEqual(self.names(Prescription.objects.expired(on=self.today + timedelta(days=1))),
+                         ['current', 'partial', 'pending'])
+        # The querysets agree with the model property
+        for prescription in Prescription.objects.all():
+            self.assertEqual(prescription.is_valid, Prescription.objects.valid().filter(pk=prescription.pk).exists())
+    
+    def test_sweeper_expires_rows_and_moves_counters(self):
+        out = StringIO()
+        call_command('expire_prescriptions', '--dry-run', stdout=out)
+        self.assertEqual(out.getvalue().strip(), '2 prescription(s) would expire')
+        self.assertFalse(Prescription.objects.filter(status='EXPIRED').exists())
+        
+        out = StringIO()
+        call_command('expire_prescriptions', '--batch-size', '1', stdout=out)
+        self.assertEqual(out.getvalue().strip(), 'Expired 2 prescription(s)')
+        self.assertEqual(self.names(Prescription.objects.filter(status='EXPIRED')), ['partial', 'pending'])
+        self.assertEqual(self.links(), {(self.doctor.pk, self.patient.pk): (5, 1, 0, 1, 1, 2)})
+        self.assertMatchesRebuild()
+        patient = UserStats.objects.get(user=self.patient)
+        self.assertEqual((patient.prescriptions_total, patient.prescriptions_pending), (5, 1))
+        
+        call_command('expire_prescriptions', stdout=StringIO())
+        self.assertEqual(Prescription.objects.filter(status='EXPIRED').count(), 2)
+
+
+class WorkQueueTests(PrescriptionTestCase):
+    
+    def setUp(self):
+        super().setUp()
+        self.empty = Drug.objects.create(name='Empty', dosage_form='TABLET', strength='1mg', sku='EMP-1',
+                                         quantity_in_stock=0, unit_price=Decimal('1.00'), selling_price=Decimal('2.00'))
+        self.low = Drug.objects.create(name='Low', dosage_form='TABLET', strength='1mg', sku='LOW-1',
+                                       quantity_in_stock=3, unit_price=Decimal('1.00'), selling_price=Decimal('2.00'))
+        self.number = 0
+    
+    def make(self, days, items, status='PENDING'):
+        self.number += 1
+        prescription = Prescription.objects.create(
+            prescription_number=f'RX-Q{self.number}', patient=self.patient, doctor=self.doctor, diagnosis='Test',
+            status=status, valid_until=date.today() + timedelta(days=days),
+        )
+        for drug, quantity, filled in items:
+            prescription.items.create(drug=drug, quantity=quantity, quantity_filled=filled, dosage='1',
+                                      frequency='daily', duration='5 days')
+        return prescription
+    
+    def queue(self, query=''):
+        client = self.client_for(self.pharmacist)
+        url, rows = f'/api/prescriptions/work_queue/?page_size=2{query}', []
+        for _ in range(10):
+            if not url:
+                break
+            response = client.get(url)
+            self.assertEqual(response.status_code, 200)
+            rows.extend(response.data['results'])
+            url = response.data['next']
+        return rows
+    
+    def test_fillability_and_order(self):
+        expected = [
+            (self.make(1, [(self.drug, 4, 0), (self.empty, 1, 0)]), 'PARTIAL'),
+            (self.make(2, [(self.empty, 2, 0)]), 'NONE'),
+            (self.make(2, [(self.drug, 4, 0)]), 'FULL'),
+            # Only what is still owed counts, and filled items need no stock
+            (self.make(3, [(self.low, 8, 5), (self.empty, 1, 1)], status='PARTIALLY_FILLED'), 'FULL'),
+            (self.make(4, [(self.low, 5, 1)], status='PARTIALLY_FILLED'), 'NONE'),
+        ]
+        # Not in the queue
+        self.make(-1, [(self.drug, 1, 0)])
+        self.make(5, [(self.drug, 1, 1)], status='FILLED')
+        self.make(5, [(self.drug, 1, 0)], status='CANCELLED')
+        
+        rows = self.queue()
+        self.assertEqual([(row['id'], row['fillability']) for row in rows],
+                         [(prescription.pk, fillability) for prescription, fillability in expected])
+        self.assertEqual((rows[0]['items_count'], rows[0]['open_items'], rows[0]['short_items']), (2, 2, 1))
+        self.assertEqual([row['id'] for row in self.queue('&fillability=none')],
+                         [prescription.pk for prescription, fillability in expected if fillability == 'NONE'])
+        
+        # Stock arriving changes the classification
+        Drug.objects.filter(pk=self.empty.pk).update(quantity_in_stock=5)
+        self.assertEqual({row['fillability'] for row in self.queue()}, {'FULL', 'NONE'})
+    
+    def test_queries_do_not_grow_with_rows(self):
+        client = self.client_for(self.pharmacist)
+        for count in (2, 6):
+            for _ in range(count):
+                self.make(1, [(self.drug, 1, 0), (self.empty, 1, 0)])
+            # Prescriptions with their users and item counts
+            with self.assertNumQueries(1):
+                response = client.get('/api/prescriptions/work_queue/')
+            self.assertEqual(response.status_code, 200)
+        self.assertEqual(len(response.data['results']), 8)
+    
+    def test_pharmacists_only(self):
+        self.assertEqual(self.client_for(self.doctor).get('/api/prescriptions/work_queue/').status_code, 403)
+
+
+class PrescriptionQueryCountTests(PrescriptionTestCase):
+    
+    def test_detail_queries_do_not_grow_with_items(self):
+        prescription = self.prescribe()
+        self.fill(prescription, 4)
+        for i in range(4):
+            drug = Drug.objects.create(name=f'Drug {i}', dosage_form='TABLET', strength='10mg', sku=f'DRG-{i}',
+                                       unit_price=Decimal('1.00'), selling_price=Decimal('2.00'))
+            prescription.items.create(drug=drug, quantity=1, dosage='1 tablet', frequency='daily', duration='5 days')
+        
+        # Prescription with its users, items with drug, category and manufacturer
+        with self.assertNumQueries(2):
+            response = self.client_for(self.pharmacist).get(f'/api/prescriptions/{prescription.pk}/')
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(len(response.data['items']), 5)
+        self.assertEqual(response.data['filled_by']['email'], self.pharmacist.email)
+
+
+class DoctorPatientCounterTests(PrescriptionTestCase):
+    
+    def test_counters_follow_every_change(self):
+        admin = self.client_for(self.admin)
+        first = self.prescribe()
+        second = self.prescribe(quantity=1)
+        self.assertEqual(self.links(), {(self.doctor.pk, self.patient.pk): (2, 2, 0, 0, 0, 0)})
+        
+        self.assertEqual(admin.patch(f'/api/prescriptions/{first.pk}/', {'doctor_id': self.other_doctor.pk},
+                                     format='json').status_code, 200)
+        self.assertMatchesRebuild()
+        self.assertEqual(self.fill(first, 2).status_code, 200)
+        self.assertMatchesRebuild()
+        self.assertEqual(self.fill(first, 2).status_code, 200)
+        self.assertMatchesRebuild()
+        self.assertEqual(admin.post(f'/api/prescriptions/{second.pk}/cancel/').status_code, 200)
+        self.assertMatchesRebuild()
+        self.assertEqual(admin.delete(f'/api/prescriptions/{first.pk}/').status_code, 204)
+        self.assertMatchesRebuild()
+        self.assertEqual(self.links(), {(self.doctor.pk, self.patient.pk): (1, 0, 0, 0, 1, 0)})
+    
+    def test_cancel_checks_the_locked_row(self):
+        prescription = self.prescribe()
+        stale = Prescription.objects.get(pk=prescription.pk)
+        # A fill completes after the cancel request loaded the prescription
+        self.assertEqual(self.fill(prescription, 4).status_code, 200)
+        
+        with mock.patch.object(PrescriptionViewSet, 'get_object', return_value=stale):
+            response = self.client_for(self.doctor).post(f'/api/prescriptions/{prescription.pk}/cancel/')
+        self.assertEqual(response.status_code, 400)
+        prescription.refresh_from_db()
+        self.assertEqual(prescription.status, 'FILLED')
+        self.assertMatchesRebuild()
+    
+    def test_update_counts_from_the_locked_row(self):
+        prescription = self.prescribe()
+        stale = Prescription.objects.get(pk=prescription.pk)
+        self.assertEqual(self.fill(prescription, 4).status_code, 200)
+        
+        with mock.patch.object(PrescriptionViewSet, 'get_object', return_value=stale):
+            response = self.client_for(self.admin).patch(f'/api/prescriptions/{prescription.pk}/',
+                                                         {'diagnosis': 'Sinusitis'}, format='json')
+        self.assertEqual(response.status_code, 200)
+        prescription.refresh_from_db()
+        self.assertEqual((prescription.status, prescription.diagnosis), ('FILLED', 'Sinusitis'))
+        self.assertMatchesRebuild()
+
+
+class BatchIngestTests(PrescriptionTestCase):
+    
+    def setUp(self):
+        super().setUp()
+        cache.clear()
+        self.aspirin = Drug.objects.create(name='Aspro', generic_name='aspirin', dosage_form='TABLET', strength='300mg',
+                                           sku='ASP-300', unit_price=Decimal('1.00'), selling_price=Decimal('2.00'))
+        self.warfarin = Drug.objects.create(name='Coumadin', generic_name='warfarin', dosage_form='TABLET',
+                                            strength='5mg', sku='WAR-5', unit_price=Decimal('1.00'),
+                                            selling_price=Decimal('2.00'))
+        DrugInteraction.objects.create(generic_a='aspirin', generic_b='warfarin', severity='MAJOR')
+    
+    def entry(self, reference, drug=None, patient=None, **extra):
+        return {
+            'reference': reference, 'patient': (patient or self.patient).pk, 'diagnosis': f'Diagnosis {reference}',
+            'valid_until': str(date.today() + timedelta(days=30)),
+            'items': [{'drug': (drug or self.drug).pk, 'quantity': 2, 'dosage': '1 capsule',
+                       'frequency': 'daily', 'duration': '5 days'}],
+            **extra,
+        }
+    
+    def test_invalid_entries_do_not_stop_the_rest(self):
+        entries = [
+            self.entry('ok-1'),
+            {'reference': 'shape', 'patient': self.patient.pk},
+            self.entry('not-a-patient', patient=self.other_doctor),
+            self.entry('unknown-drug', items=[{'drug': 0, 'quantity': 1, 'dosage': 'x', 'frequency': 'x',
+                                              'duration': 'x'}]),
+            self.entry('other-doctor', doctor=self.other_doctor.pk),
+            self.entry('ok-2', drug=self.warfarin),
+            # Checked against the entry above from the same batch
+            self.entry('interaction', drug=self.aspirin),
+            self.entry('acknowledged', drug=self.aspirin, acknowledge_interactions=True),
+        ]
+        with self.captureOnCommitCallbacks(execute=True):
+            results = ingest_prescriptions(entries, self.doctor)
+        self.assertEqual([(result['index'], result['reference'], result['status']) for result in results], [
+            (0, 'ok-1', 'created'), (1, 'shape', 'error'), (2, 'not-a-patient', 'error'),
+            (3, 'unknown-drug', 'error'), (4, 'other-doctor', 'error'), (5, 'ok-2', 'created'),
+            (6, 'interaction', 'error'), (7, 'acknowledged', 'created'),
+        ])
+        self.assertEqual(set(results[1]['errors']), {'diagnosis', 'valid_until', 'items'})
+        self.assertEqual(results[2]['errors'], {'patient': [f'Patient {self.other_doctor.pk} not found']})
+        self.assertEqual(results[3]['errors'], {'items': ['Drugs not found: [0]']})
+        self.assertEqual(results[4]['errors'], {'doctor': ['Doctors can only submit their own prescriptions']})
+        self.assertEqual(results[6]['errors']['interactions'][0]['severity'], 'MAJOR')
+        self.assertEqual(results[7]['interactions'][0]['severity'], 'MAJOR')
+        
+        created = Prescription.objects.filter(pk__in=[result['id'] for result in results if 'id' in result])
+        self.assertEqual(
+            sorted(created.values_list('diagnosis', 'doctor_id', 'items__drug_id', 'items__quantity')),
+            [('Diagnosis acknowledged', self.doctor.pk, self.aspirin.pk, 2),
+             ('Diagnosis ok-1', self.doctor.pk, self.drug.pk, 2),
+             ('Diagnosis ok-2', self.doctor.pk, self.warfarin.pk, 2)],
+        )
+        self.assertEqual(DoctorPatient.objects.get(doctor=self.doctor, patient=self.patient).total, 3)
+    
+    def test_numbers_are_assigned_to_the_right_rows(self):
+        results = ingest_prescriptions([self.entry(f'ref-{i}') for i in range(5)], self.doctor)
+        numbers = {result['prescription_number'] for result in results}
+        self.assertEqual(len(numbers), 5)
+        self.assertTrue(all(re.fullmatch(r'RX-[0-9A-F]{8}', number) for number in numbers))
+        for result in results:
+            prescription = Prescription.objects.get(pk=result['id'])
+            self.assertEqual((prescription.prescription_number, prescription.diagnosis),
+                             (result['prescription_number'], f"Diagnosis {result['reference']}"))
+    
+    def test_queries_do_not_grow_with_the_batch(self):
+        # Loads the interaction index, which later batches reuse
+        ingest_prescriptions([self.entry('warm-up')], self.doctor)
+        counts = []
+        for size in (2, 8):
+            entries = [self.entry(f'{size}-{i}', doctor=self.doctor.pk) for i in range(size)]
+            with CaptureQueriesContext(connection) as queries:
+                results = ingest_prescriptions(entries, self.admin)
+            self.assertEqual({result['status'] for result in results}, {'created'})
+            counts.append(len(queries))
+        self.assertEqual(counts[0], counts[1])
+    
+    def test_endpoint(self):
+        client = self.client_for(self.doctor)
+        response = client.post('/api/prescriptions/batch/', {'prescriptions': [self.entry('a'), {'reference': 'b'}]},
+                               format='json')
+        self.assertEqual((response.status_code, response.data['created'], response.data['failed']), (200, 1, 1))
+        self.assertEqual(client.post('/api/prescriptions/batch/', {'prescriptions': []}, format='json').status_code, 400)
+        self.assertEqual(self.client_for(self.pharmacist).post(
+            '/api/prescriptions/batch/', [self.entry('c')], format='json').status_code, 403)
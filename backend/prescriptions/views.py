@@ -3,14 +3,67 @@ from rest_framework.decorators import action
 from rest_framework.response import Response
 from django_filters.rest_framework import DjangoFilterBackend
 from rest_framework.filters import SearchFilter, OrderingFilter
+from django.db import transaction
+from django.db.models import Case, Count, F, Prefetch, Q, Value, When
 from django.utils import timezone
-from .models import Prescription, PrescriptionItem
+from .models import OPEN_STATUSES, Prescription, PrescriptionItem
 from .serializers import (
     PrescriptionListSerializer, PrescriptionDetailSerializer,
-    PrescriptionCreateSerializer, FillPrescriptionSerializer
+    PrescriptionCreateSerializer, FillPrescriptionSerializer, WorkQueueSerializer
 )
+from .filling import fill_prescription
+from .batch import MAX_BATCH_SIZE, ingest_prescriptions
+from .relationships import apply_changes, link_state
+from .pagination import WorkQueuePagination
 from users.permissions import IsDoctor, IsAdminOrPharmacist
 
+
+def with_detail_relations(queryset):
+    """
+    Load everything ``PrescriptionDetailSerializer`` renders up front:
+    patient, doctor and filled_by in the main query and all items with
+    their drug, category and manufacturer in one more.
+    """
+    return queryset.select_related('patient', 'doctor', 'filled_by').prefetch_related(
+        Prefetch(
+            'items',
+            queryset=PrescriptionItem.objects.select_related('drug__category', 'drug__manufacturer'),
+        )
+    )
+
+
+def lock_current(prescription):
+    """
+    Re-read ``prescription``'s fields under a row lock, so the state the
+    counters are moved away from cannot change before the transaction
+    commits. Cached relations and prefetched items are kept.
+    """
+    fields = [field.attname for field in prescription._meta.concrete_fields if not field.primary_key]
+    prescription.refresh_from_db(fields=fields, from_queryset=Prescription.objects.select_for_update())
+
+
+def with_fillability(queryset):
+    """
+    Annotate item counts and whether current stock covers what is still
+    owed: ``FULL`` (every open item), ``PARTIAL`` or ``NONE``.
+    """
+    open_item = Q(items__quantity_filled__lt=F('items__quantity'))
+    short_item = open_item & Q(
+        items__drug__quantity_in_stock__lt=F('items__quantity') - F('items__quantity_filled')
+    )
+    return queryset.annotate(
+        items_count=Count('items'),
+        open_items=Count('items', filter=open_item),
+        short_items=Count('items', filter=short_item),
+    ).annotate(
+        fillability=Case(
+            When(short_items=0, then=Value('FULL')),
+            When(short_items__lt=F('open_items'), then=Value('PARTIAL')),
+            default=Value('NONE'),
+        )
+    )
+
+
 class PrescriptionViewSet(viewsets.ModelViewSet):
     """ViewSet for prescription management."""
     
@@ -32,13 +85,20 @@ class PrescriptionViewSet(viewsets.ModelViewSet):
         user = self.request.user
         
         if user.is_admin or user.is_pharmacist:
-            return Prescription.objects.all()
+            queryset = Prescription.objects.all()
         elif user.is_doctor:
-            return Prescription.objects.filter(doctor=user)
+            queryset = Prescription.objects.filter(doctor=user)
         elif user.is_patient:
-            return Prescription.objects.filter(patient=user)
+            queryset = Prescription.objects.filter(patient=user)
+        else:
+            return Prescription.objects.none()
         
-        return Prescription.objects.none()
+        if self.request.query_params.get('valid') in ('true', '1'):
+            queryset = queryset.valid()
+        
+        if self.action in ('retrieve', 'update', 'partial_update'):
+            queryset = with_detail_relations(queryset)
+        return queryset
     
     def perform_create(self, serializer):
         # Doctors create prescriptions
@@ -47,46 +107,70 @@ class PrescriptionViewSet(viewsets.ModelViewSet):
         
         serializer.save(doctor=self.request.user)
     
-    @action(detail=True, methods=['post'], permission_classes=[IsAdminOrPharmacist])
-    def fill(self, request, pk=None):
-        """Fill a prescription (pharmacist action)."""
-        prescription = self.get_object()
+    @transaction.atomic
+    def perform_update(self, serializer):
+        lock_current(serializer.instance)
+        before = link_state(serializer.instance)
+        prescription = serializer.save()
+        apply_changes([(before, link_state(prescription))])
+    
+    @transaction.atomic
+    def perform_destroy(self, instance):
+        lock_current(instance)
+        before = link_state(instance)
+        instance.delete()
+        apply_changes([(before, None)])
+    
+    @action(detail=False, methods=['post'])
+    def batch(self, request):
+        """Create many prescriptions in one request (EHR integrations)."""
+        if not (request.user.is_doctor or request.user.is_admin):
+            return Response(
+                {'error': 'Only doctors and admins can submit prescriptions'},
+                status=status.HTTP_403_FORBIDDEN
+            )
         
-        if prescription.status == 'CANCELLED':
+        entries = request.data.get('prescriptions') if isinstance(request.data, dict) else request.data
+        if not isinstance(entries, list) or not entries:
             return Response(
-                {'error': 'Cannot fill cancelled prescription'},
+                {'error': 'prescriptions must be a non-empty list'},
                 status=status.HTTP_400_BAD_REQUEST
             )
-        
-        if not prescription.is_valid:
+        if len(entries) > MAX_BATCH_SIZE:
             return Response(
-                {'error': 'Prescription is expired'},
+                {'error': f'At most {MAX_BATCH_SIZE} prescriptions per batch'},
                 status=status.HTTP_400_BAD_REQUEST
             )
         
+        results = ingest_prescriptions(entries, request.user)
+        created = sum(1 for result in results if result['status'] == 'created')
+        return Response({
+            'created': created,
+            'failed': len(results) - created,
+            'results': results,
+        })
+    
+    @action(detail=True, methods=['post'], permission_classes=[IsAdminOrPharmacist])
+    def fill(self, request, pk=None):
+        """Fill a prescription (pharmacist action)."""
+        prescription = self.get_object()
+        
         serializer = FillPrescriptionSerializer(data=request.data, many=True)
         serializer.is_valid(raise_exception=True)
         
-        # Update prescription items
-        for item_data in serializer.validated_data:
-            item = PrescriptionItem.objects.get(id=item_data['item_id'])
-            item.quantity_filled += item_data['quantity_to_fill']
-            item.save()
-        
-        # Update prescription status
-        all_filled = all(item.is_fully_filled for item in prescription.items.all())
-        if all_filled:
-            prescription.status = 'FILLED'
-            prescription.filled_date = timezone.now()
-            prescription.filled_by = request.user
-        else:
-            prescription.status = 'PARTIALLY_FILLED'
-        
-        prescription.save()
+        prescription, items = fill_prescription(prescription, serializer.validated_data, request.user)
         
         return Response({
             'message': 'Prescription filled successfully',
-            'status': prescription.status
+            'status': prescription.status,
+            'items': [
+                {
+                    'item_id': item.id,
+                    'quantity_filled': item.quantity_filled,
+                    'remaining_quantity': item.remaining_quantity,
+                }
+                for item in items
+            ],
         })
     
     @action(detail=True, methods=['post'])
@@ -101,17 +185,40 @@ class PrescriptionViewSet(viewsets.ModelViewSet):
                 status=status.HTTP_403_FORBIDDEN
             )
         
-        if prescription.status == 'FILLED':
-            return Response(
-                {'error': 'Cannot cancel filled prescription'},
-                status=status.HTTP_400_BAD_REQUEST
-            )
-        
-        prescription.status = 'CANCELLED'
-        prescription.save()
+        with transaction.atomic():
+            # Checked on the locked row: a concurrent fill may have just finished
+            lock_current(prescription)
+            if prescription.status == 'FILLED':
+                return Response(
+                    {'error': 'Cannot cancel filled prescription'},
+                    status=status.HTTP_400_BAD_REQUEST
+                )
+            
+            before = link_state(prescription)
+            prescription.status = 'CANCELLED'
+            prescription.save()
+            apply_changes([(before, link_state(prescription))])
         
         return Response({'message': 'Prescription cancelled successfully'})
     
+    @action(detail=False, methods=['get'], permission_classes=[IsAdminOrPharmacist])
+    def work_queue(self, request):
+        """Open prescriptions with stock availability, most urgent first."""
+        queryset = with_fillability(
+            Prescription.objects.valid()
+            .filter(status__in=OPEN_STATUSES)
+            .select_related('patient', 'doctor')
+        )
+        
+        fillability = request.query_params.get('fillability')
+        if fillability:
+            queryset = queryset.filter(fillability=fillability.upper())
+        
+        paginator = WorkQueuePagination()
+        page = paginator.paginate_queryset(queryset, request, view=self)
+        serializer = WorkQueueSerializer(page, many=True)
+        return paginator.get_paginated_response(serializer.data)
+    
     @action(detail=False, methods=['get'])
     def my_prescriptions(self, request):
         """Get prescriptions for current user (patient view)."""
@@ -125,5 +232,13 @@ class PrescriptionViewSet(viewsets.ModelViewSet):
                 status=status.HTTP_403_FORBIDDEN
             )
         
+        prescriptions = prescriptions.select_related('patient', 'doctor').annotate(
+            items_count=Count('items')
+        ).order_by('-created_at')
+        page = self.paginate_queryset(prescriptions)
+        if page is not None:
+            serializer = PrescriptionListSerializer(page, many=True)
+            return self.get_paginated_response(serializer.data)
+        
         serializer = PrescriptionListSerializer(prescriptions, many=True)
         return Response(serializer.data)
\ No newline at end of file
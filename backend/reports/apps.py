@@ -3,3 +3,7 @@ from django.apps import AppConfig
 
 class ReportsConfig(AppConfig):
     name = 'reports'
+    
+    def ready(self):
+        from . import checks, signals
+        signals.connect()
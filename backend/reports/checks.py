@@ -0,0 +1,29 @@
+from django.conf import settings
+from django.core import checks
+
+# Cache backends whose contents other processes cannot see
+PROCESS_LOCAL_CACHES = (
+    'django.core.cache.backends.locmem.LocMemCache',
+    'django.core.cache.backends.dummy.DummyCache',
+)
+
+
+@checks.register(checks.Tags.caches)
+def check_shared_cache(app_configs, **kwargs):
+    """
+    The report data version and results must be shared by all processes.
+
+    With a per-process cache, writes handled by one worker do not bump
+    the data version seen by the others, which keep serving stale
+    reports. Tolerated with ``DEBUG``, where a single process is the norm.
+    """
+    backend = settings.CACHES['default']['BACKEND']
+    if backend not in PROCESS_LOCAL_CACHES:
+        return []
+    level = checks.Warning if settings.DEBUG else checks.Error
+    return [level(
+        f'The default cache ({backend}) is not shared between processes, so cached '
+        'reports are not invalidated by writes made in other processes.',
+        hint='Set CACHE_BACKEND to a shared cache such as Redis, Memcached or the database cache.',
+        id='reports.E001' if level is checks.Error else 'reports.W001',
+    )]
@@ -0,0 +1,64 @@
+import asyncio
+import contextvars
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from asgiref.sync import sync_to_async
+from django.conf import settings
+from django.db import connections
+
+_executor = None
+_executor_lock = threading.Lock()
+
+
+def _get_executor():
+    global _executor
+    if _executor is None:
+        with _executor_lock:
+            if _executor is None:
+                _executor = ThreadPoolExecutor(
+                    max_workers=settings.REPORT_QUERY_WORKERS,
+                    thread_name_prefix='report-query',
+                )
+    return _executor
+
+
+def _run_on_own_connection(func):
+    # Closed after each run: kept open, every pool thread of every process
+    # would hold a database connection between reports
+    try:
+        return func()
+    finally:
+        connections.close_all()
+
+
+def gather(tasks, concurrent=None):
+    """
+    Run independent query callables and return their results by name.
+
+    With ``concurrent`` (default ``REPORT_CONCURRENT_QUERIES``) the callables
+    run in parallel on the report query pool, so the total latency is close
+    to that of the slowest one. Otherwise they run one after another on the
+    calling thread.
+    """
+    if concurrent is None:
+        concurrent = settings.REPORT_CONCURRENT_QUERIES
+    if not concurrent or len(tasks) < 2:
+        return {name: func() for name, func in tasks.items()}
+
+    executor = _get_executor()
+    # Copies the context so the request's query metrics see pool queries
+    futures = {
+        name: executor.submit(contextvars.copy_context().run, _run_on_own_connection, func)
+        for name, func in tasks.items()
+    }
+    return {name: future.result() for name, future in futures.items()}
+
+
+async def agather(tasks):
+    """Async counterpart of :func:`gather` for ASGI views."""
+    names = list(tasks)
+    results = await asyncio.gather(*(
+        sync_to_async(_run_on_own_connection, thread_sensitive=False)(tasks[name])
+        for name in names
+    ))
+    return dict(zip(names, results))
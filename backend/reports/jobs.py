@@ -0,0 +1,196 @@
+import hashlib
+import json
+import threading
+import time
+from datetime import timedelta
+from django.core.cache import cache
+from django.db import connection, transaction
+from django.utils import timezone
+from rest_framework.utils.encoders import JSONEncoder
+from .models import ReportJob
+from .timeseries import parse_days
+
+DATA_VERSION_KEY = 'reports:data_version'
+RESULT_TTL = 60 * 60 * 24
+
+# Workers touch RUNNING jobs every HEARTBEAT_INTERVAL; jobs not touched
+# for STALE_AFTER are assumed to belong to a dead worker
+HEARTBEAT_INTERVAL = timedelta(seconds=30)
+STALE_AFTER = timedelta(minutes=2)
+MAX_ATTEMPTS = 3
+
+INVENTORY_TYPES = ('overview', 'valuation', 'movement')
+
+
+def data_version():
+    """Current version of the data reports are computed from."""
+    # Seeded from the clock so a cache flush never reuses an old version
+    return cache.get_or_set(DATA_VERSION_KEY, time.time_ns(), timeout=None)
+
+
+def bump_data_version():
+    """Invalidate every cached report result."""
+    try:
+        cache.incr(DATA_VERSION_KEY)
+    except ValueError:
+        cache.set(DATA_VERSION_KEY, time.time_ns(), timeout=None)
+
+
+def normalize_params(report_type, params):
+    """Validate report parameters and return them in canonical form."""
+    days = parse_days(params)
+
+    if report_type == 'sales':
+        return {'days': days}
+    if report_type == 'inventory':
+        inventory_type = params.get('type', 'overview')
+        if inventory_type not in INVENTORY_TYPES:
+            raise ValueError('Invalid report type')
+        return {'type': inventory_type, 'days': days}
+    raise ValueError(f"Unknown report '{report_type}'")
+
+
+def result_cache_key(report_type, params, version=None):
+    if version is None:
+        version = data_version()
+    digest = hashlib.sha256(
+        json.dumps([report_type, params, version], sort_keys=True).encode()
+    ).hexdigest()
+    return f'reports:result:{digest}'
+
+
+def build_report(report_type, params):
+    """Compute a report and return it as plain JSON data."""
+    from .views import InventoryReportView, SalesReportView
+
+    if report_type == 'sales':
+        data = SalesReportView().build_report(params['days'])
+    else:
+        data = InventoryReportView().build_report(params['type'], params['days'])
+    return json.loads(json.dumps(data, cls=JSONEncoder))
+
+
+def get_or_build_report(report_type, params):
+    """Serve a report from the result cache, computing it on a miss."""
+    key = result_cache_key(report_type, params)
+    result = cache.get(key)
+    if result is None:
+        result = build_report(report_type, params)
+        cache.set(key, result, timeout=RESULT_TTL)
+    return result
+
+
+def submit_job(report_type, params, user):
+    """
+    Queue a report, reusing cached results and the user's in-flight jobs.
+
+    Returns the job; it is already DONE when the result was cached.
+    """
+    key = result_cache_key(report_type, params)
+    cached = cache.get(key)
+
+    if cached is None:
+        # Only the user's own jobs: others' are not visible to them
+        in_flight = ReportJob.objects.filter(
+            cache_key=key, requested_by=user, status__in=['PENDING', 'RUNNING']
+        ).first()
+        if in_flight:
+            return in_flight
+
+    job = ReportJob(report_type=report_type, params=params, cache_key=key, requested_by=user)
+    if cached is not None:
+        now = timezone.now()
+        job.status = 'DONE'
+        job.result = cached
+        job.started_at = now
+        job.finished_at = now
+    job.save()
+    return job
+
+
+def claim_next_job():
+    """Claim the oldest pending job, skipping rows locked by other workers."""
+    with transaction.atomic():
+        job = ReportJob.objects.select_for_update(skip_locked=True).filter(
+            status='PENDING'
+        ).order_by('created_at').first()
+        if job is None:
+            return None
+
+        job.status = 'RUNNING'
+        job.started_at = job.heartbeat_at = timezone.now()
+        job.attempts += 1
+        job.save(update_fields=['status', 'started_at', 'heartbeat_at', 'attempts'])
+        return job
+
+
+def _claimed(job):
+    """The job's row, while it is still claimed by this attempt."""
+    return ReportJob.objects.filter(pk=job.pk, status='RUNNING', attempts=job.attempts)
+
+
+class Heartbeat:
+    """Touches a claimed job's ``heartbeat_at`` from a helper thread until stopped."""
+    
+    def __init__(self, job, interval=HEARTBEAT_INTERVAL):
+        self.job = job
+        self.interval = interval.total_seconds()
+        self._stop = threading.Event()
+        self._thread = threading.Thread(target=self._run, name=f'report-heartbeat-{job.pk}', daemon=True)
+    
+    def __enter__(self):
+        self._thread.start()
+        return self
+    
+    def __exit__(self, *exc_info):
+        self._stop.set()
+        self._thread.join()
+    
+    def _run(self):
+        try:
+            while not self._stop.wait(self.interval):
+                _claimed(self.job).update(heartbeat_at=timezone.now())
+        finally:
+            connection.close()
+
+
+def run_job(job):
+    """
+    Compute a claimed job and store its result on the job and in the cache.
+
+    Returns False without touching the job if it was requeued meanwhile
+    (the worker was presumed dead); the new attempt owns it then.
+    """
+    # Key the result to the data version it was computed from, so writes
+    # that land while the report runs are not hidden behind it
+    key = result_cache_key(job.report_type, job.params)
+    # Another user's job may have computed it since this one was queued
+    result = cache.get(key)
+    try:
+        if result is None:
+            with Heartbeat(job):
+                result = build_report(job.report_type, job.params)
+    except Exception as exc:
+        job.status = 'FAILED'
+        job.error = str(exc)
+    else:
+        cache.set(key, result, timeout=RESULT_TTL)
+        job.status = 'DONE'
+        job.result = result
+        job.cache_key = key
+
+    job.finished_at = timezone.now()
+    return bool(_claimed(job).update(
+        status=job.status, result=job.result, error=job.error,
+        cache_key=job.cache_key, finished_at=job.finished_at,
+    ))
+
+
+def requeue_stale_jobs():
+    """Return jobs whose worker stopped sending heartbeats to the queue."""
+    stale = ReportJob.objects.filter(
+        status='RUNNING', heartbeat_at__lt=timezone.now() - STALE_AFTER
+    )
+    requeued = stale.filter(attempts__lt=MAX_ATTEMPTS).update(status='PENDING')
+    stale.update(status='FAILED', error='Worker did not finish the report', finished_at=timezone.now())
+    return requeued
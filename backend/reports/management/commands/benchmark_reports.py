@@ -0,0 +1,43 @@
+import statistics
+import time
+from django.core.management.base import BaseCommand
+from reports.views import DashboardView, SalesReportView
+
+
+class Command(BaseCommand):
+    help = 'Compare serial and concurrent execution of report sub-queries.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--iterations', type=int, default=20)
+        parser.add_argument('--days', type=int, default=365,
+                            help='Window used for the sales report.')
+
+    def handle(self, *args, **options):
+        iterations = options['iterations']
+        days = options['days']
+        targets = {
+            'dashboard': lambda concurrent: DashboardView()._get_full_dashboard(concurrent),
+            'sales report': lambda concurrent: SalesReportView().build_report(days, concurrent),
+        }
+
+        for name, build in targets.items():
+            # Warm up both modes so connection setup is not measured
+            build(False)
+            build(True)
+
+            timings = {}
+            for label, concurrent in (('serial', False), ('concurrent', True)):
+                samples = []
+                for _ in range(iterations):
+                    started = time.perf_counter()
+                    build(concurrent)
+                    samples.append((time.perf_counter() - started) * 1000)
+                timings[label] = samples
+
+            serial = statistics.median(timings['serial'])
+            concurrent = statistics.median(timings['concurrent'])
+            self.stdout.write(
+                f'{name}: serial p50 {serial:.1f} ms, concurrent p50 {concurrent:.1f} ms '
+                f'(max {max(timings["serial"]):.1f} / {max(timings["concurrent"]):.1f} ms, '
+                f'speedup {serial / concurrent:.2f}x)'
+            )
@@ -0,0 +1,46 @@
+import signal
+import time
+from django.core.management.base import BaseCommand
+from django.db import close_old_connections
+from reports.jobs import claim_next_job, run_job, requeue_stale_jobs
+
+
+class Command(BaseCommand):
+    help = 'Process queued background report jobs.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--poll-interval', type=float, default=2.0,
+                            help='Seconds to sleep when the queue is empty.')
+        parser.add_argument('--once', action='store_true',
+                            help='Drain the queue and exit instead of polling forever.')
+
+    def handle(self, *args, **options):
+        self.running = True
+        signal.signal(signal.SIGTERM, self._stop)
+        signal.signal(signal.SIGINT, self._stop)
+
+        requeued = requeue_stale_jobs()
+        if requeued:
+            self.stdout.write(f'Requeued {requeued} stale job(s)')
+
+        while self.running:
+            close_old_connections()
+            job = claim_next_job()
+
+            if job is None:
+                if options['once']:
+                    break
+                time.sleep(options['poll_interval'])
+                requeue_stale_jobs()
+                continue
+
+            started = time.monotonic()
+            if run_job(job):
+                self.stdout.write(
+                    f'{job} finished in {time.monotonic() - started:.2f}s'
+                )
+            else:
+                self.stdout.write(f'{job} was requeued while running; result discarded')
+
+    def _stop(self, signum, frame):
+        self.running = False
@@ -0,0 +1,23 @@
+# Generated by Django 6.0 on 2026-10-19 04:53
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('reports', '0001_initial'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='reportjob',
+            name='heartbeat_at',
+            field=models.DateTimeField(blank=True, null=True),
+        ),
+        # Jobs running during the upgrade are judged by their start time
+        migrations.RunSQL(
+            "UPDATE reports_reportjob SET heartbeat_at = started_at WHERE status = 'RUNNING'",
+            migrations.RunSQL.noop,
+        ),
+    ]
@@ -1,3 +1,44 @@
 from django.db import models
+from users.models import User
 
-# Create your models here.
+
+class ReportJob(models.Model):
+    """Report computed in the background by the report worker."""
+    
+    REPORT_TYPES = [
+        ('inventory', 'Inventory'),
+        ('sales', 'Sales'),
+    ]
+    
+    STATUS_CHOICES = [
+        ('PENDING', 'Pending'),
+        ('RUNNING', 'Running'),
+        ('DONE', 'Done'),
+        ('FAILED', 'Failed'),
+    ]
+    
+    report_type = models.CharField(max_length=20, choices=REPORT_TYPES)
+    params = models.JSONField(default=dict)
+    cache_key = models.CharField(max_length=100, db_index=True)
+    
+    status = models.CharField(max_length=20, choices=STATUS_CHOICES, default='PENDING')
+    result = models.JSONField(null=True, blank=True)
+    error = models.TextField(blank=True)
+    attempts = models.IntegerField(default=0)
+    
+    requested_by = models.ForeignKey(User, on_delete=models.SET_NULL, null=True, related_name='report_jobs')
+    
+    created_at = models.DateTimeField(auto_now_add=True)
+    started_at = models.DateTimeField(null=True, blank=True)
+    # Refreshed by the worker while the job runs
+    heartbeat_at = models.DateTimeField(null=True, blank=True)
+    finished_at = models.DateTimeField(null=True, blank=True)
+    
+    class Meta:
+        ordering = ['-created_at']
+        indexes = [
+            models.Index(fields=['status', 'created_at']),
+        ]
+    
+    def __str__(self):
+        return f"{self.get_report_type_display()} report #{self.pk} ({self.status})"
@@ -0,0 +1,21 @@
+from rest_framework import serializers
+from .models import ReportJob
+
+
+class ReportJobSerializer(serializers.ModelSerializer):
+    """Serializer for background report jobs."""
+    
+    class Meta:
+        model = ReportJob
+        fields = [
+            'id', 'report_type', 'params', 'status', 'error',
+            'attempts', 'created_at', 'started_at', 'finished_at'
+        ]
+        read_only_fields = fields
+
+
+class ReportJobCreateSerializer(serializers.Serializer):
+    """Serializer for submitting report jobs."""
+    
+    report_type = serializers.ChoiceField(choices=ReportJob.REPORT_TYPES)
+    params = serializers.DictField(required=False, default=dict)
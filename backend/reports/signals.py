@@ -0,0 +1,17 @@
+from django.db.models.signals import post_save, post_delete
+from inventory.models import Drug, StockTransaction
+from sales.models import Sale, SaleItem
+from .jobs import bump_data_version
+
+# Models the inventory and sales reports are computed from
+REPORT_SOURCES = (Drug, StockTransaction, Sale, SaleItem)
+
+
+def invalidate_report_results(sender, **kwargs):
+    bump_data_version()
+
+
+def connect():
+    for model in REPORT_SOURCES:
+        post_save.connect(invalidate_report_results, sender=model, dispatch_uid=f'reports-{model.__name__}-save')
+        post_delete.connect(invalidate_report_results, sender=model, dispatch_uid=f'reports-{model.__name__}-delete')
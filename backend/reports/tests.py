@@ -1,3 +1,219 @@
-from django.test import TestCase
+import threading
+from datetime import timedelta
+from decimal import Decimal
+from unittest import mock
+from django.core.cache import cache
+from django.db import connection, connections
+from django.test import TestCase, override_settings
+from django.test.utils import CaptureQueriesContext
+from django.utils import timezone
+from rest_framework.test import APIClient
+from rest_framework_simplejwt.tokens import RefreshToken
+from inventory.models import Drug
+from sales.models import Sale, SaleItem
+from users.models import User
+from . import jobs, timeseries
+from .concurrency import gather
+from .checks import check_shared_cache
+from .models import ReportJob
+from .timeseries import sales_timeseries
 
-# Create your tests here.
+
+def make_drug(name, generic_name):
+    return Drug.objects.create(name=name, generic_name=generic_name, dosage_form='TABLET', strength='10mg',
+                               sku=name.upper(), quantity_in_stock=50, unit_price=Decimal('1.00'),
+                               selling_price=Decimal('2.00'))
+
+
+class ReportJobTests(TestCase):
+    
+    def setUp(self):
+        cache.clear()
+        self.alice = User.objects.create_user(email='alice@example.com', password='x', role='PHARMACIST',
+                                              first_name='Alice', last_name='A')
+        self.bob = User.objects.create_user(email='bob@example.com', password='x', role='PHARMACIST',
+                                            first_name='Bob', last_name='B')
+    
+    def test_in_flight_jobs_are_reused_per_user(self):
+        first = jobs.submit_job('sales', {'days': 30}, self.alice)
+        self.assertEqual(jobs.submit_job('sales', {'days': 30}, self.alice), first)
+        
+        other = jobs.submit_job('sales', {'days': 30}, self.bob)
+        self.assertNotEqual(other, first)
+        client = APIClient()
+        client.force_authenticate(self.bob)
+        self.assertEqual(client.get(f'/api/reports/jobs/{other.pk}/').status_code, 200)
+    
+    def test_run_job_reuses_cached_result(self):
+        job = jobs.submit_job('sales', {'days': 30}, self.alice)
+        cache.set(jobs.result_cache_key('sales', {'days': 30}), {'cached': True})
+        
+        with mock.patch('reports.jobs.build_report') as build:
+            self.assertTrue(jobs.run_job(jobs.claim_next_job()))
+        build.assert_not_called()
+        job.refresh_from_db()
+        self.assertEqual((job.status, job.result), ('DONE', {'cached': True}))
+    
+    def test_jobs_without_heartbeat_are_requeued(self):
+        alive = jobs.submit_job('sales', {'days': 30}, self.alice)
+        dead = jobs.submit_job('sales', {'days': 60}, self.alice)
+        jobs.claim_next_job()
+        jobs.claim_next_job()
+        long_ago = timezone.now() - jobs.STALE_AFTER - timedelta(minutes=1)
+        # Long running but still beating
+        ReportJob.objects.filter(pk=alive.pk).update(started_at=long_ago)
+        ReportJob.objects.filter(pk=dead.pk).update(started_at=long_ago, heartbeat_at=long_ago)
+        
+        self.assertEqual(jobs.requeue_stale_jobs(), 1)
+        alive.refresh_from_db()
+        dead.refresh_from_db()
+        self.assertEqual((alive.status, dead.status), ('RUNNING', 'PENDING'))
+    
+    def test_requeued_job_ignores_late_result(self):
+        jobs.submit_job('sales', {'days': 30}, self.alice)
+        stale_claim = jobs.claim_next_job()
+        ReportJob.objects.filter(pk=stale_claim.pk).update(status='PENDING')
+        fresh_claim = jobs.claim_next_job()
+        
+        with mock.patch('reports.jobs.build_report', return_value={'late': True}):
+            self.assertFalse(jobs.run_job(stale_claim))
+        fresh_claim.refresh_from_db()
+        self.assertEqual((fresh_claim.status, fresh_claim.attempts), ('RUNNING', 2))
+    
+    def test_process_local_cache_fails_checks(self):
+        with override_settings(DEBUG=False):
+            self.assertEqual([error.id for error in check_shared_cache(None)], ['reports.E001'])
+        with override_settings(DEBUG=False, CACHES={'default': {
+            'BACKEND': 'django.core.cache.backends.db.DatabaseCache', 'LOCATION': 'cache',
+        }}):
+            self.assertEqual(check_shared_cache(None), [])
+
+
+class GatherTests(TestCase):
+    
+    def task(self, value):
+        def run():
+            with connection.cursor() as cursor:
+                cursor.execute('SELECT %s', [value])
+                self.threads[value] = (threading.get_ident(), connections['default'])
+                return cursor.fetchone()[0]
+        return run
+    
+    def test_serial_unless_enabled(self):
+        self.threads = {}
+        self.assertEqual(gather({'a': self.task(1), 'b': self.task(2)}), {'a': 1, 'b': 2})
+        self.assertEqual({ident for ident, _ in self.threads.values()}, {threading.get_ident()})
+    
+    @override_settings(REPORT_CONCURRENT_QUERIES=True)
+    def test_pool_threads_close_their_connections(self):
+        self.threads = {}
+        self.assertEqual(gather({'a': self.task(1), 'b': self.task(2)}), {'a': 1, 'b': 2})
+        self.assertNotIn(threading.get_ident(), {ident for ident, _ in self.threads.values()})
+        for _, wrapper in self.threads.values():
+            self.assertIsNone(wrapper.connection)
+
+
+class AsyncReportViewTests(TestCase):
+    
+    def setUp(self):
+        cache.clear()
+        self.pharmacist = User.objects.create_user(email='ph@example.com', password=None, role='PHARMACIST',
+                                                   first_name='Phar', last_name='Macist')
+        self.patient = User.objects.create_user(email='pat@example.com', password=None, role='PATIENT',
+                                                first_name='Pat', last_name='Ient')
+    
+    def get(self, url, user=None, token=None, method='get'):
+        if user is not None:
+            token = str(RefreshToken.for_user(user).access_token)
+        headers = {'HTTP_AUTHORIZATION': f'Bearer {token}'} if token else {}
+        return getattr(self.client, method)(url, **headers)
+    
+    def test_errors_match_the_rest_of_the_api(self):
+        response = self.get('/api/reports/async/sales/')
+        self.assertEqual((response.status_code, response.json()['detail']),
+                         (401, 'Authentication credentials were not provided.'))
+        self.assertEqual(response['WWW-Authenticate'], 'Bearer realm="api"')
+        response = self.get('/api/reports/async/sales/', token='not-a-token')
+        self.assertEqual((response.status_code, response.json()['code']), (401, 'token_not_valid'))
+        self.assertEqual(self.get('/api/reports/async/dashboard/', self.patient).status_code, 403)
+        self.assertEqual(self.get('/api/reports/async/sales/', self.pharmacist, method='post').status_code, 405)
+        response = self.get('/api/reports/async/sales/?days=abc', self.pharmacist)
+        self.assertEqual((response.status_code, response.json()), (400, {'error': 'days must be an integer'}))
+        response = self.get('/api/reports/async/sales/?days=7', self.pharmacist)
+        self.assertEqual((response.status_code, response.json()['summary']['total_transactions']), (200, 0))
+    
+    def test_throttled_like_the_rest_of_the_api(self):
+        with mock.patch('users.throttling.consume', return_value=7):
+            response = self.get('/api/reports/async/sales/', self.pharmacist)
+        self.assertEqual(response.status_code, 429)
+        self.assertEqual(response['Retry-After'], '7')
+
+
+class SalesTimeSeriesTests(TestCase):
+    
+    def setUp(self):
+        self.today = timezone.now().replace(hour=0, minute=0, second=0, microsecond=0)
+        self.start, self.end = self.today - timedelta(days=3), self.today + timedelta(days=1)
+        self.aspirin = make_drug('Aspro', 'aspirin')
+        self.paracetamol = make_drug('Panadol', 'paracetamol')
+        self.sell(3, self.aspirin, 2, 'CASH')
+        self.sell(3, self.paracetamol, 1, 'CARD')
+        self.sell(1, self.aspirin, 1, 'CASH')
+        # Outside the range
+        self.sell(4, self.aspirin, 5, 'CASH')
+    
+    def sell(self, days_ago, drug, quantity, method):
+        sale = Sale.objects.create(invoice_number=f'INV-T{Sale.objects.count() + 1:07d}', payment_method=method,
+                                   total_amount=drug.selling_price * quantity)
+        SaleItem.objects.create(sale=sale, drug=drug, quantity=quantity, unit_price=drug.unit_price,
+                                selling_price=drug.selling_price)
+        Sale.objects.filter(pk=sale.pk).update(sale_date=self.today - timedelta(days=days_ago, hours=-12))
+    
+    def series(self, expected_queries, **kwargs):
+        with CaptureQueriesContext(connection) as queries:
+            result = sales_timeseries(self.start, self.end, **kwargs)
+        self.assertEqual(len(queries), expected_queries)
+        self.assertEqual([point['bucket'] for point in result['points']],
+                         [self.start + timedelta(days=day) for day in range(5)])
+        return result
+    
+    def test_empty_buckets_are_zero_filled_in_one_query(self):
+        points = self.series(1)['points']
+        self.assertEqual([(point['transactions'], point['revenue']) for point in points], [
+            (2, Decimal('6.00')), (0, 0), (1, Decimal('2.00')), (0, 0), (0, 0),
+        ])
+        
+        result = self.series(1, split='payment_method')
+        self.assertEqual([(point['series']['CASH']['transactions'], point['series']['CARD']['revenue'])
+                          for point in result['points']], [(1, Decimal('2.00')), (0, 0), (1, 0), (0, 0), (0, 0)])
+    
+    def test_item_splits_pick_top_sellers_first(self):
+        result = self.series(2, split='drug', limit=1)
+        self.assertEqual(result['series'], [{'key': self.aspirin.pk, 'label': 'Aspro'}])
+        self.assertEqual([(point['quantity'], point['series'][self.aspirin.pk]['quantity'])
+                          for point in result['points']], [(3, 2), (0, 0), (1, 1), (0, 0), (0, 0)])
+        
+        result = self.series(2, split='category')
+        self.assertEqual(result['series'], [{'key': None, 'label': 'Uncategorized'}])
+        self.assertEqual([point['series'][None]['revenue'] for point in result['points']],
+                         [Decimal('6.00'), 0, Decimal('2.00'), 0, 0])
+
+
+class SalesTimeSeriesViewTests(TestCase):
+    
+    def setUp(self):
+        self.client = APIClient()
+        self.client.force_authenticate(User.objects.create_user(
+            email='ph@example.com', password=None, role='PHARMACIST', first_name='Phar', last_name='Macist'))
+    
+    def test_bad_parameters_are_rejected(self):
+        for query, error in [
+            ('days=abc', 'days must be an integer'),
+            ('days=-5', f'days must be between 1 and {timeseries.MAX_DAYS}'),
+            ('limit=abc', 'limit must be a positive integer'),
+            ('limit=-1', 'limit must be a positive integer'),
+        ]:
+            response = self.client.get(f'/api/reports/sales/timeseries/?{query}')
+            self.assertEqual((response.status_code, response.data), (400, {'error': error}), query)
+        response = self.client.get('/api/reports/sales/timeseries/?days=7&limit=100&split=drug')
+        self.assertEqual(response.status_code, 200)
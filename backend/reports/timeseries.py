@@ -0,0 +1,172 @@
+from django.db import connection
+from django.db.models import Count, Sum, Q
+from django.db.models.functions import Trunc
+from django.utils import timezone
+from sales.models import Sale, SaleItem
+
+# Bucket sizes accepted by the time-series endpoint, mapped to the
+# PostgreSQL interval used by generate_series for gap filling.
+INTERVALS = {
+    'hour': '1 hour',
+    'day': '1 day',
+    'week': '1 week',
+    'month': '1 month',
+}
+
+SPLITS = ('none', 'payment_method', 'drug', 'category')
+
+# Upper bound on the number of buckets a single request may produce.
+MAX_BUCKETS = 10000
+
+# Upper bound on the ``days`` parameter of the report endpoints.
+MAX_DAYS = 3650
+
+_APPROX_BUCKET_HOURS = {'hour': 1, 'day': 24, 'week': 24 * 7, 'month': 24 * 28}
+
+
+def parse_days(params):
+    """The ``days`` parameter (default 30); ValueError unless 1 to MAX_DAYS."""
+    try:
+        days = int(params.get('days', 30))
+    except (TypeError, ValueError):
+        raise ValueError('days must be an integer')
+    if not 1 <= days <= MAX_DAYS:
+        raise ValueError(f'days must be between 1 and {MAX_DAYS}')
+    return days
+
+
+def sales_timeseries(start, end, interval='day', split='none', limit=10):
+    """
+    Bucketed sales totals between ``start`` and ``end``.
+
+    Buckets are truncated in the database (``Trunc`` in the current time
+    zone), every series is computed in a single GROUP BY using conditional
+    aggregation, and empty buckets are zero-filled by joining against
+    ``generate_series``. Splitting by payment method takes one query;
+    splitting by drug or category takes one extra query to pick the
+    ``limit`` best selling keys.
+    """
+    if interval not in INTERVALS:
+        raise ValueError(f"Invalid interval '{interval}'")
+    if split not in SPLITS:
+        raise ValueError(f"Invalid split '{split}'")
+    if (end - start).total_seconds() / 3600 / _APPROX_BUCKET_HOURS[interval] > MAX_BUCKETS:
+        raise ValueError('Requested range produces too many buckets')
+
+    if split in ('drug', 'category'):
+        base, aggregates, series = _item_series(start, end, split, limit)
+        date_field = 'sale__sale_date'
+    else:
+        base, aggregates, series = _sale_series(start, end, split)
+        date_field = 'sale_date'
+
+    grouped = base.annotate(
+        bucket=Trunc(date_field, interval)
+    ).values('bucket').annotate(**aggregates).order_by()
+
+    rows = _fill_gaps(grouped, list(aggregates), start, end, interval)
+    metrics = ('quantity', 'revenue') if split in ('drug', 'category') else ('transactions', 'revenue')
+    tz = timezone.get_current_timezone()
+
+    points = []
+    for row in rows:
+        values = dict(zip(aggregates, row[1:]))
+        point = {'bucket': timezone.make_aware(row[0], tz)}
+        point.update({metric: values[metric] for metric in metrics})
+        if series:
+            point['series'] = {
+                entry['key']: {
+                    metric: values[f"{entry['alias']}_{metric}"] for metric in metrics
+                }
+                for entry in series
+            }
+        points.append(point)
+
+    return {
+        'interval': interval,
+        'split': split,
+        'series': [{'key': entry['key'], 'label': entry['label']} for entry in series],
+        'points': points,
+    }
+
+
+def _sale_series(start, end, split):
+    """Sale-level aggregates, optionally split by payment method."""
+    base = Sale.objects.filter(sale_date__gte=start, sale_date__lt=end)
+    aggregates = {
+        'transactions': Count('id'),
+        'revenue': Sum('total_amount'),
+    }
+    series = []
+
+    if split == 'payment_method':
+        for index, (method_code, method_name) in enumerate(Sale.PAYMENT_METHODS):
+            alias = f's{index}'
+            condition = Q(payment_method=method_code)
+            aggregates[f'{alias}_transactions'] = Count('id', filter=condition)
+            aggregates[f'{alias}_revenue'] = Sum('total_amount', filter=condition)
+            series.append({'key': method_code, 'label': method_name, 'alias': alias})
+
+    return base, aggregates, series
+
+
+def _item_series(start, end, split, limit):
+    """Item-level aggregates split by the top ``limit`` drugs or categories."""
+    base = SaleItem.objects.sold_between(start, end)
+    if split == 'drug':
+        key_field, label_field = 'drug_id', 'drug__name'
+    else:
+        key_field, label_field = 'drug__category_id', 'drug__category__name'
+
+    top_keys = base.values(key_field, label_field).annotate(
+        total_quantity=Sum('quantity')
+    ).order_by('-total_quantity')[:limit]
+
+    aggregates = {}
+    series = []
+
+    for index, row in enumerate(top_keys):
+        alias = f's{index}'
+        condition = Q(**{key_field: row[key_field]})
+        aggregates[f'{alias}_quantity'] = Sum('quantity', filter=condition)
+        aggregates[f'{alias}_revenue'] = Sum('total_price', filter=condition)
+        series.append({
+            'key': row[key_field],
+            'label': row[label_field] or 'Uncategorized',
+            'alias': alias,
+        })
+
+    # Added last: once annotated, 'quantity' refers to the total rather
+    # than the field, and the per-series sums above would nest aggregates
+    aggregates['quantity'] = Sum('quantity')
+    aggregates['revenue'] = Sum('total_price')
+    return base, aggregates, series
+
+
+def _fill_gaps(grouped, columns, start, end, interval):
+    """Left join the grouped queryset onto a generated bucket series."""
+    sql, params = grouped.query.sql_with_params()
+    select = ', '.join(f'COALESCE(agg."{column}", 0)' for column in columns)
+
+    query = f"""
+        WITH agg AS ({sql})
+        SELECT series.bucket, {select}
+        FROM generate_series(
+            date_trunc(%s, %s::timestamp),
+            date_trunc(%s, %s::timestamp),
+            %s::interval
+        ) AS series(bucket)
+        LEFT JOIN agg ON agg.bucket = series.bucket
+        ORDER BY series.bucket
+    """
+    local_start = timezone.localtime(start).replace(tzinfo=None)
+    local_end = timezone.localtime(end).replace(tzinfo=None)
+
+    with connection.cursor() as cursor:
+        cursor.execute(query, (
+            *params,
+            interval, local_start,
+            interval, local_end,
+            INTERVALS[interval],
+        ))
+        return cursor.fetchall()
@@ -1,25 +1,45 @@
 from rest_framework.views import APIView
 from rest_framework.response import Response
-from rest_framework import permissions, status
-from django.db.models import Sum, Count, F, Q
+from rest_framework.decorators import action
+from rest_framework import mixins, viewsets, permissions, status
+from django.db.models import Sum, Count, Avg, F, Q
+from django.db.models.functions import TruncMonth
 from django.utils import timezone
-from datetime import timedelta
+from datetime import datetime, time, timedelta, timezone as dt_timezone
+from rest_framework import exceptions
+from asgiref.sync import sync_to_async
 from users.models import User
+from users.stats import stats_for
+from users.permissions import IsAdminOrPharmacist
 from inventory.models import Drug, StockTransaction
-from prescriptions.models import Prescription
+from prescriptions.models import Prescription, DoctorPatient
 from sales.models import Sale, SaleItem
+from .timeseries import sales_timeseries, parse_days, INTERVALS, SPLITS
+from .jobs import normalize_params, get_or_build_report, submit_job
+from .concurrency import gather, agather
+from .models import ReportJob
+from .serializers import ReportJobSerializer, ReportJobCreateSerializer
+
+def query_mode(request):
+    """Explicit ``?mode=serial|concurrent`` override for report sub-queries."""
+    mode = request.query_params.get('mode')
+    if mode in ('serial', 'concurrent'):
+        return mode == 'concurrent'
+    return None
+
 
 class DashboardView(APIView):
     """Main dashboard statistics."""
     
     permission_classes = [permissions.IsAuthenticated]
+    throttle_scope = 'reports'
     
     def get(self, request):
         user = request.user
         
         # Admin and Pharmacist get full dashboard
         if user.is_admin or user.is_pharmacist:
-            return Response(self._get_full_dashboard())
+            return Response(self._get_full_dashboard(query_mode(request)))
         
         # Doctor gets doctor-specific data
         elif user.is_doctor:
@@ -31,91 +51,118 @@ class DashboardView(APIView):
         
         return Response({'error': 'Invalid role'}, status=status.HTTP_403_FORBIDDEN)
     
-    def _get_full_dashboard(self):
+    def _get_full_dashboard(self, concurrent=None):
         """Full dashboard for admin/pharmacist."""
+        return gather(self._full_dashboard_sections(), concurrent)
+    
+    def _full_dashboard_sections(self):
+        """Independent dashboard sections, keyed by response field."""
+        return {
+            'inventory': self._get_inventory_stats,
+            'sales': self._get_sales_stats,
+            'prescriptions': self._get_prescription_stats,
+            'users': self._get_user_stats,
+            'alerts': self._get_alerts,
+        }
+    
+    def _get_inventory_stats(self):
+        return {
+            'total_drugs': Drug.objects.filter(is_active=True).count(),
+            'low_stock': Drug.objects.filter(
+                quantity_in_stock__lte=F('reorder_level'),
+                is_active=True
+            ).count(),
+            'out_of_stock': Drug.objects.filter(
+                quantity_in_stock=0,
+                is_active=True
+            ).count(),
+            'total_value': Drug.objects.aggregate(
+                total=Sum(F('quantity_in_stock') * F('unit_price'))
+            )['total'] or 0,
+        }
+    
+    def _get_sales_stats(self):
         today = timezone.now().date()
         last_30_days = timezone.now() - timedelta(days=30)
         
         return {
-            'inventory': {
-                'total_drugs': Drug.objects.filter(is_active=True).count(),
-                'low_stock': Drug.objects.filter(
-                    quantity_in_stock__lte=F('reorder_level'),
-                    is_active=True
-                ).count(),
-                'out_of_stock': Drug.objects.filter(
-                    quantity_in_stock=0,
-                    is_active=True
-                ).count(),
-                'total_value': Drug.objects.aggregate(
-                    total=Sum(F('quantity_in_stock') * F('unit_price'))
-                )['total'] or 0,
-            },
-            'sales': {
-                'today': Sale.objects.filter(sale_date__date=today).count(),
-                'today_revenue': Sale.objects.filter(
-                    sale_date__date=today
-                ).aggregate(total=Sum('total_amount'))['total'] or 0,
-                'last_30_days': Sale.objects.filter(sale_date__gte=last_30_days).count(),
-                'last_30_days_revenue': Sale.objects.filter(
-                    sale_date__gte=last_30_days
-                ).aggregate(total=Sum('total_amount'))['total'] or 0,
-            },
-            'prescriptions': {
-                'pending': Prescription.objects.filter(status='PENDING').count(),
-                'filled_today': Prescription.objects.filter(
-                    status='FILLED',
-                    filled_date__date=today
-                ).count(),
-                'total_active': Prescription.objects.filter(
-                    status__in=['PENDING', 'PARTIALLY_FILLED']
-                ).count(),
-            },
-            'users': {
-                'total': User.objects.filter(is_active=True).count(),
-                'patients': User.objects.filter(role='PATIENT', is_active=True).count(),
-                'doctors': User.objects.filter(role='DOCTOR', is_active=True).count(),
-                'pharmacists': User.objects.filter(role='PHARMACIST', is_active=True).count(),
-            },
-            'alerts': self._get_alerts(),
+            'today': Sale.objects.filter(sale_date__date=today).count(),
+            'today_revenue': Sale.objects.filter(
+                sale_date__date=today
+            ).aggregate(total=Sum('total_amount'))['total'] or 0,
+            'last_30_days': Sale.objects.filter(sale_date__gte=last_30_days).count(),
+            'last_30_days_revenue': Sale.objects.filter(
+                sale_date__gte=last_30_days
+            ).aggregate(total=Sum('total_amount'))['total'] or 0,
+        }
+    
+    def _get_prescription_stats(self):
+        today = timezone.now().date()
+        
+        return {
+            'pending': Prescription.objects.valid().filter(status='PENDING').count(),
+            'filled_today': Prescription.objects.filter(
+                status='FILLED',
+                filled_date__date=today
+            ).count(),
+            'total_active': Prescription.objects.valid().filter(
+                status__in=['PENDING', 'PARTIALLY_FILLED']
+            ).count(),
+        }
+    
+    def _get_user_stats(self):
+        return {
+            'total': User.objects.filter(is_active=True).count(),
+            'patients': User.objects.filter(role='PATIENT', is_active=True).count(),
+            'doctors': User.objects.filter(role='DOCTOR', is_active=True).count(),
+            'pharmacists': User.objects.filter(role='PHARMACIST', is_active=True).count(),
         }
     
     def _get_doctor_dashboard(self, user):
         """Dashboard for doctors."""
-        today = timezone.now().date()
+        # Counters are kept by prescriptions.relationships; pending counts
+        # follow the daily expiry sweep.
+        counts = DoctorPatient.objects.filter(doctor=user).aggregate(
+            total_issued=Sum('total'),
+            pending=Sum('pending'),
+            filled=Sum('filled'),
+            patients=Count('id', filter=Q(total__gt=0)),
+        )
         
         return {
             'prescriptions': {
-                'total_issued': user.issued_prescriptions.count(),
-                'pending': user.issued_prescriptions.filter(status='PENDING').count(),
-                'filled': user.issued_prescriptions.filter(status='FILLED').count(),
+                'total_issued': counts['total_issued'] or 0,
+                'pending': counts['pending'] or 0,
+                'filled': counts['filled'] or 0,
                 'recent': user.issued_prescriptions.order_by('-created_at')[:10].values(
                     'id', 'prescription_number', 'patient__first_name',
                     'patient__last_name', 'status', 'created_at'
                 ),
             },
             'patients': {
-                'total': Prescription.objects.filter(doctor=user).values('patient').distinct().count(),
+                'total': counts['patients'],
             },
         }
     
     def _get_patient_dashboard(self, user):
         """Dashboard for patients."""
+        # Counters are kept by users.stats; pending counts follow the
+        # daily expiry sweep.
+        stats = stats_for(user)
+        
         return {
             'prescriptions': {
-                'total': user.prescriptions.count(),
-                'pending': user.prescriptions.filter(status='PENDING').count(),
-                'filled': user.prescriptions.filter(status='FILLED').count(),
+                'total': stats.prescriptions_total,
+                'pending': stats.prescriptions_pending,
+                'filled': stats.prescriptions_filled,
                 'recent': user.prescriptions.order_by('-created_at')[:10].values(
                     'id', 'prescription_number', 'doctor__first_name',
                     'doctor__last_name', 'status', 'created_at'
                 ),
             },
             'purchases': {
-                'total': user.purchases.count(),
-                'total_spent': user.purchases.aggregate(
-                    total=Sum('total_amount')
-                )['total'] or 0,
+                'total': stats.purchases_count,
+                'total_spent': stats.purchases_total,
             },
         }
     
@@ -134,7 +181,7 @@ class DashboardView(APIView):
                 expiry_date__gte=timezone.now().date(),
                 is_active=True
             ).count(),
-            'pending_prescriptions': Prescription.objects.filter(
+            'pending_prescriptions': Prescription.objects.valid().filter(
                 status='PENDING'
             ).count(),
         }
@@ -144,18 +191,22 @@ class InventoryReportView(APIView):
     """Inventory analysis and reports."""
     
     permission_classes = [permissions.IsAuthenticated]
+    throttle_scope = 'reports'
     
     def get(self, request):
-        report_type = request.query_params.get('type', 'overview')
+        try:
+            params = normalize_params('inventory', request.query_params)
+        except ValueError as exc:
+            return Response({'error': str(exc)}, status=status.HTTP_400_BAD_REQUEST)
         
+        return Response(get_or_build_report('inventory', params))
+    
+    def build_report(self, report_type, days):
         if report_type == 'overview':
-            return Response(self._get_inventory_overview())
+            return self._get_inventory_overview()
         elif report_type == 'valuation':
-            return Response(self._get_inventory_valuation())
-        elif report_type == 'movement':
-            return Response(self._get_stock_movement())
-        
-        return Response({'error': 'Invalid report type'}, status=status.HTTP_400_BAD_REQUEST)
+            return self._get_inventory_valuation()
+        return self._get_stock_movement(days)
     
     def _get_inventory_overview(self):
         """Overview of inventory status."""
@@ -189,9 +240,8 @@ class InventoryReportView(APIView):
             )),
         }
     
-    def _get_stock_movement(self):
+    def _get_stock_movement(self, days):
         """Stock movement analysis."""
-        days = int(self.request.query_params.get('days', 30))
         start_date = timezone.now() - timedelta(days=days)
         
         transactions = StockTransaction.objects.filter(created_at__gte=start_date)
@@ -214,42 +264,308 @@ class SalesReportView(APIView):
     """Sales analysis and reports."""
     
     permission_classes = [permissions.IsAuthenticated]
+    throttle_scope = 'reports'
     
     def get(self, request):
-        days = int(request.query_params.get('days', 30))
-        start_date = timezone.now() - timedelta(days=days)
+        try:
+            params = normalize_params('sales', request.query_params)
+        except ValueError as exc:
+            return Response({'error': str(exc)}, status=status.HTTP_400_BAD_REQUEST)
         
+        return Response(get_or_build_report('sales', params))
+    
+    def build_report(self, days, concurrent=None):
+        return gather(self.report_sections(days), concurrent)
+    
+    def report_sections(self, days):
+        """Independent report sections, keyed by response field."""
+        end_date = timezone.now()
+        start_date = end_date - timedelta(days=days)
         sales = Sale.objects.filter(sale_date__gte=start_date)
         
-        return Response({
-            'summary': self._get_sales_summary(sales),
-            'trends': self._get_sales_trends(sales),
-            'top_products': self._get_top_products(sales),
-        })
+        return {
+            'summary': lambda: self._get_sales_summary(sales, start_date),
+            'trends': lambda: self._get_sales_trends(start_date, end_date),
+            'top_products': lambda: self._get_top_products(start_date),
+        }
     
-    def _get_sales_summary(self, sales):
+    def _get_sales_summary(self, sales, start_date):
         """Sales summary statistics."""
+        totals = sales.aggregate(
+            total_transactions=Count('id'),
+            total_revenue=Sum('total_amount'),
+            average_transaction=Avg('total_amount'),
+        )
+        total_profit = SaleItem.objects.sold_between(start_date).aggregate(
+            total=Sum((F('selling_price') - F('unit_price')) * F('quantity'))
+        )['total']
+        
         return {
-            'total_transactions': sales.count(),
-            'total_revenue': sales.aggregate(total=Sum('total_amount'))['total'] or 0,
-            'total_profit': sum(sale.profit for sale in sales),
-            'average_transaction': sales.aggregate(avg=Sum('total_amount'))['avg'] or 0,
+            'total_transactions': totals['total_transactions'],
+            'total_revenue': totals['total_revenue'] or 0,
+            'total_profit': total_profit or 0,
+            'average_transaction': totals['average_transaction'] or 0,
         }
     
-    def _get_sales_trends(self, sales):
-        """Daily sales trends."""
-        return list(sales.extra(
-            select={'date': 'DATE(sale_date)'}
-        ).values('date').annotate(
-            transactions=Count('id'),
-            revenue=Sum('total_amount')
-        ).order_by('date'))
+    def _get_sales_trends(self, start_date, end_date):
+        """Daily sales trends, including days without sales."""
+        timeseries = sales_timeseries(start_date, end_date, interval='day')
+        return [
+            {
+                'date': point['bucket'].date(),
+                'transactions': point['transactions'],
+                'revenue': point['revenue'],
+            }
+            for point in timeseries['points']
+        ]
     
-    def _get_top_products(self, sales):
+    def _get_top_products(self, start_date):
         """Top selling products."""
-        return list(SaleItem.objects.filter(
-            sale__in=sales
+        return list(SaleItem.objects.sold_between(
+            start_date
         ).values('drug__name').annotate(
             quantity_sold=Sum('quantity'),
             revenue=Sum('total_price')
-        ).order_by('-quantity_sold')[:10])
\ No newline at end of file
+        ).order_by('-quantity_sold')[:10])
+
+
+class SalesTimeSeriesView(APIView):
+    """Bucketed sales time series with zero-filled gaps."""
+    
+    permission_classes = [permissions.IsAuthenticated]
+    throttle_scope = 'reports'
+    
+    def get(self, request):
+        interval = request.query_params.get('interval', 'day')
+        split = request.query_params.get('split', 'none')
+        
+        if interval not in INTERVALS:
+            return Response(
+                {'error': f"interval must be one of: {', '.join(INTERVALS)}"},
+                status=status.HTTP_400_BAD_REQUEST
+            )
+        if split not in SPLITS:
+            return Response(
+                {'error': f"split must be one of: {', '.join(SPLITS)}"},
+                status=status.HTTP_400_BAD_REQUEST
+            )
+        
+        try:
+            days = parse_days(request.query_params)
+        except ValueError as exc:
+            return Response({'error': str(exc)}, status=status.HTTP_400_BAD_REQUEST)
+        try:
+            limit = min(int(request.query_params.get('limit', 10)), 50)
+        except ValueError:
+            limit = 0
+        if limit < 1:
+            return Response({'error': 'limit must be a positive integer'}, status=status.HTTP_400_BAD_REQUEST)
+        end_date = timezone.now()
+        start_date = end_date - timedelta(days=days)
+        
+        try:
+            data = sales_timeseries(start_date, end_date, interval, split, limit)
+        except ValueError as exc:
+            return Response({'error': str(exc)}, status=status.HTTP_400_BAD_REQUEST)
+        
+        return Response(data)
+
+
+class ReportJobViewSet(mixins.ListModelMixin, mixins.RetrieveModelMixin, viewsets.GenericViewSet):
+    """Submit reports for background computation and poll for results."""
+    
+    serializer_class = ReportJobSerializer
+    permission_classes = [permissions.IsAuthenticated]
+    
+    def get_queryset(self):
+        user = self.request.user
+        if user.is_admin:
+            return ReportJob.objects.all()
+        return ReportJob.objects.filter(requested_by=user)
+    
+    def create(self, request):
+        """Queue a report, or return it immediately if it is cached."""
+        serializer = ReportJobCreateSerializer(data=request.data)
+        serializer.is_valid(raise_exception=True)
+        report_type = serializer.validated_data['report_type']
+        
+        try:
+            params = normalize_params(report_type, serializer.validated_data['params'])
+        except ValueError as exc:
+            return Response({'error': str(exc)}, status=status.HTTP_400_BAD_REQUEST)
+        
+        job = submit_job(report_type, params, request.user)
+        data = ReportJobSerializer(job).data
+        
+        if job.status == 'DONE':
+            data['result'] = job.result
+            return Response(data, status=status.HTTP_200_OK)
+        return Response(data, status=status.HTTP_202_ACCEPTED)
+    
+    @action(detail=True, methods=['get'])
+    def result(self, request, pk=None):
+        """Get the result of a finished report."""
+        job = self.get_object()
+        
+        if job.status == 'FAILED':
+            return Response({'error': job.error}, status=status.HTTP_409_CONFLICT)
+        if job.status != 'DONE':
+            return Response(ReportJobSerializer(job).data, status=status.HTTP_202_ACCEPTED)
+        
+        return Response(job.result)
+
+
+class SalesHistoryView(APIView):
+    """Long-range sales history merging live rows with the cold archive."""
+    
+    permission_classes = [permissions.IsAuthenticated]
+    throttle_scope = 'reports'
+    
+    def get(self, request):
+        from sales.archive import ArchiveReader
+        
+        try:
+            end_day = _parse_day(request.query_params.get('end')) or timezone.now().date()
+            start_day = _parse_day(request.query_params.get('start')) or end_day - timedelta(days=3 * 365)
+        except ValueError:
+            return Response({'error': 'start and end must be YYYY-MM-DD'}, status=status.HTTP_400_BAD_REQUEST)
+        try:
+            limit = min(int(request.query_params.get('limit', 10)), 50)
+        except ValueError:
+            limit = 0
+        if limit < 1:
+            return Response({'error': 'limit must be a positive integer'}, status=status.HTTP_400_BAD_REQUEST)
+        
+        start = datetime.combine(start_day, time.min, tzinfo=dt_timezone.utc)
+        end = datetime.combine(end_day + timedelta(days=1), time.min, tzinfo=dt_timezone.utc)
+        reader = ArchiveReader()
+        
+        parts = gather({
+            'live_monthly': lambda: self._live_monthly(start, end),
+            'live_products': lambda: self._live_products(start, end),
+            'archive_monthly': lambda: reader.monthly_summary(start, end),
+            'archive_products': lambda: reader.product_totals(start, end),
+        })
+        
+        monthly = _merge_totals(parts['live_monthly'], parts['archive_monthly'])
+        products = _merge_totals(parts['live_products'], parts['archive_products'])
+        top = sorted(products.items(), key=lambda entry: entry[1]['quantity_sold'], reverse=True)[:limit]
+        names = dict(Drug.objects.filter(id__in=[drug_id for drug_id, _ in top]).values_list('id', 'name'))
+        
+        return Response({
+            'start': start_day,
+            'end': end_day,
+            'summary': {
+                'total_transactions': sum(month['transactions'] for month in monthly.values()),
+                'total_revenue': sum(month['revenue'] for month in monthly.values()),
+                'total_profit': sum(product['profit'] for product in products.values()),
+            },
+            'monthly': [{'month': month, **monthly[month]} for month in sorted(monthly)],
+            'top_products': [
+                {'drug_id': drug_id, 'drug__name': names.get(drug_id), **totals}
+                for drug_id, totals in top
+            ],
+            'archived_months': [month.strftime('%Y-%m') for month in reader.months()],
+        })
+    
+    def _live_monthly(self, start, end):
+        rows = Sale.objects.filter(sale_date__gte=start, sale_date__lt=end).annotate(
+            month=TruncMonth('sale_date', tzinfo=dt_timezone.utc)
+        ).values('month').annotate(
+            transactions=Count('id'),
+            revenue=Sum('total_amount')
+        ).order_by()
+        return {
+            row['month'].strftime('%Y-%m'): {'transactions': row['transactions'], 'revenue': row['revenue']}
+            for row in rows
+        }
+    
+    def _live_products(self, start, end):
+        rows = SaleItem.objects.sold_between(
+            start, end
+        ).values('drug_id').annotate(
+            quantity_sold=Sum('quantity'),
+            revenue=Sum('total_price'),
+            profit=Sum((F('selling_price') - F('unit_price')) * F('quantity'))
+        ).order_by()
+        return {
+            row['drug_id']: {
+                'quantity_sold': row['quantity_sold'],
+                'revenue': row['revenue'],
+                'profit': row['profit'],
+            }
+            for row in rows
+        }
+
+
+def _parse_day(value):
+    return datetime.strptime(value, '%Y-%m-%d').date() if value else None
+
+
+def _merge_totals(*sources):
+    """Add up ``{key: {metric: value}}`` dictionaries."""
+    merged = {}
+    for source in sources:
+        for key, totals in source.items():
+            target = merged.setdefault(key, dict.fromkeys(totals, 0))
+            for metric, value in totals.items():
+                target[metric] += value or 0
+    return merged
+
+
+class AsyncReportPolicies(APIView):
+    """
+    The DRF request policies of the async report views: the configured
+    authenticators, ``permission_classes`` and the ``reports`` throttle
+    scope, with the same error responses as every other API view.
+    """
+    
+    throttle_scope = 'reports'
+    
+    def check(self, django_request):
+        """Return an error response, or ``None`` if the request may proceed."""
+        self.args, self.kwargs = (), {}
+        self.request = self.initialize_request(django_request)
+        self.headers = self.default_response_headers
+        try:
+            if self.request.method != 'GET':
+                raise exceptions.MethodNotAllowed(self.request.method)
+            self.initial(self.request)
+        except Exception as exc:
+            return self.respond(self.handle_exception(exc))
+        return None
+    
+    def respond(self, response):
+        return self.finalize_response(self.request, response).render()
+
+
+def _async_report_view(build, permission_classes=(permissions.IsAuthenticated,)):
+    """Wrap an async report builder with the DRF policies and rendering."""
+    async def view(request):
+        policies = AsyncReportPolicies(permission_classes=list(permission_classes))
+        # Authenticators and throttle stores may touch the database
+        denied = await sync_to_async(policies.check)(request)
+        if denied is not None:
+            return denied
+        
+        try:
+            data = await build(policies.request)
+        except ValueError as exc:
+            return policies.respond(Response({'error': str(exc)}, status=status.HTTP_400_BAD_REQUEST))
+        return policies.respond(Response(data))
+    return view
+
+
+async def _build_dashboard(request):
+    return await agather(DashboardView()._full_dashboard_sections())
+
+
+async def _build_sales_report(request):
+    params = normalize_params('sales', request.query_params)
+    return await agather(SalesReportView().report_sections(params['days']))
+
+
+# Async variants for ASGI deployments: every sub-query runs concurrently on
+# its own connection and the result is always computed fresh.
+async_dashboard_view = _async_report_view(_build_dashboard, [permissions.IsAuthenticated, IsAdminOrPharmacist])
+async_sales_report_view = _async_report_view(_build_sales_report)
\ No newline at end of file
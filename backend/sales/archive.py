@@ -0,0 +1,325 @@
+"""
+Cold archive of closed sales months.
+
+Each archive run of a month adds a part directory under
+``SALES_ARCHIVE_DIR/<YYYY-MM>/`` holding zstd-compressed Parquet files
+for sales, sale items and payments plus a ``manifest.json``; earlier
+parts are never touched, so re-archiving a month after a backdated sale
+only adds the new rows. Exactly the exported rows are deleted, in one
+transaction that rolls back if they changed since the export. A part is
+only used by readers once its live rows are gone: its manifest says so
+(``live_deleted``) or, after a crash between the delete and the manifest
+update, none of its sales are live any more. ``reconcile`` settles such
+parts for good.
+"""
+import json
+import os
+import shutil
+from datetime import datetime, timezone as dt_timezone
+from decimal import Decimal
+from pathlib import Path
+import pyarrow as pa
+import pyarrow.compute as pc
+import pyarrow.parquet as pq
+from django.conf import settings
+from django.db import connection, models, transaction
+from users.stats import apply_deltas
+from .models import Sale, SaleItem, PaymentHistory
+
+BATCH_SIZE = 50000
+COMPRESSION = 'zstd'
+
+# file name -> model exported to it
+ARCHIVE_FILES = {
+    'sales': Sale,
+    'sale_items': SaleItem,
+    'payments': PaymentHistory,
+}
+
+
+def archive_root():
+    return Path(settings.SALES_ARCHIVE_DIR)
+
+
+def month_bounds(month):
+    """UTC datetimes covering the calendar month starting at ``month``."""
+    start = datetime(month.year, month.month, 1, tzinfo=dt_timezone.utc)
+    if month.month == 12:
+        end = start.replace(year=month.year + 1, month=1)
+    else:
+        end = start.replace(month=month.month + 1)
+    return start, end
+
+
+def _arrow_type(field):
+    if isinstance(field, (models.ForeignKey, models.IntegerField)):
+        return pa.int64()
+    if isinstance(field, models.DecimalField):
+        return pa.decimal128(field.max_digits, field.decimal_places)
+    if isinstance(field, models.DateTimeField):
+        return pa.timestamp('us', tz='UTC')
+    if isinstance(field, models.DateField):
+        return pa.date32()
+    if isinstance(field, models.BooleanField):
+        return pa.bool_()
+    return pa.string()
+
+
+def _schema(model):
+    fields = [pa.field(field.attname, _arrow_type(field)) for field in model._meta.concrete_fields]
+    if model is not Sale:
+        # Denormalized so item and payment scans can be range-filtered
+        fields.append(pa.field('sale_date', pa.timestamp('us', tz='UTC')))
+    return pa.schema(fields)
+
+
+def _month_queryset(model, start, end):
+    if model is Sale:
+        return Sale.objects.filter(sale_date__gte=start, sale_date__lt=end).order_by('id')
+    return model.objects.filter(
+        sale__sale_date__gte=start, sale__sale_date__lt=end
+    ).annotate(archived_sale_date=models.F('sale__sale_date')).order_by('id')
+
+
+def _export(model, start, end, path):
+    schema = _schema(model)
+    columns = [field.attname for field in model._meta.concrete_fields]
+    if model is not Sale:
+        columns.append('archived_sale_date')
+
+    rows = 0
+    with pq.ParquetWriter(path, schema, compression=COMPRESSION) as writer:
+        batch = []
+        for values in _month_queryset(model, start, end).values_list(*columns).iterator(chunk_size=BATCH_SIZE):
+            batch.append(values)
+            if len(batch) == BATCH_SIZE:
+                writer.write_table(_to_table(batch, schema))
+                rows += len(batch)
+                batch = []
+        if batch:
+            writer.write_table(_to_table(batch, schema))
+            rows += len(batch)
+    return rows
+
+
+def _to_table(rows, schema):
+    columns = list(zip(*rows))
+    return pa.Table.from_arrays(
+        [pa.array(column, type=field.type) for column, field in zip(columns, schema)],
+        schema=schema,
+    )
+
+
+def archivable_months(before):
+    """Months before ``before`` that still have live sales."""
+    return [
+        moment.date()
+        for moment in Sale.objects.filter(sale_date__lt=before).datetimes('sale_date', 'month', tzinfo=dt_timezone.utc)
+    ]
+
+
+def archive_month(month):
+    """Export one month to a new Parquet part, verify it and delete its live rows."""
+    start, end = month_bounds(month)
+    reconcile(month)
+    part = datetime.now(dt_timezone.utc).strftime('%Y%m%dT%H%M%S%f')
+    final_dir = archive_root() / month.strftime('%Y-%m') / part
+    work_dir = archive_root() / '.tmp' / f"{month.strftime('%Y-%m')}-{part}"
+    shutil.rmtree(work_dir, ignore_errors=True)
+    work_dir.mkdir(parents=True)
+
+    counts = {}
+    outermost = not connection.in_atomic_block
+    with transaction.atomic():
+        if outermost:
+            # One snapshot for all files, so items and payments match the sales
+            with connection.cursor() as cursor:
+                cursor.execute('SET TRANSACTION ISOLATION LEVEL REPEATABLE READ')
+        for name, model in ARCHIVE_FILES.items():
+            path = work_dir / f'{name}.parquet'
+            counts[name] = _export(model, start, end, path)
+            if pq.ParquetFile(path).metadata.num_rows != counts[name]:
+                raise RuntimeError(f'Row count mismatch while archiving {name} for {month:%Y-%m}')
+
+    manifest = {
+        'month': month.strftime('%Y-%m'),
+        'rows': counts,
+        'exported_at': datetime.now(dt_timezone.utc).isoformat(),
+        'live_deleted': False,
+    }
+    _write_manifest(work_dir, manifest)
+    final_dir.parent.mkdir(parents=True, exist_ok=True)
+    work_dir.rename(final_dir)
+
+    _delete_live_rows(_sale_ids(final_dir), counts)
+
+    manifest['live_deleted'] = True
+    _write_manifest(final_dir, manifest)
+    return counts
+
+
+def _write_manifest(directory, manifest):
+    temporary = directory / 'manifest.json.tmp'
+    temporary.write_text(json.dumps(manifest, indent=2))
+    os.replace(temporary, directory / 'manifest.json')
+
+
+def _sale_ids(part_dir):
+    return pq.read_table(part_dir / 'sales.parquet', columns=['id'])['id'].to_pylist()
+
+
+def _delete_live_rows(sale_ids, counts):
+    """Delete exactly the exported rows; rolls back if anything changed since the export."""
+    qn = connection.ops.quote_name
+    with transaction.atomic(), connection.cursor() as cursor:
+        for name, model in (('sale_items', SaleItem), ('payments', PaymentHistory)):
+            cursor.execute(f'DELETE FROM {qn(model._meta.db_table)} WHERE sale_id = ANY(%s)', [sale_ids])
+            if cursor.rowcount != counts[name]:
+                raise RuntimeError(f'{name} changed since the export; not deleting')
+        cursor.execute(
+            f'DELETE FROM {qn(Sale._meta.db_table)} WHERE id = ANY(%s) RETURNING customer_id, total_amount',
+            [sale_ids],
+        )
+        deleted = cursor.fetchall()
+        if len(deleted) != counts['sales']:
+            raise RuntimeError('sales changed since the export; not deleting')
+
+        # Archived sales no longer count towards the customers' purchases
+        deltas = {}
+        for customer_id, amount in deleted:
+            if customer_id is not None:
+                delta = deltas.setdefault(customer_id, {'purchases_count': 0, 'purchases_total': 0})
+                delta['purchases_count'] -= 1
+                delta['purchases_total'] -= amount
+        apply_deltas(deltas)
+
+
+def _parts(root, month=None):
+    """``(month, part directory, manifest)`` of every archive part, oldest first."""
+    month_dir = month.strftime('%Y-%m') if month else '*'
+    # Archives written before parts existed keep their files in the month directory
+    paths = [*root.glob(f'{month_dir}/manifest.json'), *root.glob(f'{month_dir}/*/manifest.json')]
+    for manifest_path in sorted(paths):
+        if any(name.startswith('.') for name in manifest_path.relative_to(root).parts):
+            continue
+        manifest = json.loads(manifest_path.read_text())
+        yield datetime.strptime(manifest['month'], '%Y-%m').date(), manifest_path.parent, manifest
+
+
+def _live_sales(part_dir):
+    """``(live, total)`` counts of the part's sales."""
+    sale_ids = _sale_ids(part_dir)
+    return (Sale.objects.filter(id__in=sale_ids).count() if sale_ids else 0), len(sale_ids)
+
+
+def reconcile(month=None, root=None):
+    """
+    Settle parts left unmarked by an interrupted run: mark those whose
+    live rows are gone as archived and discard those whose rows are still
+    live. Returns ``(marked, discarded)``.
+    """
+    marked = discarded = 0
+    for _, part_dir, manifest in list(_parts(Path(root) if root else archive_root(), month)):
+        if manifest.get('live_deleted'):
+            continue
+        live, total = _live_sales(part_dir)
+        if live == 0:
+            manifest['live_deleted'] = True
+            _write_manifest(part_dir, manifest)
+            marked += 1
+        elif live == total:
+            shutil.rmtree(part_dir)
+            discarded += 1
+        else:
+            raise RuntimeError(f'{part_dir}: {live} of its {total} sales are still live')
+    return marked, discarded
+
+
+class ArchiveReader:
+    """
+    Memory-mapped scans over archived months. A month may hold several
+    parts (one per archive run). A part is used once its live rows are
+    deleted, which is checked against the live tables if a crash kept
+    its manifest from saying so.
+    """
+
+    def __init__(self, root=None):
+        self.root = Path(root) if root else archive_root()
+
+    def parts(self):
+        """``(month, part directory)`` of the parts whose live rows are gone."""
+        if not self.root.exists():
+            return []
+        return [
+            (month, part_dir)
+            for month, part_dir, manifest in _parts(self.root)
+            if manifest.get('live_deleted') or _live_sales(part_dir)[0] == 0
+        ]
+
+    def months(self):
+        """Archived months, oldest first."""
+        return sorted({month for month, _ in self.parts()})
+
+    def scan(self, name, start, end, columns):
+        """Rows of archive file ``name`` with ``start <= sale_date < end``."""
+        tables = []
+        for month, part_dir in self.parts():
+            month_start, month_end = month_bounds(month)
+            if month_end <= start or month_start >= end:
+                continue
+            table = pq.read_table(
+                part_dir / f'{name}.parquet',
+                columns=columns,
+                memory_map=True,
+                filters=[('sale_date', '>=', start), ('sale_date', '<', end)],
+            )
+            tables.append(table)
+        if not tables:
+            return None
+        return pa.concat_tables(tables)
+
+    def monthly_summary(self, start, end):
+        """``{month: {'transactions', 'revenue'}}`` for archived sales."""
+        sales = self.scan('sales', start, end, ['sale_date', 'total_amount'])
+        if sales is None:
+            return {}
+        months = pc.strftime(sales['sale_date'], format='%Y-%m')
+        grouped = pa.table({'month': months, 'total_amount': sales['total_amount']}).group_by('month').aggregate([
+            ('total_amount', 'count'),
+            ('total_amount', 'sum'),
+        ])
+        return {
+            row['month']: {
+                'transactions': row['total_amount_count'],
+                'revenue': row['total_amount_sum'] or Decimal('0'),
+            }
+            for row in grouped.to_pylist()
+        }
+
+    def product_totals(self, start, end):
+        """``{drug_id: {'quantity_sold', 'revenue', 'profit'}}`` for archived items."""
+        items = self.scan('sale_items', start, end, ['drug_id', 'quantity', 'unit_price', 'selling_price', 'total_price'])
+        if items is None:
+            return {}
+        margin = pc.multiply(
+            pc.subtract(items['selling_price'], items['unit_price']),
+            pc.cast(items['quantity'], pa.decimal128(19, 0)),
+        )
+        grouped = pa.table({
+            'drug_id': items['drug_id'],
+            'quantity': items['quantity'],
+            'total_price': items['total_price'],
+            'margin': margin,
+        }).group_by('drug_id').aggregate([
+            ('quantity', 'sum'),
+            ('total_price', 'sum'),
+            ('margin', 'sum'),
+        ])
+        return {
+            row['drug_id']: {
+                'quantity_sold': row['quantity_sum'],
+                'revenue': row['total_price_sum'],
+                'profit': row['margin_sum'],
+            }
+            for row in grouped.to_pylist()
+        }
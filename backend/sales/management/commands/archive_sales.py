@@ -0,0 +1,43 @@
+from datetime import date
+from django.conf import settings
+from django.core.management.base import BaseCommand
+from backend.partitioning import add_months, month_start
+from sales.archive import archivable_months, archive_month, month_bounds, reconcile
+
+
+class Command(BaseCommand):
+    help = 'Move closed sales months to the compressed Parquet archive.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--after-months', type=int, default=settings.SALES_ARCHIVE_AFTER_MONTHS,
+                            help='Archive months that ended more than this many months ago.')
+        parser.add_argument('--dry-run', action='store_true',
+                            help='List the months that would be archived.')
+
+    def handle(self, *args, **options):
+        if not options['dry_run']:
+            marked, discarded = reconcile()
+            if marked or discarded:
+                self.stdout.write(f'Settled interrupted runs: {marked} part(s) archived, {discarded} discarded')
+
+        cutoff_month = add_months(month_start(date.today()), -options['after_months'])
+        cutoff, _ = month_bounds(cutoff_month)
+
+        months = archivable_months(cutoff)
+        if not months:
+            self.stdout.write('Nothing to archive')
+            return
+
+        for month in months:
+            if options['dry_run']:
+                self.stdout.write(f'Would archive {month:%Y-%m}')
+                continue
+            counts = archive_month(month)
+            self.stdout.write(
+                f"Archived {month:%Y-%m}: {counts['sales']} sales, "
+                f"{counts['sale_items']} items, {counts['payments']} payments"
+            )
+
+        if not options['dry_run']:
+            from reports.jobs import bump_data_version
+            bump_data_version()
@@ -0,0 +1,22 @@
+from django.core.management.base import BaseCommand
+from sales.walkins import BATCH_SIZE, link_walkin_sales
+
+
+class Command(BaseCommand):
+    help = 'Link walk-in sales to patient records by phone number.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--phone-only', action='store_true',
+                            help="Do not require the sale's customer name to match the patient.")
+        parser.add_argument('--batch-size', type=int, default=BATCH_SIZE)
+        parser.add_argument('--dry-run', action='store_true',
+                            help='Report how many sales would be linked.')
+
+    def handle(self, *args, **options):
+        linked, examined = link_walkin_sales(
+            require_name=not options['phone_only'],
+            dry_run=options['dry_run'],
+            batch_size=options['batch_size'],
+        )
+        verb = 'Would link' if options['dry_run'] else 'Linked'
+        self.stdout.write(f'{verb} {linked} of {examined} walk-in sale(s) with a phone number')
@@ -0,0 +1,35 @@
+from datetime import date
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection, transaction
+from backend.partitioning import (
+    PARTITIONED_TABLES, ensure_partitions, detach_partitions, add_months, month_start
+)
+
+
+class Command(BaseCommand):
+    help = 'Pre-create future monthly partitions and detach old ones.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--months-ahead', type=int, default=3,
+                            help='Number of future months to keep partitions for.')
+        parser.add_argument('--retain-months', type=int, default=None,
+                            help='Detach partitions older than this many months.')
+        parser.add_argument('--drop', action='store_true',
+                            help='Drop detached partitions instead of keeping them as tables.')
+
+    def handle(self, *args, **options):
+        if connection.vendor != 'postgresql':
+            raise CommandError('Partitioning is only supported on PostgreSQL')
+
+        for table, column in PARTITIONED_TABLES.items():
+            with transaction.atomic():
+                created = ensure_partitions(connection, table, column, options['months_ahead'])
+            for name in created:
+                self.stdout.write(f'Created {name}')
+
+            if options['retain_months'] is not None:
+                cutoff = add_months(month_start(date.today()), -options['retain_months'])
+                with transaction.atomic():
+                    detached = detach_partitions(connection, table, cutoff, drop=options['drop'])
+                for name in detached:
+                    self.stdout.write(f"{'Dropped' if options['drop'] else 'Detached'} {name}")
@@ -0,0 +1,37 @@
+import django.db.models.deletion
+from django.db import migrations, models
+from backend.partitioning import convert_to_partitioned
+
+
+def partition_tables(apps, schema_editor):
+    if schema_editor.connection.vendor != 'postgresql':
+        return
+    convert_to_partitioned(schema_editor.connection, 'sales_sale', 'sale_date')
+    convert_to_partitioned(schema_editor.connection, 'sales_saleitem', 'created_at')
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('sales', '0002_initial'),
+    ]
+
+    operations = [
+        # The foreign keys to sales_sale are dropped together with the
+        # unpartitioned table in partition_tables.
+        migrations.SeparateDatabaseAndState(
+            state_operations=[
+                migrations.AlterField(
+                    model_name='saleitem',
+                    name='sale',
+                    field=models.ForeignKey(db_constraint=False, on_delete=django.db.models.deletion.CASCADE, related_name='items', to='sales.sale'),
+                ),
+                migrations.AlterField(
+                    model_name='paymenthistory',
+                    name='sale',
+                    field=models.ForeignKey(db_constraint=False, on_delete=django.db.models.deletion.CASCADE, related_name='payments', to='sales.sale'),
+                ),
+            ],
+        ),
+        migrations.RunPython(partition_tables),
+    ]
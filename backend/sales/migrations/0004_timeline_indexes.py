@@ -0,0 +1,20 @@
+# Generated by Django 6.0 on 2026-10-19 04:12
+
+from django.conf import settings
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('prescriptions', '0004_timeline_indexes'),
+        ('sales', '0003_partition_by_month'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='sale',
+            index=models.Index(fields=['customer', '-sale_date', '-id'], include=('invoice_number', 'payment_method', 'total_amount'), name='sale_customer_timeline'),
+        ),
+    ]
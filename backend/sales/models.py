@@ -53,6 +53,12 @@ class Sale(models.Model):
             models.Index(fields=['invoice_number']),
             models.Index(fields=['-sale_date']),
             models.Index(fields=['customer']),
+            # Covering index for the patient timeline
+            models.Index(
+                fields=['customer', '-sale_date', '-id'],
+                include=['invoice_number', 'payment_method', 'total_amount'],
+                name='sale_customer_timeline',
+            ),
         ]
     
     def __str__(self):
@@ -71,10 +77,28 @@ class Sale(models.Model):
         return sum(item.profit for item in self.items.all())
 
 
+class SaleItemQuerySet(models.QuerySet):
+    
+    def sold_between(self, start, end=None):
+        """
+        Items of sales made in ``[start, end)``.
+        
+        Also bounds ``created_at``, the partition key, so only the
+        partitions of those months are scanned.
+        """
+        from backend.partitioning import SALE_ITEM_LAG
+        items = self.filter(sale__sale_date__gte=start, created_at__gte=start)
+        if end is not None:
+            items = items.filter(sale__sale_date__lt=end, created_at__lt=end + SALE_ITEM_LAG)
+        return items
+
+
 class SaleItem(models.Model):
     """Individual items in a sale."""
     
-    sale = models.ForeignKey(Sale, on_delete=models.CASCADE, related_name='items')
+    # No database constraint: sales_sale is partitioned by month (see
+    # backend/partitioning.py) and cannot be referenced by id alone.
+    sale = models.ForeignKey(Sale, on_delete=models.CASCADE, related_name='items', db_constraint=False)
     drug = models.ForeignKey(Drug, on_delete=models.CASCADE, related_name='sale_items')
     
     # Quantity and Pricing
@@ -89,6 +113,8 @@ class SaleItem(models.Model):
     
     created_at = models.DateTimeField(auto_now_add=True)
     
+    objects = SaleItemQuerySet.as_manager()
+    
     class Meta:
         ordering = ['id']
     
@@ -108,7 +134,7 @@ class SaleItem(models.Model):
 class PaymentHistory(models.Model):
     """Track payment history for sales (useful for partial payments)."""
     
-    sale = models.ForeignKey(Sale, on_delete=models.CASCADE, related_name='payments')
+    sale = models.ForeignKey(Sale, on_delete=models.CASCADE, related_name='payments', db_constraint=False)
     amount = models.DecimalField(max_digits=12, decimal_places=2, validators=[MinValueValidator(Decimal('0.01'))])
     payment_method = models.CharField(max_length=20, choices=Sale.PAYMENT_METHODS)
     payment_reference = models.CharField(max_length=100, blank=True)
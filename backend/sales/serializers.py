@@ -3,6 +3,8 @@ from .models import Sale, SaleItem, PaymentHistory
 from users.serializers import UserSerializer
 from inventory.models import Drug
 from prescriptions.models import Prescription
+from django.db import transaction
+from .topsellers import record_sale
 
 from django.contrib.auth import get_user_model
 
@@ -69,6 +71,13 @@ class SaleDetailSerializer(serializers.ModelSerializer):
         read_only_fields = ['id', 'invoice_number', 'subtotal', 'total_amount', 'change_given', 'sold_by', 'created_at']
 
 
+class LinkCustomerSerializer(serializers.Serializer):
+    """Walk-in sales to attach to a patient record."""
+    
+    customer = serializers.PrimaryKeyRelatedField(queryset=User.objects.filter(role='PATIENT', is_active=True))
+    sales = serializers.ListField(child=serializers.IntegerField(), allow_empty=False, max_length=1000)
+
+
 class SaleCreateSerializer(serializers.Serializer):
     """Serializer for creating sales."""
     
@@ -93,6 +102,7 @@ class SaleCreateSerializer(serializers.Serializer):
     payment_method = serializers.ChoiceField(choices=Sale.PAYMENT_METHODS)
     payment_reference = serializers.CharField(max_length=100, required=False, allow_blank=True)
     notes = serializers.CharField(required=False, allow_blank=True)
+    acknowledge_interactions = serializers.BooleanField(default=False, write_only=True)
     
     def validate_items(self, items):
         if not items:
@@ -111,11 +121,35 @@ class SaleCreateSerializer(serializers.Serializer):
         
         return items
     
+    def validate(self, attrs):
+        from inventory.interactions import check_interactions, has_blocking, active_patient_drugs
+        
+        drugs = Drug.objects.filter(
+            id__in=[item['drug_id'] for item in attrs['items']]
+        ).only('id', 'name', 'generic_name')
+        customer = attrs.get('customer')
+        existing = active_patient_drugs(customer) if customer else ()
+        findings = check_interactions(drugs, existing)
+        prescription = attrs.get('prescription')
+        if customer and prescription is not None and prescription.patient_id == customer.pk:
+            # Prescribed drugs were checked against each other and the
+            # patient's other prescriptions when the later one was written,
+            # so only findings involving drugs added at the counter count
+            prescribed = set(prescription.items.values_list('drug_id', flat=True))
+            added = {drug.pk for drug in drugs} - prescribed
+            findings = [finding for finding in findings if added.intersection(finding['drugs'])]
+        if has_blocking(findings) and not attrs['acknowledge_interactions']:
+            raise serializers.ValidationError({'interactions': findings})
+        return attrs
+    
+    @transaction.atomic
     def create(self, validated_data):
         from inventory.models import StockTransaction
+        from users.stats import apply_purchase_changes, purchase
         import uuid
         
         items_data = validated_data.pop('items')
+        validated_data.pop('acknowledge_interactions', None)
         
         # Generate invoice number
         invoice_number = f"INV-{uuid.uuid4().hex[:8].upper()}"
@@ -155,6 +189,11 @@ class SaleCreateSerializer(serializers.Serializer):
         
         # Calculate totals
         sale.calculate_totals()
+        apply_purchase_changes([(None, purchase(sale))])
+        
+        # Feed the streaming top-sellers summaries once the sale is committed
+        sold_items = [(item['drug_id'], item['quantity']) for item in items_data]
+        transaction.on_commit(lambda: record_sale(sold_items, sale.sale_date))
         
         return sale
 
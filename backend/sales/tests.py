@@ -1,3 +1,298 @@
-from django.test import TestCase
+import tempfile
+from datetime import date, datetime, timedelta, timezone as dt_timezone
+from decimal import Decimal
+from unittest import mock
+from django.core.cache import cache
+from django.db import IntegrityError, connection, transaction
+from django.test import TestCase, TransactionTestCase, override_settings
+from django.utils import timezone
+from rest_framework.test import APIClient
+from inventory.models import Drug
+from users.models import User, UserStats
+from . import archive, topsellers
+from .archive import ArchiveReader, _parts, archive_month, reconcile
+from .models import PaymentHistory, Sale, SaleItem
 
-# Create your tests here.
+MONTH = date(2020, 3, 1)
+
+
+def make_sale(drug, customer=None, quantity=1, day=10, invoice=None):
+    sale = Sale.objects.create(
+        invoice_number=invoice or f'INV-T{Sale.objects.count() + 1:07d}',
+        customer=customer, total_amount=drug.selling_price * quantity,
+    )
+    SaleItem.objects.create(sale=sale, drug=drug, quantity=quantity, unit_price=drug.unit_price,
+                            selling_price=drug.selling_price)
+    PaymentHistory.objects.create(sale=sale, amount=sale.total_amount, payment_method='CASH')
+    moment = datetime(MONTH.year, MONTH.month, day, 12, tzinfo=dt_timezone.utc)
+    Sale.objects.filter(pk=sale.pk).update(sale_date=moment)
+    return sale
+
+
+class PartitionTests(TestCase):
+    
+    def setUp(self):
+        self.drug = Drug.objects.create(name='Amoxil', dosage_form='CAPSULE', strength='500mg', sku='AMX-500',
+                                        unit_price=Decimal('2.00'), selling_price=Decimal('3.00'))
+    
+    def test_invoice_number_stays_unique(self):
+        sale = Sale.objects.create(invoice_number='INV-1')
+        with self.assertRaises(IntegrityError), transaction.atomic():
+            Sale.objects.create(invoice_number='INV-1')
+        
+        # Renumbering and deleting free the old number
+        sale.invoice_number = 'INV-2'
+        sale.save()
+        Sale.objects.create(invoice_number='INV-1')
+        with self.assertRaises(IntegrityError), transaction.atomic():
+            Sale.objects.create(invoice_number='INV-2')
+        sale.delete()
+        Sale.objects.create(invoice_number='INV-2')
+        
+        # The original unique constraint is kept, with the partition key added
+        with connection.cursor() as cursor:
+            cursor.execute("SELECT pg_get_constraintdef(oid) FROM pg_constraint "
+                           "WHERE conrelid = 'sales_sale'::regclass AND conname = 'sales_sale_invoice_number_key'")
+            self.assertEqual(cursor.fetchall(), [('UNIQUE (invoice_number, sale_date)',)])
+    
+    def test_sold_between_matches_sale_date_filter(self):
+        make_sale(self.drug)
+        sale = Sale.objects.create(invoice_number='INV-NOW')
+        SaleItem.objects.create(sale=sale, drug=self.drug, quantity=1, unit_price=1, selling_price=1)
+        start = timezone.now() - timedelta(days=1)
+        end = timezone.now() + timedelta(days=1)
+        
+        self.assertEqual(list(SaleItem.objects.sold_between(start, end)),
+                         list(SaleItem.objects.filter(sale__sale_date__gte=start, sale__sale_date__lt=end)))
+        self.assertEqual(SaleItem.objects.sold_between(start).count(), 1)
+
+
+class SaleQueryCountTests(TestCase):
+    
+    def setUp(self):
+        self.pharmacist = User.objects.create_user(email='ph@example.com', password='x', role='PHARMACIST',
+                                                   first_name='Phar', last_name='Macist')
+        self.client = APIClient()
+        self.client.force_authenticate(self.pharmacist)
+        self.drugs = [
+            Drug.objects.create(name=f'Drug {i}', dosage_form='TABLET', strength='10mg', sku=f'DRG-{i}',
+                                unit_price=Decimal('1.00'), selling_price=Decimal('2.00'))
+            for i in range(3)
+        ]
+    
+    def add_sales(self, count):
+        for _ in range(count):
+            customer = User.objects.create_user(email=f'c{Sale.objects.count()}@example.com', password=None,
+                                                role='PATIENT', first_name='Cus', last_name='Tomer')
+            sale = Sale.objects.create(invoice_number=f'INV-Q{Sale.objects.count() + 1:07d}', customer=customer,
+                                       sold_by=self.pharmacist)
+            for drug in self.drugs:
+                SaleItem.objects.create(sale=sale, drug=drug, quantity=2, unit_price=drug.unit_price,
+                                        selling_price=drug.selling_price)
+        return sale
+    
+    def test_list_queries_do_not_grow_with_rows(self):
+        for count in (2, 8):
+            self.add_sales(count)
+            # Count, sales with customer and seller, items
+            with self.assertNumQueries(3):
+                response = self.client.get('/api/sales/')
+            self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.data['results'][0]['items_count'], 3)
+    
+    def test_detail_queries_do_not_grow_with_items(self):
+        sale = self.add_sales(1)
+        # Sale with customer and seller, items with their drugs
+        with self.assertNumQueries(2):
+            response = self.client.get(f'/api/sales/{sale.pk}/')
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(len(response.data['items']), 3)
+        self.assertEqual(response.data['customer']['email'], sale.customer.email)
+    
+    @override_settings(QUERY_METRICS_SAMPLE_RATE=1.0)
+    def test_metrics_time_serialization(self):
+        from backend.metrics import registry
+        self.add_sales(2)
+        registry.clear()
+        # A new client builds the middleware chain with sampling on
+        client = APIClient()
+        client.force_authenticate(self.pharmacist)
+        self.assertEqual(client.get('/api/sales/').status_code, 200)
+        metrics = registry.snapshot()[('sale-list', 'GET')]
+        self.assertEqual(metrics.queries, 3)
+        self.assertGreater(metrics.serialize_seconds, 0)
+        self.assertLess(metrics.serialize_seconds, metrics.seconds)
+    
+    @override_settings(PROFILING_ENABLED=True, PROFILING_DIR='')
+    def test_only_admins_get_profiles(self):
+        from users.authentication import CachedJWTAuthentication
+        from users.serializers import RoleTokenObtainPairSerializer
+        self.add_sales(2)
+        admin = User.objects.create_user(email='ad@example.com', password=None, role='ADMIN')
+        
+        def get(user, mode='1'):
+            # A new client builds the middleware chain with profiling on
+            client = APIClient()
+            token = RoleTokenObtainPairSerializer.get_token(user).access_token
+            client.credentials(HTTP_AUTHORIZATION=f'Bearer {token}')
+            authenticate = CachedJWTAuthentication.authenticate
+            with mock.patch.object(CachedJWTAuthentication, 'authenticate', autospec=True,
+                                   side_effect=authenticate) as counted:
+                response = client.get(f'/api/sales/?_profile={mode}')
+            # The middleware's authentication is reused by the view
+            self.assertEqual(counted.call_count, 1)
+            self.assertEqual(response.status_code, 200)
+            return response.json()
+        
+        self.assertEqual(len(get(self.pharmacist)['results']), 2)
+        report = get(admin)
+        self.assertEqual((report['view'], report['status'], report['mode']), ('sale-list', 200, 'cprofile'))
+        self.assertEqual(report['queries']['count'], 3)
+        self.assertIn('rest_framework', report['functions'])
+        self.assertEqual(get(admin, 'sample')['mode'], 'sample')
+        self.assertEqual(APIClient().get('/api/sales/?_profile=1').status_code, 401)
+
+
+@override_settings(TOP_SELLERS_CAPACITY=4)
+class TopSellersTests(TestCase):
+    
+    def setUp(self):
+        cache.clear()
+        self.drugs = [
+            Drug.objects.create(name=f'Drug {i}', dosage_form='TABLET', strength='10mg', sku=f'DRG-{i}',
+                                unit_price=Decimal('1.00'), selling_price=Decimal('2.00'))
+            for i in range(12)
+        ]
+        cache.set(topsellers.SINCE_KEY, (timezone.now() - timedelta(days=30)).isoformat(), timeout=None)
+    
+    def sell(self, items):
+        sale = Sale.objects.create(invoice_number=f'INV-S{Sale.objects.count() + 1:07d}')
+        for drug, quantity in items:
+            SaleItem.objects.create(sale=sale, drug=drug, quantity=quantity, unit_price=drug.unit_price,
+                                    selling_price=drug.selling_price)
+        topsellers.record_sale([(drug.pk, quantity) for drug, quantity in items], sale.sale_date)
+    
+    def test_counts_bound_the_exact_quantities(self):
+        # Skewed sales of 12 drugs through 4 counters
+        for i, drug in enumerate(self.drugs):
+            for _ in range(12 - i):
+                self.sell([(drug, 1 + i % 3), (self.drugs[0], 1)])
+        
+        sketch = topsellers.sketch_for_window('today')
+        start, _ = topsellers.window_bounds('today')
+        exact = {row['drug_id']: row['quantity'] for row in topsellers.exact_top_sellers(start, len(self.drugs))}
+        self.assertEqual(sketch.total, sum(exact.values()))
+        self.assertTrue(any(error for _, _, error in sketch.top(4)))
+        for drug_id, count, error in sketch.top(4):
+            self.assertLessEqual(count - error, exact[drug_id])
+            self.assertLessEqual(exact[drug_id], count)
+            self.assertLessEqual(error, sketch.error_bound)
+        # Every drug above N / m is reported
+        reported = {drug_id for drug_id, _, _ in sketch.top(4)}
+        self.assertTrue({drug_id for drug_id, quantity in exact.items() if quantity > sketch.error_bound} <= reported)
+    
+    def test_evicted_bucket_falls_back_to_exact(self):
+        self.sell([(self.drugs[0], 3)])
+        # Days without sales have no bucket and are fine
+        self.assertIsNotNone(topsellers.sketch_for_window('7d'))
+        
+        cache.delete(topsellers.window_bounds('today')[1][0])
+        self.assertIsNone(topsellers.sketch_for_window('today'))
+        self.assertIsNone(topsellers.sketch_for_window('7d'))
+
+
+class ArchiveTests(TransactionTestCase):
+    # Listing the apps makes the flush between tests TRUNCATE ... CASCADE,
+    # which the partitioned sales tables need
+    available_apps = ['django.contrib.auth', 'django.contrib.contenttypes', 'users', 'inventory',
+                      'prescriptions', 'sales', 'reports']
+    
+    def setUp(self):
+        self.root = tempfile.mkdtemp()
+        override = override_settings(SALES_ARCHIVE_DIR=self.root)
+        override.enable()
+        self.addCleanup(override.disable)
+        self.drug = Drug.objects.create(name='Amoxil', dosage_form='CAPSULE', strength='500mg', sku='AMX-500',
+                                        unit_price=Decimal('2.00'), selling_price=Decimal('3.00'))
+        self.patient = User.objects.create_user(email='p@example.com', password='x', role='PATIENT',
+                                                first_name='Pat', last_name='Ient')
+    
+    def archived_totals(self):
+        start = datetime(2020, 1, 1, tzinfo=dt_timezone.utc)
+        end = datetime(2021, 1, 1, tzinfo=dt_timezone.utc)
+        return ArchiveReader().monthly_summary(start, end).get('2020-03', {}).get('transactions', 0)
+    
+    def test_round_trip(self):
+        make_sale(self.drug, self.patient, quantity=2)
+        make_sale(self.drug)
+        UserStats.objects.create(user=self.patient, purchases_count=1, purchases_total=Decimal('6.00'))
+        
+        counts = archive_month(MONTH)
+        
+        self.assertEqual(counts, {'sales': 2, 'sale_items': 2, 'payments': 2})
+        self.assertFalse(Sale.objects.exists())
+        self.assertFalse(SaleItem.objects.exists())
+        self.assertFalse(PaymentHistory.objects.exists())
+        self.assertEqual(self.archived_totals(), 2)
+        start = datetime(2020, 1, 1, tzinfo=dt_timezone.utc)
+        products = ArchiveReader().product_totals(start, datetime(2021, 1, 1, tzinfo=dt_timezone.utc))
+        self.assertEqual(products[self.drug.pk]['quantity_sold'], 3)
+        stats = UserStats.objects.get(user=self.patient)
+        self.assertEqual((stats.purchases_count, stats.purchases_total), (0, Decimal('0.00')))
+    
+    def test_rearchive_keeps_earlier_part(self):
+        make_sale(self.drug)
+        archive_month(MONTH)
+        # A backdated sale lands in the archived month
+        make_sale(self.drug, day=20)
+        archive_month(MONTH)
+        
+        self.assertEqual(len(list(_parts(ArchiveReader().root))), 2)
+        self.assertEqual(self.archived_totals(), 2)
+        self.assertEqual(ArchiveReader().months(), [MONTH])
+    
+    def test_crash_after_delete_is_still_read(self):
+        make_sale(self.drug)
+        real_write = archive._write_manifest
+        
+        def write_manifest(directory, manifest):
+            if manifest['live_deleted']:
+                raise OSError('disk full')
+            real_write(directory, manifest)
+        
+        with mock.patch('sales.archive._write_manifest', side_effect=write_manifest):
+            with self.assertRaises(OSError):
+                archive_month(MONTH)
+        
+        # The live rows are gone and the manifest was not updated
+        self.assertFalse(Sale.objects.exists())
+        self.assertEqual(self.archived_totals(), 1)
+        self.assertEqual(reconcile(), (1, 0))
+        self.assertTrue(all(manifest['live_deleted'] for _, _, manifest in _parts(ArchiveReader().root)))
+    
+    def test_crash_before_delete_is_discarded(self):
+        make_sale(self.drug)
+        with mock.patch('sales.archive._delete_live_rows', side_effect=RuntimeError('connection lost')):
+            with self.assertRaises(RuntimeError):
+                archive_month(MONTH)
+        
+        # The sale is still live, so the unfinished part must not count it again
+        self.assertEqual(Sale.objects.count(), 1)
+        self.assertEqual(self.archived_totals(), 0)
+        self.assertEqual(reconcile(), (0, 1))
+        archive_month(MONTH)
+        self.assertEqual(self.archived_totals(), 1)
+    
+    def test_rows_changed_since_export_are_not_deleted(self):
+        sale = make_sale(self.drug)
+        
+        def late_payment(*args, **kwargs):
+            PaymentHistory.objects.create(sale=sale, amount=Decimal('1.00'), payment_method='CASH')
+            return real_sale_ids(*args, **kwargs)
+        
+        real_sale_ids = archive._sale_ids
+        with mock.patch('sales.archive._sale_ids', side_effect=late_payment):
+            with self.assertRaises(RuntimeError):
+                archive_month(MONTH)
+        self.assertEqual(PaymentHistory.objects.count(), 2)
+        self.assertEqual(reconcile(), (0, 1))
@@ -0,0 +1,191 @@
+"""
+Streaming top-sellers tracking.
+
+Every sale feeds per-hour and per-day Space-Saving summaries (Metwally,
+Agrawal & El Abbadi, 2005) stored in the default cache. A summary with
+``m`` counters over a stream of total weight ``N`` guarantees, for every
+drug it reports:
+
+* ``count - error <= true quantity <= count``
+* ``error <= N / m``
+
+and every drug whose true quantity exceeds ``N / m`` is reported. Merging
+summaries (used for the 7-day window) keeps the same bound with ``N`` the
+combined weight. Windows that start before tracking began, or whose
+buckets could not be updated safely, fall back to an exact recompute.
+So do windows with a bucket missing from the cache for a period that
+had sales: the bucket was evicted, and merging the rest would undercount.
+"""
+import time
+from datetime import datetime, timedelta
+from functools import reduce
+from operator import or_
+from django.conf import settings
+from django.core.cache import cache
+from django.db.models import Q, Sum
+from django.utils import timezone
+
+WINDOWS = ('hour', 'today', '7d')
+
+CACHE_PREFIX = 'topsellers'
+SINCE_KEY = f'{CACHE_PREFIX}:since'
+HOUR_TTL = 60 * 60 * 48
+DAY_TTL = 60 * 60 * 24 * 9
+LOCK_TTL = 5
+LOCK_ATTEMPTS = 50
+
+
+class SpaceSaving:
+    """Space-Saving heavy-hitter summary with a fixed number of counters."""
+
+    def __init__(self, capacity, counters=None, total=0):
+        self.capacity = capacity
+        self.counters = counters or {}  # key -> [count, error]
+        self.total = total
+
+    @property
+    def error_bound(self):
+        """Maximum overestimate of any reported count."""
+        return self.total / self.capacity
+
+    def add(self, key, weight=1):
+        self.total += weight
+        if key in self.counters:
+            self.counters[key][0] += weight
+        elif len(self.counters) < self.capacity:
+            self.counters[key] = [weight, 0]
+        else:
+            victim = min(self.counters, key=lambda k: self.counters[k][0])
+            floor = self.counters.pop(victim)[0]
+            self.counters[key] = [floor + weight, floor]
+
+    def merge(self, other):
+        """Combine with another summary (Agarwal et al. mergeable summaries)."""
+        own_floor = self._floor()
+        other_floor = other._floor()
+        merged = {}
+
+        for key in self.counters.keys() | other.counters.keys():
+            count, error = self.counters.get(key, (own_floor, own_floor))
+            other_count, other_error = other.counters.get(key, (other_floor, other_floor))
+            merged[key] = [count + other_count, error + other_error]
+
+        kept = sorted(merged.items(), key=lambda entry: entry[1][0], reverse=True)
+        self.counters = dict(kept[:self.capacity])
+        self.total += other.total
+        return self
+
+    def top(self, n):
+        """Return ``[(key, count, error)]`` ordered by estimated count."""
+        ranked = sorted(self.counters.items(), key=lambda entry: entry[1][0], reverse=True)
+        return [(key, count, error) for key, (count, error) in ranked[:n]]
+
+    def to_dict(self):
+        return {'capacity': self.capacity, 'total': self.total, 'counters': self.counters}
+
+    @classmethod
+    def from_dict(cls, data):
+        return cls(data['capacity'], data['counters'], data['total'])
+
+    def _floor(self):
+        # A key missing from a full summary can have at most the smallest
+        # tracked count; from a summary that is not full, it has none.
+        if len(self.counters) < self.capacity:
+            return 0
+        return min(count for count, _ in self.counters.values())
+
+
+def _capacity():
+    return getattr(settings, 'TOP_SELLERS_CAPACITY', 200)
+
+
+def _hour_key(moment):
+    return f"{CACHE_PREFIX}:hour:{moment.strftime('%Y%m%d%H')}"
+
+
+def _day_key(moment):
+    return f"{CACHE_PREFIX}:day:{moment.strftime('%Y%m%d')}"
+
+
+def record_sale(items, sold_at=None):
+    """Feed ``[(drug_id, quantity)]`` from a committed sale into the summaries."""
+    moment = timezone.localtime(sold_at)
+    cache.add(SINCE_KEY, timezone.now().isoformat(), timeout=None)
+
+    for key, ttl in ((_hour_key(moment), HOUR_TTL), (_day_key(moment), DAY_TTL)):
+        if not _update_bucket(key, ttl, items):
+            # The bucket may now be missing updates: drop it and restart
+            # tracking so readers fall back to an exact recompute.
+            cache.delete(key)
+            cache.set(SINCE_KEY, timezone.now().isoformat(), timeout=None)
+
+
+def _update_bucket(key, ttl, items):
+    lock_key = f'{key}:lock'
+    for _ in range(LOCK_ATTEMPTS):
+        if cache.add(lock_key, 1, timeout=LOCK_TTL):
+            break
+        time.sleep(0.01)
+    else:
+        return False
+
+    try:
+        data = cache.get(key)
+        sketch = SpaceSaving.from_dict(data) if data else SpaceSaving(_capacity())
+        for drug_id, quantity in items:
+            sketch.add(drug_id, quantity)
+        cache.set(key, sketch.to_dict(), timeout=ttl)
+        return True
+    finally:
+        cache.delete(lock_key)
+
+
+def _buckets(window, now=None):
+    """``[(key, start, end)]`` of the buckets covering ``window``, in local time."""
+    now = timezone.localtime(now)
+    if window == 'hour':
+        start = now.replace(minute=0, second=0, microsecond=0)
+        return [(_hour_key(start), start, start + timedelta(hours=1))]
+
+    today = now.replace(hour=0, minute=0, second=0, microsecond=0)
+    days = 1 if window == 'today' else 7
+    starts = [today - timedelta(days=offset) for offset in range(days - 1, -1, -1)]
+    return [(_day_key(start), start, start + timedelta(days=1)) for start in starts]
+
+
+def window_bounds(window, now=None):
+    """Start and bucket keys covering ``window``, in local time."""
+    buckets = _buckets(window, now)
+    return buckets[0][1], [key for key, _, _ in buckets]
+
+
+def sketch_for_window(window, now=None):
+    """Merged summary for ``window``, or ``None`` if it cannot be trusted."""
+    from .models import Sale
+
+    buckets = _buckets(window, now)
+    since = cache.get(SINCE_KEY)
+    if since is None or datetime.fromisoformat(since) > buckets[0][1]:
+        return None
+
+    found = cache.get_many([key for key, _, _ in buckets])
+    # A bucket is also missing when nothing sold in its period
+    missing = [Q(sale_date__gte=start, sale_date__lt=end) for key, start, end in buckets if key not in found]
+    if missing and Sale.objects.filter(reduce(or_, missing)).exists():
+        return None
+
+    merged = SpaceSaving(_capacity())
+    for data in found.values():
+        merged.merge(SpaceSaving.from_dict(data))
+    return merged
+
+
+def exact_top_sellers(start, limit):
+    """Exact top sellers since ``start`` computed from sale items."""
+    from .models import SaleItem
+
+    return list(SaleItem.objects.sold_between(
+        start
+    ).values('drug_id', 'drug__name').annotate(
+        quantity=Sum('quantity')
+    ).order_by('-quantity')[:limit])
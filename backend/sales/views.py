@@ -3,21 +3,32 @@ from rest_framework.decorators import action
 from rest_framework.response import Response
 from django_filters.rest_framework import DjangoFilterBackend
 from rest_framework.filters import SearchFilter, OrderingFilter
-from django.db.models import Sum, Count, F
+from django.db import transaction
+from django.db.models import Sum, Count, F, Prefetch, Q
 from datetime import timedelta
 from django.utils import timezone
 from .models import Sale, SaleItem, PaymentHistory
 from .serializers import (
     SaleListSerializer, SaleDetailSerializer,
-    SaleCreateSerializer, PaymentHistorySerializer
+    SaleCreateSerializer, PaymentHistorySerializer, LinkCustomerSerializer
 )
+from .topsellers import WINDOWS, sketch_for_window, window_bounds, exact_top_sellers
 from users.permissions import IsAdminOrPharmacist
+from users.stats import apply_purchase_changes, purchase
+
+
+def lock_current(sale):
+    """Re-read ``sale`` under a row lock, so the counters move from its current amount."""
+    fields = [field.attname for field in Sale._meta.concrete_fields if not field.primary_key]
+    sale.refresh_from_db(fields=fields, from_queryset=Sale.objects.select_for_update())
+
 
 class SaleViewSet(viewsets.ModelViewSet):
     """ViewSet for sales management."""
     
     queryset = Sale.objects.all()
     permission_classes = [permissions.IsAuthenticated, IsAdminOrPharmacist]
+    throttle_scope = 'pos'
     filter_backends = [DjangoFilterBackend, SearchFilter, OrderingFilter]
     filterset_fields = ['customer', 'payment_method', 'sold_by']
     search_fields = ['invoice_number', 'customer_name', 'customer_phone']
@@ -30,9 +41,47 @@ class SaleViewSet(viewsets.ModelViewSet):
             return SaleCreateSerializer
         return SaleDetailSerializer
     
+    def get_queryset(self):
+        queryset = Sale.objects.all()
+        if self.action == 'list':
+            # Items are prefetched for items_count and profit
+            return queryset.select_related('customer', 'sold_by').prefetch_related('items')
+        if self.action in ('retrieve', 'update', 'partial_update'):
+            return queryset.select_related('customer', 'sold_by').prefetch_related(
+                Prefetch('items', queryset=SaleItem.objects.select_related('drug'))
+            )
+        return queryset
+    
     def perform_create(self, serializer):
         serializer.save(sold_by=self.request.user)
     
+    @transaction.atomic
+    def perform_update(self, serializer):
+        lock_current(serializer.instance)
+        before = purchase(serializer.instance)
+        sale = serializer.save()
+        apply_purchase_changes([(before, purchase(sale))])
+    
+    @transaction.atomic
+    def perform_destroy(self, instance):
+        lock_current(instance)
+        before = purchase(instance)
+        instance.delete()
+        apply_purchase_changes([(before, None)])
+    
+    @action(detail=False, methods=['post'])
+    def link_customer(self, request):
+        """Attach walk-in sales to a patient record; already linked sales are skipped."""
+        from .walkins import link_sales
+        serializer = LinkCustomerSerializer(data=request.data)
+        serializer.is_valid(raise_exception=True)
+        
+        requested = set(serializer.validated_data['sales'])
+        sale_ids = sorted(Sale.objects.filter(pk__in=requested, customer__isnull=True).values_list('id', flat=True))
+        link_sales([(sale_id, serializer.validated_data['customer'].pk) for sale_id in sale_ids])
+        
+        return Response({'linked': len(sale_ids), 'skipped': len(requested) - len(sale_ids)})
+    
     @action(detail=False, methods=['get'])
     def today(self, request):
         """Get today's sales."""
@@ -59,21 +108,22 @@ class SaleViewSet(viewsets.ModelViewSet):
             'top_selling_drugs': []
         }
         
-        # Sales by payment method
+        # Sales by payment method, in a single conditional aggregate
+        by_method = sales.aggregate(**{
+            f'{method_code}_{metric}': aggregate(field, filter=Q(payment_method=method_code))
+            for method_code, _ in Sale.PAYMENT_METHODS
+            for metric, aggregate, field in (('count', Count, 'id'), ('amount', Sum, 'total_amount'))
+        })
         for method_code, method_name in Sale.PAYMENT_METHODS:
-            count = sales.filter(payment_method=method_code).count()
-            amount = sales.filter(payment_method=method_code).aggregate(
-                total=Sum('total_amount')
-            )['total'] or 0
             stats['by_payment_method'][method_name] = {
-                'count': count,
-                'amount': float(amount)
+                'count': by_method[f'{method_code}_count'],
+                'amount': float(by_method[f'{method_code}_amount'] or 0)
             }
         
         # Top selling drugs
         from inventory.models import Drug
-        top_drugs = SaleItem.objects.filter(
-            sale__sale_date__gte=start_date
+        top_drugs = SaleItem.objects.sold_between(
+            start_date
         ).values('drug__name').annotate(
             total_quantity=Sum('quantity'),
             total_revenue=Sum('total_price')
@@ -83,6 +133,54 @@ class SaleViewSet(viewsets.ModelViewSet):
         
         return Response(stats)
     
+    @action(detail=False, methods=['get'])
+    def top_sellers(self, request):
+        """Top selling drugs for the current hour, today or the last 7 days."""
+        window = request.query_params.get('window', 'today')
+        if window not in WINDOWS:
+            return Response(
+                {'error': f"window must be one of: {', '.join(WINDOWS)}"},
+                status=status.HTTP_400_BAD_REQUEST
+            )
+        
+        limit = min(int(request.query_params.get('limit', 10)), 50)
+        exact = request.query_params.get('exact') in ('1', 'true')
+        sketch = None if exact else sketch_for_window(window)
+        
+        if sketch is None:
+            start, _ = window_bounds(window)
+            results = [
+                {
+                    'drug_id': row['drug_id'],
+                    'drug_name': row['drug__name'],
+                    'quantity': row['quantity'],
+                    'max_error': 0,
+                }
+                for row in exact_top_sellers(start, limit)
+            ]
+            return Response({'window': window, 'source': 'exact', 'error_bound': 0, 'results': results})
+        
+        top = sketch.top(limit)
+        from inventory.models import Drug
+        names = dict(Drug.objects.filter(id__in=[key for key, _, _ in top]).values_list('id', 'name'))
+        results = [
+            {
+                'drug_id': drug_id,
+                'drug_name': names.get(drug_id),
+                'quantity': count,
+                'max_error': error,
+            }
+            for drug_id, count, error in top
+        ]
+        
+        return Response({
+            'window': window,
+            'source': 'sketch',
+            'total_quantity': sketch.total,
+            'error_bound': sketch.error_bound,
+            'results': results,
+        })
+    
     @action(detail=False, methods=['get'])
     def daily_report(self, request):
         """Generate daily sales report."""
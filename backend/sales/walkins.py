@@ -0,0 +1,84 @@
+"""
+Linking walk-in sales to patient records.
+
+Walk-in sales only carry a free-text ``customer_name`` and
+``customer_phone``. Patients are indexed once by the trailing digits of
+their phone number; each unlinked sale is then matched with a dict
+lookup. Phone numbers shared by several patients are ambiguous and left
+alone, and by default the sale's name must also sound like the
+patient's, so a family member buying on a shared phone is not linked to
+the wrong record.
+"""
+from collections import defaultdict
+from django.db import transaction
+from users.dedup import PHONE_KEY_DIGITS, soundex
+from users.models import User, normalize_name, normalize_phone
+from users.stats import Purchase, apply_purchase_changes
+from .models import Sale
+
+BATCH_SIZE = 2000
+
+
+def _phone_key(phone):
+    digits = normalize_phone(phone)
+    return digits[-PHONE_KEY_DIGITS:] if len(digits) >= 7 else ''
+
+
+def _names_agree(customer_name, first_name, last_name):
+    codes = {soundex(word) for word in normalize_name(customer_name).split()}
+    return bool(codes & {soundex(first_name), soundex(last_name)} - {''})
+
+
+def patient_phone_index():
+    """``{phone key: (id, first_name, last_name)}`` for phones owned by one patient."""
+    owners = defaultdict(list)
+    rows = User.objects.filter(role='PATIENT', is_active=True).exclude(phone_normalized='').values_list(
+        'id', 'phone_normalized', 'first_name', 'last_name'
+    )
+    for user_id, phone, first_name, last_name in rows.iterator(chunk_size=5000):
+        key = _phone_key(phone)
+        if key:
+            owners[key].append((user_id, first_name, last_name))
+    return {key: matches[0] for key, matches in owners.items() if len(matches) == 1}
+
+
+def link_walkin_sales(require_name=True, dry_run=False, batch_size=BATCH_SIZE):
+    """Link unlinked sales to patients by phone; returns ``(linked, examined)``."""
+    index = patient_phone_index()
+    sales = Sale.objects.filter(customer__isnull=True).exclude(customer_phone='').values_list(
+        'id', 'customer_phone', 'customer_name'
+    )
+    links = []
+    examined = 0
+    for sale_id, phone, name in sales.iterator(chunk_size=batch_size):
+        examined += 1
+        match = index.get(_phone_key(phone))
+        if match is None:
+            continue
+        user_id, first_name, last_name = match
+        if require_name and not _names_agree(name, first_name, last_name):
+            continue
+        links.append((sale_id, user_id))
+
+    if not dry_run:
+        link_sales(links, batch_size)
+    return len(links), examined
+
+
+def link_sales(links, batch_size=BATCH_SIZE):
+    """Set ``Sale.customer`` for ``(sale id, user id)`` pairs of still unlinked sales."""
+    if not links:
+        return
+    with transaction.atomic():
+        for start in range(0, len(links), batch_size):
+            batch = links[start:start + batch_size]
+            amounts = dict(
+                Sale.objects.filter(pk__in=[sale_id for sale_id, _ in batch], customer__isnull=True)
+                .select_for_update().values_list('id', 'total_amount')
+            )
+            batch = [(sale_id, user_id) for sale_id, user_id in batch if sale_id in amounts]
+            Sale.objects.bulk_update([Sale(pk=sale_id, customer_id=user_id) for sale_id, user_id in batch], ['customer'])
+            apply_purchase_changes([(None, Purchase(user_id, amounts[sale_id])) for sale_id, user_id in batch])
+        # bulk_update bypasses signals
+        from reports.jobs import bump_data_version
+        transaction.on_commit(bump_data_version)
@@ -3,3 +3,9 @@ from django.apps import AppConfig
 
 class UsersConfig(AppConfig):
     name = 'users'
+    
+    def ready(self):
+        from backend.metrics import register_collector
+        from . import hashing, signals
+        signals.connect()
+        register_collector(hashing.collect_metrics)
@@ -0,0 +1,100 @@
+"""
+JWT authentication that resolves users from the cache.
+
+Tokens carry the user's ``role`` and ``token_version`` (``ver``) claims.
+The fields authentication needs (:data:`CACHED_FIELDS`, never the
+password hash) are cached by user id for ``AUTH_USER_CACHE_TTL`` seconds
+and compared with the token's version, so most requests need no user
+query at all; other fields load on first access. Saving or deleting a
+user drops the cached entry; password, role and activation changes also
+bump ``token_version``, which rejects every token issued before the
+change, so the ``role`` claim of an accepted token is current and the
+permission classes read it. Access tokens issued before versioning are
+checked against the database on every request until they expire;
+refresh tokens without a version are refused. Single tokens revoked by
+logout or refresh rotation are rejected through ``users.revocation``.
+
+Queryset ``update()`` calls bypass both, so code that changes roles or
+deactivates users in bulk must also bump ``token_version`` and call
+:func:`forget_user`.
+"""
+from django.conf import settings
+from django.contrib.auth import get_user_model
+from django.core.cache import cache
+from django.db import DEFAULT_DB_ALIAS, transaction
+from django.utils.translation import gettext_lazy as _
+from rest_framework.exceptions import AuthenticationFailed
+from rest_framework_simplejwt.authentication import JWTAuthentication
+from rest_framework_simplejwt.exceptions import InvalidToken
+from rest_framework_simplejwt.settings import api_settings
+from .revocation import is_revoked
+
+VERSION_CLAIM = 'ver'
+ROLE_CLAIM = 'role'
+
+# User fields kept in the cache; the rest load from the database on access
+CACHED_FIELDS = (
+    'id', 'email', 'first_name', 'last_name', 'role', 'is_active', 'is_staff', 'is_superuser', 'token_version',
+)
+
+
+def user_cache_key(user_id):
+    return f'auth:user:{user_id}'
+
+
+def forget_user(user_id):
+    """Drop the cached user once the current transaction commits."""
+    transaction.on_commit(lambda: cache.delete(user_cache_key(user_id)))
+
+
+def add_user_claims(token, user):
+    token[ROLE_CLAIM] = user.role
+    token[VERSION_CLAIM] = user.token_version
+    return token
+
+
+def get_token_user(token):
+    """
+    Return the active user ``token`` was issued to, from the cache when
+    possible. Raises ``AuthenticationFailed`` if the token's version is
+    outdated or the user is gone or inactive.
+    """
+    try:
+        user_id = token[api_settings.USER_ID_CLAIM]
+    except KeyError:
+        raise InvalidToken(_('Token contained no recognizable user identification'))
+
+    User = get_user_model()
+    # from_db() takes the values in model field order
+    names = [field.attname for field in User._meta.concrete_fields if field.attname in CACHED_FIELDS]
+    version = token.get(VERSION_CLAIM)
+    key = user_cache_key(user_id)
+    # Tokens issued before versioning cannot be checked against the cache
+    values = cache.get(key) if version is not None else None
+    if values is not None:
+        user = User.from_db(DEFAULT_DB_ALIAS, names, values)
+    else:
+        try:
+            user = User.objects.get(**{api_settings.USER_ID_FIELD: user_id})
+        except User.DoesNotExist:
+            raise AuthenticationFailed(_('User not found'), code='user_not_found')
+        cache.set(key, [getattr(user, name) for name in names], settings.AUTH_USER_CACHE_TTL)
+
+    if version is not None and user.token_version != version:
+        raise AuthenticationFailed(_('Token has been revoked'), code='token_revoked')
+    if not api_settings.USER_AUTHENTICATION_RULE(user):
+        raise AuthenticationFailed(_('User is inactive'), code='user_inactive')
+    return user
+
+
+class CachedJWTAuthentication(JWTAuthentication):
+    """``JWTAuthentication`` backed by a short-lived user cache."""
+
+    def get_validated_token(self, raw_token):
+        token = super().get_validated_token(raw_token)
+        if is_revoked(token.get(api_settings.JTI_CLAIM)):
+            raise InvalidToken(_('Token has been revoked'))
+        return token
+
+    def get_user(self, validated_token):
+        return get_token_user(validated_token)
@@ -0,0 +1,125 @@
+"""
+Duplicate patient detection.
+
+Comparing every pair of patients is quadratic, so records are grouped by
+blocking keys (phone number, phonetic name codes, date of birth combined
+with a phonetic code) and only records sharing a key are compared. Each
+record has at most five keys and blocks larger than ``MAX_BLOCK_SIZE``
+(a clinic's shared phone number, say) are skipped, so the work grows
+linearly with the number of patients.
+"""
+from collections import defaultdict, namedtuple
+from difflib import SequenceMatcher
+from .models import normalize_name
+
+Record = namedtuple('Record', 'id name first last phone dob')
+
+# Trailing digits compared, so numbers with and without country code match
+PHONE_KEY_DIGITS = 9
+MAX_BLOCK_SIZE = 200
+DEFAULT_THRESHOLD = 0.6
+
+SOUNDEX_CODES = {
+    **dict.fromkeys('bfpv', '1'),
+    **dict.fromkeys('cgjkqsxz', '2'),
+    **dict.fromkeys('dt', '3'),
+    'l': '4',
+    **dict.fromkeys('mn', '5'),
+    'r': '6',
+}
+
+
+def soundex(name):
+    """American Soundex code of the first word of ``name`` ('' if none)."""
+    letters = [char for char in normalize_name(name).split(' ')[0] if 'a' <= char <= 'z']
+    if not letters:
+        return ''
+    code = letters[0].upper()
+    previous = SOUNDEX_CODES.get(letters[0], '')
+    for char in letters[1:]:
+        digit = SOUNDEX_CODES.get(char, '')
+        if digit and digit != previous:
+            code += digit
+            if len(code) == 4:
+                break
+        # 'h' and 'w' do not separate letters with the same code
+        if char not in 'hw':
+            previous = digit
+    return code.ljust(4, '0')
+
+
+def to_record(user_id, first_name, last_name, phone_normalized, date_of_birth):
+    return Record(
+        user_id, normalize_name(f'{first_name} {last_name}'), soundex(first_name), soundex(last_name),
+        phone_normalized[-PHONE_KEY_DIGITS:] if len(phone_normalized) >= 7 else '', date_of_birth,
+    )
+
+
+def blocking_keys(record):
+    keys = []
+    if record.phone:
+        keys.append(f'p:{record.phone}')
+    if record.last:
+        keys.append(f'n:{record.last}:{record.first}')
+    if record.dob:
+        if record.last:
+            keys.append(f'dl:{record.dob}:{record.last}')
+        # Catches last name changes, e.g. after marriage
+        if record.first:
+            keys.append(f'df:{record.dob}:{record.first}')
+    return keys
+
+
+def score(a, b):
+    """``(score, reasons)`` for a pair of records; scores range over about -0.25..1."""
+    name = SequenceMatcher(None, a.name, b.name).ratio()
+    total = 0.45 * name
+    reasons = []
+    if name >= 0.85:
+        reasons.append('name')
+    elif a.last and a.last == b.last and a.first == b.first:
+        reasons.append('name_sound')
+    if a.phone and a.phone == b.phone:
+        total += 0.3
+        reasons.append('phone')
+    if a.dob and b.dob:
+        if a.dob == b.dob:
+            total += 0.25
+            reasons.append('date_of_birth')
+        else:
+            total -= 0.25
+    return round(total, 3), reasons
+
+
+def find_candidates(records, threshold=DEFAULT_THRESHOLD, max_block_size=MAX_BLOCK_SIZE):
+    """
+    Return ``(candidates, stats)``; candidates are ``(id_a, id_b, score, reasons)``
+    tuples with ``id_a < id_b``.
+    """
+    blocks = defaultdict(list)
+    count = 0
+    for record in records:
+        count += 1
+        for key in blocking_keys(record):
+            blocks[key].append(record)
+
+    seen = set()
+    candidates = []
+    skipped = comparisons = 0
+    for members in blocks.values():
+        if len(members) > max_block_size:
+            skipped += 1
+            continue
+        for i, a in enumerate(members):
+            for b in members[i + 1:]:
+                pair = (a.id, b.id) if a.id < b.id else (b.id, a.id)
+                if pair in seen:
+                    continue
+                seen.add(pair)
+                comparisons += 1
+                value, reasons = score(a, b)
+                if value >= threshold:
+                    candidates.append((*pair, value, reasons))
+
+    stats = {'records': count, 'blocks': len(blocks), 'skipped_blocks': skipped, 'comparisons': comparisons}
+    return candidates, stats
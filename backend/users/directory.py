@@ -0,0 +1,83 @@
+"""
+Patient directory lookup for the point of sale.
+
+Names are matched against ``User.search_name`` and phone numbers against
+``User.phone_normalized``; both carry GIN trigram indexes, so substring
+matches do not scan the table. Results are ranked (prefix matches
+first, then word-prefix or suffix matches, then other substrings) and
+ordered by ``(rank, matched value, id)``, which is also the keyset the
+opaque cursor holds.
+"""
+import base64
+import json
+from django.db.models import Case, F, IntegerField, Q, Value, When
+from .models import normalize_name, normalize_phone
+
+PAGE_SIZE = 20
+MAX_PAGE_SIZE = 100
+MIN_TERM_LENGTH = 2
+
+
+def _match(term):
+    """``(field, filter, rank expression)`` for a search term."""
+    digits = normalize_phone(term)
+    if digits and not any(char.isalpha() for char in term):
+        field, needle = 'phone_normalized', digits
+        # Staff often type the local part of a number stored with country code
+        second = Q(phone_normalized__endswith=needle)
+        condition = Q(phone_normalized__contains=needle)
+    else:
+        field, needle = 'search_name', normalize_name(term)
+        words = needle.split()
+        second = Q(search_name__startswith=words[0]) | Q(search_name__contains=f' {words[0]}') if words else Q()
+        condition = Q()
+        for word in words:
+            # Words too short for a trigram only match at a word start
+            if len(word) < 3:
+                condition &= Q(search_name__startswith=word) | Q(search_name__contains=f' {word}')
+            else:
+                condition &= Q(search_name__contains=word)
+    if len(needle) < MIN_TERM_LENGTH:
+        raise ValueError(f'Search term must contain at least {MIN_TERM_LENGTH} characters')
+    rank = Case(
+        When(**{f'{field}__startswith': needle}, then=Value(0)),
+        When(second, then=Value(1)),
+        default=Value(2),
+        output_field=IntegerField(),
+    )
+    return field, condition, rank
+
+
+def lookup_page(queryset, term, cursor=None, page_size=PAGE_SIZE):
+    """Return ``(users, next_cursor)`` for one page of matches of ``term``."""
+    field, condition, rank = _match(term)
+    queryset = queryset.filter(condition).annotate(rank=rank, key=F(field))
+    if cursor:
+        rank_after, key_after, id_after = decode_cursor(cursor)
+        queryset = queryset.filter(
+            Q(rank__gt=rank_after)
+            | Q(rank=rank_after, key__gt=key_after)
+            | Q(rank=rank_after, key=key_after, id__gt=id_after)
+        )
+    users = list(queryset.order_by('rank', 'key', 'id')[:page_size + 1])
+
+    next_cursor = None
+    if len(users) > page_size:
+        users = users[:page_size]
+        last = users[-1]
+        next_cursor = encode_cursor(last.rank, last.key, last.pk)
+    return users, next_cursor
+
+
+def encode_cursor(rank, key, pk):
+    payload = json.dumps([rank, key, pk]).encode()
+    return base64.urlsafe_b64encode(payload).decode()
+
+
+def decode_cursor(cursor):
+    """Parse a cursor from :func:`encode_cursor`; raises ``ValueError`` if malformed."""
+    try:
+        rank, key, pk = json.loads(base64.urlsafe_b64decode(cursor.encode()))
+        return int(rank), str(key), int(pk)
+    except (TypeError, ValueError, UnicodeDecodeError) as exc:
+        raise ValueError('Invalid cursor') from exc
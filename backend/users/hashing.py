@@ -0,0 +1,158 @@
+"""
+Password hashing on a bounded worker pool.
+
+Hashing a password with PBKDF2 takes hundreds of milliseconds of CPU.
+``User.check_password`` and ``User.set_password`` run it on a pool of
+``PASSWORD_HASH_WORKERS`` threads (``hashlib`` releases the GIL, so they
+run in parallel) and at most ``PASSWORD_HASH_QUEUE_SIZE`` more wait for a
+worker. Beyond that :class:`HashingBusy` answers 503 straight away instead
+of letting a burst of logins pile up behind the CPU.
+
+After a successful check, passwords stored with an outdated hasher or
+iteration count are rehashed in the background with the preferred one
+(the first of ``PASSWORD_HASHERS``).
+"""
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from django.conf import settings
+from django.contrib.auth import hashers
+from django.core.cache import cache
+from django.db import close_old_connections
+from rest_framework.exceptions import APIException
+
+_executor = None
+_executor_lock = threading.Lock()
+
+_lock = threading.Lock()
+_stats = {
+    'queued': 0,
+    'running': 0,
+    'peak_queued': 0,
+    'completed': 0,
+    'rejected': 0,
+    'upgraded': 0,
+    'wait_seconds': 0.0,
+}
+
+
+class HashingBusy(APIException):
+    status_code = 503
+    default_detail = 'Too many logins in progress, please try again shortly.'
+    default_code = 'hashing_busy'
+
+
+class PBKDF2PasswordHasher(hashers.PBKDF2PasswordHasher):
+    """PBKDF2-SHA256 with the iteration count taken from ``PASSWORD_HASH_ITERATIONS``."""
+    
+    @property
+    def iterations(self):
+        return settings.PASSWORD_HASH_ITERATIONS or hashers.PBKDF2PasswordHasher.iterations
+
+
+def _get_executor():
+    global _executor
+    if _executor is None:
+        with _executor_lock:
+            if _executor is None:
+                _executor = ThreadPoolExecutor(
+                    max_workers=settings.PASSWORD_HASH_WORKERS,
+                    thread_name_prefix='password-hash',
+                )
+    return _executor
+
+
+def _submit(func, *args):
+    with _lock:
+        if _stats['queued'] >= settings.PASSWORD_HASH_QUEUE_SIZE:
+            _stats['rejected'] += 1
+            return None
+        _stats['queued'] += 1
+        _stats['peak_queued'] = max(_stats['peak_queued'], _stats['queued'])
+    return _get_executor().submit(_call, time.monotonic(), func, args)
+
+
+def _call(submitted, func, args):
+    with _lock:
+        _stats['queued'] -= 1
+        _stats['running'] += 1
+        _stats['wait_seconds'] += time.monotonic() - submitted
+    try:
+        return func(*args)
+    finally:
+        with _lock:
+            _stats['running'] -= 1
+            _stats['completed'] += 1
+
+
+def run(func, *args):
+    """Run ``func(*args)`` on the pool and wait for it; inline if the pool is disabled."""
+    if not settings.PASSWORD_HASH_WORKERS:
+        return func(*args)
+    future = _submit(func, *args)
+    if future is None:
+        raise HashingBusy()
+    return future.result()
+
+
+def stats():
+    """Snapshot of the pool counters, for metrics."""
+    with _lock:
+        return dict(_stats, workers=settings.PASSWORD_HASH_WORKERS,
+                    queue_size=settings.PASSWORD_HASH_QUEUE_SIZE)
+
+
+def collect_metrics(family):
+    """Pool metric families; registered with ``backend.metrics`` by the app config."""
+    pool = stats()
+    family('medixhub_password_hash_workers', 'gauge', 'Password hashing threads.', [('', pool['workers'])])
+    family('medixhub_password_hash_queue_size', 'gauge', 'Password hashing queue limit.', [('', pool['queue_size'])])
+    family('medixhub_password_hash_queued', 'gauge', 'Password hashes waiting for a thread.', [('', pool['queued'])])
+    family('medixhub_password_hash_running', 'gauge', 'Password hashes being computed.', [('', pool['running'])])
+    family('medixhub_password_hash_completed_total', 'counter', 'Password hashes computed.', [('', pool['completed'])])
+    family('medixhub_password_hash_rejected_total', 'counter', 'Password hashes refused with a full queue.',
+           [('', pool['rejected'])])
+    family('medixhub_password_hash_wait_seconds_total', 'counter', 'Time password hashes spent queued.',
+           [('', pool['wait_seconds'])])
+
+
+def make_password(raw_password):
+    return run(hashers.make_password, raw_password)
+
+
+def check_password(user, raw_password):
+    """Check ``raw_password`` against ``user`` and schedule a rehash if it is outdated."""
+    encoded = user.password
+
+    def setter(raw_password):
+        if user.pk is None:
+            return
+        if settings.PASSWORD_HASH_WORKERS:
+            # Best effort: if the pool is full the upgrade waits for the next login
+            _submit(_upgrade_in_background, user.pk, encoded, raw_password)
+        else:
+            _upgrade(user.pk, encoded, raw_password)
+
+    return run(hashers.check_password, raw_password, encoded, setter)
+
+
+def _upgrade(user_id, encoded, raw_password):
+    # A queryset update neither bumps token_version nor touches a password
+    # that was changed while the new hash was being computed
+    from .authentication import user_cache_key
+    from .models import User
+    updated = User.objects.filter(pk=user_id, password=encoded).update(
+        password=hashers.make_password(raw_password)
+    )
+    if updated:
+        cache.delete(user_cache_key(user_id))
+        with _lock:
+            _stats['upgraded'] += 1
+
+
+def _upgrade_in_background(*args):
+    close_old_connections()
+    try:
+        _upgrade(*args)
+    finally:
+        close_old_connections()
@@ -0,0 +1,183 @@
+"""
+Bulk patient import.
+
+Rows are read as a stream and handled in chunks. Each chunk is validated
+with a light serializer (no password validators, no per-row uniqueness
+queries), checked for existing emails (case-insensitively) and phone
+numbers (digits only, as in ``phone_normalized``) with one query, and
+inserted with ``bulk_create``. Imported patients get an unusable
+password; they choose one through an invite link, so no password is
+hashed during the import. Invite links stay valid for
+``PATIENT_INVITE_TIMEOUT`` seconds rather than the password reset
+timeout, since patients may not open them for a while.
+"""
+import csv
+import json
+import re
+from itertools import islice
+from django.conf import settings
+from django.contrib.auth import hashers
+from django.contrib.auth.tokens import PasswordResetTokenGenerator
+from django.core.mail import EmailMessage, get_connection
+from django.db import IntegrityError, transaction
+from django.db.models import Q
+from django.db.models.functions import Lower
+from django.utils.crypto import constant_time_compare
+from django.utils.encoding import force_bytes
+from django.utils.http import base36_to_int, urlsafe_base64_encode
+from rest_framework import serializers
+from .models import User, normalize_phone
+
+BATCH_SIZE = 1000
+
+
+def clean_phone(value):
+    """Strip everything but digits and a leading ``+``."""
+    value = (value or '').strip()
+    return ('+' if value.startswith('+') else '') + re.sub(r'\D', '', value)
+
+
+class PatientImportSerializer(serializers.Serializer):
+    email = serializers.EmailField()
+    first_name = serializers.CharField(max_length=100)
+    last_name = serializers.CharField(max_length=100)
+    phone_number = serializers.CharField(max_length=17, required=False, allow_blank=True, default='')
+    date_of_birth = serializers.DateField(required=False, allow_null=True, default=None)
+    gender = serializers.ChoiceField(choices=User.GENDER_CHOICES, required=False, allow_blank=True, default='')
+    address = serializers.CharField(required=False, allow_blank=True, default='')
+    
+    def validate_email(self, value):
+        return User.objects.normalize_email(value)
+    
+    def validate_phone_number(self, value):
+        value = clean_phone(value)
+        if value:
+            User.phone_regex(value)
+        return value
+    
+    def to_internal_value(self, data):
+        # CSV cells are always strings; treat empty ones as missing
+        if isinstance(data, dict):
+            data = {key: value for key, value in data.items() if value not in ('', None)}
+        return super().to_internal_value(data)
+
+
+def read_rows(handle, fmt):
+    """Yield row dicts from a CSV or NDJSON file object."""
+    if fmt == 'csv':
+        yield from csv.DictReader(handle)
+        return
+    for line in handle:
+        if line.strip():
+            yield json.loads(line)
+
+
+def import_patients(rows, batch_size=BATCH_SIZE, match_phone=True, on_created=None):
+    """
+    Create patients from an iterable of row dicts.
+
+    Rows whose email (or phone number, with ``match_phone``) matches an
+    existing user or an earlier row are skipped as duplicates.
+    ``on_created`` is called with each chunk of created users after it is
+    committed. Returns ``(created, duplicates, errors)`` where ``errors``
+    is a list of ``(row number, errors)``.
+    """
+    seen_emails = set()
+    seen_phones = set()
+    created = duplicates = 0
+    errors = []
+    rows = enumerate(rows, start=1)
+    while chunk := list(islice(rows, batch_size)):
+        valid = []
+        for number, row in chunk:
+            serializer = PatientImportSerializer(data=row)
+            if serializer.is_valid():
+                valid.append(serializer.validated_data)
+            else:
+                errors.append((number, serializer.errors))
+
+        emails = {data['email'].lower() for data in valid}
+        phones = {normalize_phone(data['phone_number']) for data in valid} - {''} if match_phone else set()
+        lookup = Q(email_lower__in=emails)
+        if phones:
+            lookup |= Q(phone_normalized__in=phones)
+        existing = User.objects.annotate(email_lower=Lower('email')).filter(lookup)
+        for email, phone in existing.values_list('email_lower', 'phone_normalized'):
+            seen_emails.add(email)
+            if match_phone and phone:
+                seen_phones.add(phone)
+
+        users = []
+        for data in valid:
+            email, phone = data['email'].lower(), normalize_phone(data['phone_number'])
+            if email in seen_emails or (match_phone and phone and phone in seen_phones):
+                duplicates += 1
+                continue
+            seen_emails.add(email)
+            if phone:
+                seen_phones.add(phone)
+            user = User(**data, role='PATIENT', password=hashers.make_password(None))
+            user.set_search_fields()
+            users.append(user)
+
+        try:
+            with transaction.atomic():
+                User.objects.bulk_create(users)
+        except IntegrityError:
+            # Someone registered with one of these emails since the lookup
+            taken = set(User.objects.filter(email__in=[user.email for user in users]).values_list('email', flat=True))
+            duplicates += sum(user.email in taken for user in users)
+            users = [user for user in users if user.email not in taken]
+            with transaction.atomic():
+                User.objects.bulk_create(users)
+        created += len(users)
+        if users and on_created:
+            on_created(users)
+    return created, duplicates, errors
+
+
+class InviteTokenGenerator(PasswordResetTokenGenerator):
+    """Password reset style tokens that expire after ``PATIENT_INVITE_TIMEOUT``."""
+    
+    key_salt = 'users.importing.InviteTokenGenerator'
+    
+    def check_token(self, user, token):
+        # The base class compares the age against PASSWORD_RESET_TIMEOUT
+        if not (user and token):
+            return False
+        try:
+            ts_b36, _ = token.split('-')
+            ts = base36_to_int(ts_b36)
+        except ValueError:
+            return False
+        if not any(
+            constant_time_compare(self._make_token_with_timestamp(user, ts, secret), token)
+            for secret in [self.secret, *self.secret_fallbacks]
+        ):
+            return False
+        return self._num_seconds(self._now()) - ts <= settings.PATIENT_INVITE_TIMEOUT
+
+
+invite_token_generator = InviteTokenGenerator()
+
+
+def invite_token(user):
+    """``(uidb64, token)`` for setting the first password; used up once it is set."""
+    return urlsafe_base64_encode(force_bytes(user.pk)), invite_token_generator.make_token(user)
+
+
+def send_invites(users):
+    """Email an invite link to each user over a single SMTP connection."""
+    messages = []
+    for user in users:
+        uid, token = invite_token(user)
+        link = settings.PATIENT_INVITE_URL.format(uid=uid, token=token)
+        messages.append(EmailMessage(
+            subject='Set up your MedixHub account',
+            body=(
+                f'Hello {user.first_name},\n\n'
+                f'An account has been created for you. Choose a password here:\n{link}\n'
+            ),
+            to=[user.email],
+        ))
+    return get_connection().send_messages(messages) or 0
@@ -0,0 +1,69 @@
+import statistics
+import time
+from concurrent.futures import ThreadPoolExecutor
+from django.core.management.base import BaseCommand, CommandError
+from django.db import close_old_connections
+from rest_framework.test import APIRequestFactory
+from users import hashing
+from users.views import LoginView
+
+
+class Command(BaseCommand):
+    help = 'Measure login latency with many concurrent clients.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('email')
+        parser.add_argument('password')
+        parser.add_argument('--clients', type=int, default=50,
+                            help='Number of concurrent clients.')
+        parser.add_argument('--requests', type=int, default=200,
+                            help='Total number of logins.')
+
+    def handle(self, *args, **options):
+        # Throttling would turn most of the burst into 429s
+        view = LoginView.as_view(throttle_classes=[])
+        factory = APIRequestFactory()
+        body = {'email': options['email'], 'password': options['password']}
+
+        def login(_):
+            close_old_connections()
+            try:
+                request = factory.post('/api/auth/login/', body, format='json')
+                started = time.perf_counter()
+                response = view(request)
+                return response.status_code, (time.perf_counter() - started) * 1000
+            finally:
+                close_old_connections()
+
+        status, _ = login(None)
+        if status != 200:
+            raise CommandError(f'Login failed with status {status}')
+
+        before = hashing.stats()
+        started = time.perf_counter()
+        with ThreadPoolExecutor(max_workers=options['clients']) as clients:
+            results = list(clients.map(login, range(options['requests'])))
+        elapsed = time.perf_counter() - started
+        after = hashing.stats()
+
+        samples = sorted(ms for status, ms in results if status == 200)
+        failed = len(results) - len(samples)
+        if not samples:
+            raise CommandError(f'All {failed} logins failed')
+        quantiles = statistics.quantiles(samples, n=100, method='inclusive')
+        self.stdout.write(
+            f"{len(results)} logins from {options['clients']} clients in {elapsed:.1f} s "
+            f'({len(results) / elapsed:.1f}/s), {failed} failed'
+        )
+        self.stdout.write(
+            f'latency p50 {quantiles[49]:.0f} ms, p90 {quantiles[89]:.0f} ms, '
+            f'p99 {quantiles[98]:.0f} ms, max {samples[-1]:.0f} ms'
+        )
+        if after['workers']:
+            checks = after['completed'] - before['completed']
+            waited = after['wait_seconds'] - before['wait_seconds']
+            self.stdout.write(
+                f"hash pool: {after['workers']} workers, peak queue {after['peak_queued']}, "
+                f"{after['rejected'] - before['rejected']} rejected, "
+                f'mean queue wait {waited / max(checks, 1) * 1000:.0f} ms'
+            )
@@ -0,0 +1,51 @@
+from django.core.management.base import BaseCommand
+from django.db import transaction
+from django.utils import timezone
+from users.dedup import DEFAULT_THRESHOLD, MAX_BLOCK_SIZE, find_candidates, to_record
+from users.models import DuplicateCandidate, User
+
+
+class Command(BaseCommand):
+    help = 'Find probable duplicate patient records and store them for review.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--threshold', type=float, default=DEFAULT_THRESHOLD,
+                            help='Minimum score for a pair to be reported.')
+        parser.add_argument('--max-block-size', type=int, default=MAX_BLOCK_SIZE,
+                            help='Skip blocking keys shared by more records than this.')
+        parser.add_argument('--dry-run', action='store_true',
+                            help='Report the number of candidates without saving them.')
+
+    def handle(self, *args, **options):
+        started = timezone.now()
+        rows = User.objects.filter(role='PATIENT', is_active=True).values_list(
+            'id', 'first_name', 'last_name', 'phone_normalized', 'date_of_birth'
+        )
+        candidates, stats = find_candidates(
+            (to_record(*row) for row in rows.iterator(chunk_size=5000)),
+            threshold=options['threshold'],
+            max_block_size=options['max_block_size'],
+        )
+        self.stdout.write(
+            f"Compared {stats['comparisons']} pair(s) of {stats['records']} patient(s) "
+            f"in {stats['blocks']} block(s), skipped {stats['skipped_blocks']} oversized block(s)"
+        )
+        if options['dry_run']:
+            self.stdout.write(f'Would store {len(candidates)} candidate(s)')
+            return
+
+        with transaction.atomic():
+            DuplicateCandidate.objects.bulk_create(
+                [
+                    DuplicateCandidate(user_a_id=a, user_b_id=b, score=value, reasons=reasons, detected_at=started)
+                    for a, b, value, reasons in candidates
+                ],
+                batch_size=2000,
+                update_conflicts=True,
+                unique_fields=['user_a', 'user_b'],
+                update_fields=['score', 'reasons', 'detected_at'],
+            )
+            # Pending pairs that no longer match were fixed or changed since
+            stale, _ = DuplicateCandidate.objects.filter(status='PENDING', detected_at__lt=started).delete()
+
+        self.stdout.write(f'Stored {len(candidates)} candidate(s), removed {stale} stale one(s)')
@@ -0,0 +1,31 @@
+from django.core.management.base import BaseCommand
+from django.db.models import F, Q
+from django.db.models.fields.json import KeyTextTransform
+from users.models import User
+from users.thumbnails import generate
+
+
+class Command(BaseCommand):
+    help = 'Render missing or outdated profile picture thumbnails.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--all', action='store_true',
+                            help='Re-render every thumbnail, e.g. after changing the configured sizes.')
+
+    def handle(self, *args, **options):
+        users = User.objects.exclude(Q(profile_picture='') | Q(profile_picture__isnull=True))
+        if not options['all']:
+            # The recorded source is the picture the thumbnails were made from
+            users = users.annotate(source=KeyTextTransform('source', 'profile_thumbnails')).filter(
+                Q(source__isnull=True) | ~Q(source=F('profile_picture'))
+            )
+
+        done = failed = 0
+        for user_id, source in users.values_list('id', 'profile_picture').iterator():
+            try:
+                generate(user_id, source)
+                done += 1
+            except Exception as exc:
+                failed += 1
+                self.stderr.write(f'User {user_id}: {exc}')
+        self.stdout.write(f'Rendered thumbnails for {done} user(s), {failed} failed')
@@ -0,0 +1,63 @@
+import csv
+import json
+from django.core.management.base import BaseCommand, CommandError
+from users.importing import BATCH_SIZE, import_patients, invite_token, read_rows, send_invites
+
+
+class Command(BaseCommand):
+    help = 'Bulk register patients from a CSV or NDJSON file and issue invite links.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('path', help='File with email, first_name, last_name and optional '
+                                         'phone_number, date_of_birth, gender and address columns.')
+        parser.add_argument('--format', choices=['csv', 'jsonl'], default=None,
+                            help='Input format (default: guessed from the file extension).')
+        parser.add_argument('--batch-size', type=int, default=BATCH_SIZE)
+        parser.add_argument('--no-phone-match', action='store_true',
+                            help='Only treat matching emails as duplicates (e.g. for shared family phones).')
+        parser.add_argument('--send-invites', action='store_true',
+                            help='Email each new patient a link to choose a password.')
+        parser.add_argument('--invites-file', default=None,
+                            help='Write email, uid and token of every new patient to this CSV file.')
+        parser.add_argument('--max-errors', type=int, default=20,
+                            help='Number of invalid rows to print.')
+
+    def handle(self, *args, **options):
+        path = options['path']
+        fmt = options['format'] or ('jsonl' if path.endswith(('.jsonl', '.ndjson')) else 'csv')
+
+        invites = open(options['invites_file'], 'w', newline='', encoding='utf-8') if options['invites_file'] else None
+        writer = csv.writer(invites) if invites else None
+        if writer:
+            writer.writerow(['email', 'uid', 'token'])
+        sent = 0
+
+        def on_created(users):
+            nonlocal sent
+            if writer:
+                writer.writerows([user.email, *invite_token(user)] for user in users)
+            if options['send_invites']:
+                sent += send_invites(users)
+            if options['verbosity'] > 1:
+                self.stdout.write(f'Created {len(users)} patient(s)')
+
+        try:
+            with open(path, newline='', encoding='utf-8') as handle:
+                created, duplicates, errors = import_patients(
+                    read_rows(handle, fmt),
+                    batch_size=options['batch_size'],
+                    match_phone=not options['no_phone_match'],
+                    on_created=on_created,
+                )
+        except ValueError as exc:
+            raise CommandError(f'Could not read {path}: {exc}')
+        finally:
+            if invites:
+                invites.close()
+
+        for number, row_errors in errors[:options['max_errors']]:
+            self.stderr.write(f'Row {number}: {json.dumps(row_errors)}')
+        self.stdout.write(
+            f'Imported {created} patient(s), skipped {duplicates} duplicate(s) and {len(errors)} invalid row(s)'
+            + (f', sent {sent} invite(s)' if options['send_invites'] else '')
+        )
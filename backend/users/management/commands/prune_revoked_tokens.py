@@ -0,0 +1,10 @@
+from django.core.management.base import BaseCommand
+from users.revocation import prune
+
+
+class Command(BaseCommand):
+    help = 'Delete revoked token records whose tokens have expired.'
+
+    def handle(self, *args, **options):
+        deleted = prune()
+        self.stdout.write(f'Pruned {deleted} revoked token(s)')
@@ -0,0 +1,12 @@
+from django.core.management.base import BaseCommand
+from django.db import transaction
+from users.stats import rebuild
+
+
+class Command(BaseCommand):
+    help = 'Recompute the per-user prescription and purchase counters.'
+
+    def handle(self, *args, **options):
+        with transaction.atomic():
+            rows = rebuild()
+        self.stdout.write(f'Rebuilt counters for {rows} user(s)')
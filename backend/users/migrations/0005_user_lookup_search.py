@@ -0,0 +1,65 @@
+# Generated by Django 6.0 on 2026-10-19 04:25
+
+import unicodedata
+import django.contrib.postgres.indexes
+from django.contrib.postgres.operations import TrigramExtension
+from django.db import migrations, models
+from django.db.models import Q
+
+
+def normalize_name(value):
+    # Copy of users.models.normalize_name as of this migration
+    value = unicodedata.normalize('NFKD', value or '')
+    value = ''.join(char for char in value if not unicodedata.combining(char))
+    return ' '.join(value.lower().split())
+
+
+def fill_search_fields(apps, schema_editor):
+    User = apps.get_model('users', 'User')
+    table = schema_editor.quote_name(User._meta.db_table)
+    # Plain SQL gives the same result as normalize_name() for ASCII names
+    schema_editor.execute(
+        f"UPDATE {table} SET "
+        f"search_name = lower(regexp_replace(btrim(first_name || ' ' || last_name), '\\s+', ' ', 'g')), "
+        f"phone_normalized = regexp_replace(phone_number, '\\D', '', 'g')"
+    )
+    # Names with accents or other non-ASCII characters go through Python
+    batch = []
+    non_ascii = r'[^\x01-\x7F]'
+    rows = User.objects.filter(Q(first_name__regex=non_ascii) | Q(last_name__regex=non_ascii))
+    for user in rows.only('first_name', 'last_name').iterator(chunk_size=2000):
+        user.search_name = normalize_name(f'{user.first_name} {user.last_name}')
+        batch.append(user)
+    User.objects.bulk_update(batch, ['search_name'], batch_size=2000)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('auth', '0012_alter_user_first_name_max_length'),
+        ('users', '0004_user_email_lower'),
+    ]
+
+    operations = [
+        TrigramExtension(),
+        migrations.AddField(
+            model_name='user',
+            name='phone_normalized',
+            field=models.CharField(blank=True, editable=False, max_length=17),
+        ),
+        migrations.AddField(
+            model_name='user',
+            name='search_name',
+            field=models.CharField(blank=True, editable=False, max_length=201),
+        ),
+        # Filled before the indexes exist so the backfill does not update them
+        migrations.RunPython(fill_search_fields, migrations.RunPython.noop),
+        migrations.AddIndex(
+            model_name='user',
+            index=django.contrib.postgres.indexes.GinIndex(fields=['search_name'], name='user_search_name_trgm', opclasses=['gin_trgm_ops']),
+        ),
+        migrations.AddIndex(
+            model_name='user',
+            index=django.contrib.postgres.indexes.GinIndex(fields=['phone_normalized'], name='user_phone_trgm', opclasses=['gin_trgm_ops']),
+        ),
+    ]
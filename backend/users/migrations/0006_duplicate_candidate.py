@@ -0,0 +1,34 @@
+# Generated by Django 6.0 on 2026-10-19 04:28
+
+import django.db.models.deletion
+from django.conf import settings
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('users', '0005_user_lookup_search'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='DuplicateCandidate',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('score', models.FloatField()),
+                ('reasons', models.JSONField(default=list)),
+                ('status', models.CharField(choices=[('PENDING', 'Pending review'), ('CONFIRMED', 'Confirmed duplicate'), ('DISMISSED', 'Not a duplicate')], default='PENDING', max_length=20)),
+                ('detected_at', models.DateTimeField()),
+                ('reviewed_at', models.DateTimeField(blank=True, null=True)),
+                ('reviewed_by', models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.SET_NULL, related_name='+', to=settings.AUTH_USER_MODEL)),
+                ('user_a', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='+', to=settings.AUTH_USER_MODEL)),
+                ('user_b', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='+', to=settings.AUTH_USER_MODEL)),
+            ],
+            options={
+                'ordering': ['-score', 'id'],
+                'indexes': [models.Index(fields=['status', '-score'], name='users_dupli_status_b32251_idx')],
+                'constraints': [models.UniqueConstraint(fields=('user_a', 'user_b'), name='unique_duplicate_pair'), models.CheckConstraint(condition=models.Q(('user_a__lt', models.F('user_b'))), name='duplicate_pair_ordered')],
+            },
+        ),
+    ]
@@ -0,0 +1,58 @@
+# Generated by Django 6.0 on 2026-10-19 04:33
+
+import django.db.models.deletion
+from django.conf import settings
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('users', '0007_user_profile_thumbnails'),
+        ('prescriptions', '0005_doctor_patient'),
+        ('sales', '0004_timeline_indexes'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='UserStats',
+            fields=[
+                ('user', models.OneToOneField(on_delete=django.db.models.deletion.CASCADE, primary_key=True, related_name='stats', serialize=False, to=settings.AUTH_USER_MODEL)),
+                ('prescriptions_total', models.IntegerField(default=0)),
+                ('prescriptions_pending', models.IntegerField(default=0)),
+                ('prescriptions_filled', models.IntegerField(default=0)),
+                ('prescriptions_issued', models.IntegerField(default=0)),
+                ('purchases_count', models.IntegerField(default=0)),
+                ('purchases_total', models.DecimalField(decimal_places=2, default=0, max_digits=14)),
+            ],
+            options={
+                'verbose_name_plural': 'user stats',
+            },
+        ),
+        # Backfill counters for existing prescriptions and sales
+        migrations.RunSQL(
+            """
+            INSERT INTO users_userstats
+                (user_id, prescriptions_total, prescriptions_pending, prescriptions_filled,
+                 prescriptions_issued, purchases_count, purchases_total)
+            SELECT COALESCE(p.user_id, d.user_id, s.user_id),
+                   COALESCE(p.total, 0), COALESCE(p.pending, 0), COALESCE(p.filled, 0),
+                   COALESCE(d.issued, 0), COALESCE(s.count, 0), COALESCE(s.amount, 0)
+            FROM (
+                SELECT patient_id AS user_id, COUNT(*) AS total,
+                       COUNT(*) FILTER (WHERE status = 'PENDING') AS pending,
+                       COUNT(*) FILTER (WHERE status = 'FILLED') AS filled
+                FROM prescriptions_prescription GROUP BY patient_id
+            ) p
+            FULL JOIN (
+                SELECT doctor_id AS user_id, COUNT(*) AS issued
+                FROM prescriptions_prescription GROUP BY doctor_id
+            ) d ON d.user_id = p.user_id
+            FULL JOIN (
+                SELECT customer_id AS user_id, COUNT(*) AS count, SUM(total_amount) AS amount
+                FROM sales_sale WHERE customer_id IS NOT NULL GROUP BY customer_id
+            ) s ON s.user_id = COALESCE(p.user_id, d.user_id)
+            """,
+            migrations.RunSQL.noop,
+        ),
+    ]
@@ -1,6 +1,25 @@
+import re
+import unicodedata
 from django.contrib.auth.models import AbstractUser, BaseUserManager
+from django.contrib.postgres.indexes import GinIndex
 from django.db import models
+from django.db.models.functions import Lower
 from django.core.validators import RegexValidator
+from . import hashing, thumbnails
+
+
+SEARCH_SOURCE_FIELDS = {'first_name', 'last_name', 'phone_number'}
+
+
+def normalize_name(value):
+    """Lowercase, accent-free, single-spaced form used for name search."""
+    value = unicodedata.normalize('NFKD', value or '')
+    value = ''.join(char for char in value if not unicodedata.combining(char))
+    return ' '.join(value.lower().split())
+
+
+def normalize_phone(value):
+    return re.sub(r'\D', '', value or '')
 
 
 class UserManager(BaseUserManager):
@@ -55,6 +74,8 @@ class User(AbstractUser):
     gender = models.CharField(max_length=1, choices=GENDER_CHOICES, blank=True)
     address = models.TextField(blank=True)
     profile_picture = models.ImageField(upload_to='profiles/', null=True, blank=True)
+    # Rendered in the background by users.thumbnails
+    profile_thumbnails = models.JSONField(default=dict, blank=True, editable=False)
     
     # Professional Information (for staff)
     license_number = models.CharField(max_length=50, blank=True, unique=True, null=True)
@@ -64,6 +85,13 @@ class User(AbstractUser):
     is_active = models.BooleanField(default=True)
     email_verified = models.BooleanField(default=False)
     
+    # Derived from the fields above on save, for the trigram-indexed lookup
+    search_name = models.CharField(max_length=201, blank=True, editable=False)
+    phone_normalized = models.CharField(max_length=17, blank=True, editable=False)
+    
+    # Embedded in issued JWTs; bumping it invalidates every token of the user
+    token_version = models.PositiveIntegerField(default=0)
+    
     # Timestamps
     created_at = models.DateTimeField(auto_now_add=True)
     updated_at = models.DateTimeField(auto_now=True)
@@ -77,6 +105,10 @@ class User(AbstractUser):
         ordering = ['-created_at']
         indexes = [
             models.Index(fields=['email', 'role']),
+            # Case-insensitive email matching in users.importing
+            models.Index(Lower('email'), name='user_email_lower'),
+            GinIndex(fields=['search_name'], opclasses=['gin_trgm_ops'], name='user_search_name_trgm'),
+            GinIndex(fields=['phone_normalized'], opclasses=['gin_trgm_ops'], name='user_phone_trgm'),
         ]
     
     def __str__(self):
@@ -85,6 +117,69 @@ class User(AbstractUser):
     def get_full_name(self):
         return f"{self.first_name} {self.last_name}".strip()
     
+    @classmethod
+    def from_db(cls, db, field_names, values):
+        instance = super().from_db(db, field_names, values)
+        instance._auth_state = instance._auth_fields()
+        instance._picture_name = instance._current_picture_name()
+        return instance
+    
+    def _auth_fields(self):
+        # Read from __dict__ so deferred fields are not loaded here
+        return (self.__dict__.get('role'), self.__dict__.get('is_active'))
+    
+    def _current_picture_name(self):
+        value = self.__dict__.get('profile_picture')
+        return getattr(value, 'name', value) or ''
+    
+    def set_search_fields(self):
+        self.search_name = normalize_name(f'{self.first_name} {self.last_name}')
+        self.phone_normalized = normalize_phone(self.phone_number)
+    
+    def save(self, *args, **kwargs):
+        update_fields = kwargs.get('update_fields')
+        if update_fields is None or SEARCH_SOURCE_FIELDS.intersection(update_fields):
+            self.set_search_fields()
+            if update_fields is not None:
+                update_fields = {*update_fields, 'search_name', 'phone_normalized'}
+        
+        picture_changed = (
+            (update_fields is None or 'profile_picture' in update_fields)
+            and 'profile_picture' in self.__dict__
+            and self._current_picture_name() != getattr(self, '_picture_name', '')
+        )
+        if picture_changed:
+            self.profile_thumbnails = {}
+            if update_fields is not None:
+                update_fields = {*update_fields, 'profile_thumbnails'}
+        
+        # A password, role or activation change revokes outstanding tokens
+        auth_state = getattr(self, '_auth_state', None)
+        changed = auth_state is not None and auth_state != self._auth_fields()
+        if self.pk and (getattr(self, '_revoke_tokens', False) or changed):
+            self.token_version += 1
+            if update_fields is not None:
+                update_fields = {*update_fields, 'token_version'}
+        
+        if update_fields is not None:
+            kwargs['update_fields'] = update_fields
+        super().save(*args, **kwargs)
+        self._revoke_tokens = False
+        self._auth_state = self._auth_fields()
+        self._picture_name = self._current_picture_name()
+        if picture_changed and self._picture_name:
+            thumbnails.schedule(self.pk, self._picture_name)
+    
+    def set_password(self, raw_password):
+        self.password = hashing.make_password(raw_password)
+        self._password = raw_password
+        self._revoke_tokens = True
+    
+    def check_password(self, raw_password):
+        # Hashes on the shared pool; outdated hashes are upgraded without
+        # going through set_password, so tokens stay valid.
+        return hashing.check_password(self, raw_password)
+    
     @property
     def is_admin(self):
         return self.role == 'ADMIN'
@@ -103,4 +198,77 @@ class User(AbstractUser):
     
     @property
     def is_patient(self):
-        return self.role == 'PATIENT'
\ No newline at end of file
+        return self.role == 'PATIENT'
+
+
+class RevokedToken(models.Model):
+    """JWT ids revoked by logout or refresh rotation, kept until they expire."""
+    
+    jti = models.CharField(max_length=64, unique=True)
+    expires_at = models.DateTimeField(db_index=True)
+    revoked_at = models.DateTimeField(auto_now_add=True, db_index=True)
+    
+    def __str__(self):
+        return self.jti
+
+
+class DuplicateCandidate(models.Model):
+    """Two patient records that probably belong to the same person."""
+    
+    STATUSES = [
+        ('PENDING', 'Pending review'),
+        ('CONFIRMED', 'Confirmed duplicate'),
+        ('DISMISSED', 'Not a duplicate'),
+    ]
+    
+    # Stored with user_a < user_b so each pair has exactly one row
+    user_a = models.ForeignKey(User, on_delete=models.CASCADE, related_name='+')
+    user_b = models.ForeignKey(User, on_delete=models.CASCADE, related_name='+')
+    score = models.FloatField()
+    reasons = models.JSONField(default=list)
+    status = models.CharField(max_length=20, choices=STATUSES, default='PENDING')
+    
+    detected_at = models.DateTimeField()
+    reviewed_by = models.ForeignKey(User, on_delete=models.SET_NULL, null=True, blank=True, related_name='+')
+    reviewed_at = models.DateTimeField(null=True, blank=True)
+    
+    class Meta:
+        ordering = ['-score', 'id']
+        constraints = [
+            models.UniqueConstraint(fields=['user_a', 'user_b'], name='unique_duplicate_pair'),
+            models.CheckConstraint(condition=models.Q(user_a__lt=models.F('user_b')), name='duplicate_pair_ordered'),
+        ]
+        indexes = [
+            models.Index(fields=['status', '-score']),
+        ]
+    
+    def __str__(self):
+        return f"{self.user_a_id} ~ {self.user_b_id} ({self.score:.2f})"
+
+
+class UserStats(models.Model):
+    """
+    Per-user prescription and purchase counters. Kept in step by
+    ``users.stats``; rebuild with ``manage.py rebuild_user_stats`` if it
+    ever drifts. Users without a row have no prescriptions or purchases.
+    """
+    
+    user = models.OneToOneField(User, on_delete=models.CASCADE, primary_key=True, related_name='stats')
+    
+    # As patient
+    prescriptions_total = models.IntegerField(default=0)
+    prescriptions_pending = models.IntegerField(default=0)
+    prescriptions_filled = models.IntegerField(default=0)
+    
+    # As doctor
+    prescriptions_issued = models.IntegerField(default=0)
+    
+    # As customer
+    purchases_count = models.IntegerField(default=0)
+    purchases_total = models.DecimalField(max_digits=14, decimal_places=2, default=0)
+    
+    class Meta:
+        verbose_name_plural = 'user stats'
+    
+    def __str__(self):
+        return f"Stats for {self.user_id}"
\ No newline at end of file
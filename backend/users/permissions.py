@@ -1,40 +1,60 @@
 from rest_framework import permissions
 
+
+def request_role(request):
+    """
+    The ``role`` claim of the request's token, else the user's role.
+    
+    Role changes revoke earlier tokens, so the claim of an accepted token
+    is current and the check needs no user row.
+    """
+    token = request.auth
+    role = token.get('role') if hasattr(token, 'get') else None
+    return role or getattr(request.user, 'role', None)
+
+
 class IsAdminOrReadOnly(permissions.BasePermission):
     """Allow read access to all, write access only to admins."""
     
     def has_permission(self, request, view):
         if request.method in permissions.SAFE_METHODS:
             return True
-        return request.user and request.user.is_admin
+        return request_role(request) == 'ADMIN'
+
+
+class IsAdmin(permissions.BasePermission):
+    """Allow access only to admins."""
+    
+    def has_permission(self, request, view):
+        return request_role(request) == 'ADMIN'
 
 
 class IsAdminOrPharmacist(permissions.BasePermission):
     """Allow access to admins and pharmacists."""
     
     def has_permission(self, request, view):
-        return request.user and (request.user.is_admin or request.user.is_pharmacist)
+        return request_role(request) in ('ADMIN', 'PHARMACIST')
 
 
 class IsDoctor(permissions.BasePermission):
     """Allow access only to doctors."""
     
     def has_permission(self, request, view):
-        return request.user and request.user.is_doctor
+        return request_role(request) == 'DOCTOR'
 
 
 class IsPatient(permissions.BasePermission):
     """Allow access only to patients."""
     
     def has_permission(self, request, view):
-        return request.user and request.user.is_patient
+        return request_role(request) == 'PATIENT'
 
 
 class IsOwnerOrAdmin(permissions.BasePermission):
     """Allow access to object owner or admin."""
     
     def has_object_permission(self, request, view, obj):
-        if request.user.is_admin:
+        if request_role(request) == 'ADMIN':
             return True
         
         # Check if object has user attribute
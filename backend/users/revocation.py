@@ -0,0 +1,109 @@
+"""
+Revoked JWT ids.
+
+Revocations are written to the ``RevokedToken`` table and mirrored into a
+per-process dict of ``jti -> expiry``, so checking a token is a dict
+lookup. Each write bumps a version in the shared cache; processes that
+see a new version pull the rows revoked since their last sync (with a
+safety margin for transactions that committed late). When the cache is
+not shared between processes (``LocMemCache``, ``DummyCache``) the
+version says nothing about other processes, so every sync queries the
+table instead. Entries are dropped from memory once expired and from the
+table by ``prune_revoked_tokens``.
+"""
+import threading
+import time
+from datetime import datetime, timedelta, timezone as dt_timezone
+from django.conf import settings
+from django.core.cache import cache, caches
+from django.core.cache.backends.dummy import DummyCache
+from django.core.cache.backends.locmem import LocMemCache
+from django.db import IntegrityError, transaction
+from django.utils import timezone
+
+VERSION_KEY = 'auth:revocation_version'
+
+# Rows committed up to this long after they were stamped are still seen
+SYNC_MARGIN = timedelta(minutes=5)
+PRUNE_INTERVAL = 60
+
+_lock = threading.Lock()
+_revoked = {}
+_version = None
+_synced_at = None
+_checked_at = 0.0
+_next_prune = 0.0
+
+
+def _bump_version():
+    try:
+        cache.incr(VERSION_KEY)
+    except ValueError:
+        cache.set(VERSION_KEY, time.time_ns(), timeout=None)
+
+
+def _sync():
+    global _version, _synced_at, _checked_at, _next_prune
+    now = time.monotonic()
+    if now - _checked_at < settings.TOKEN_REVOCATION_SYNC_INTERVAL:
+        return
+    _checked_at = now
+
+    shared = not isinstance(caches['default'], (LocMemCache, DummyCache))
+    version = cache.get_or_set(VERSION_KEY, time.time_ns(), timeout=None) if shared else None
+    if not shared or version != _version:
+        with _lock:
+            if not shared or version != _version:
+                from .models import RevokedToken
+                started = timezone.now()
+                rows = RevokedToken.objects.filter(expires_at__gt=started)
+                if _synced_at is not None:
+                    rows = rows.filter(revoked_at__gte=_synced_at - SYNC_MARGIN)
+                for jti, expires_at in rows.values_list('jti', 'expires_at').iterator():
+                    _revoked[jti] = expires_at.timestamp()
+                _synced_at = started
+                _version = version
+
+    if now >= _next_prune:
+        _next_prune = now + PRUNE_INTERVAL
+        cutoff = time.time()
+        with _lock:
+            for jti in [jti for jti, expires in _revoked.items() if expires <= cutoff]:
+                _revoked.pop(jti, None)
+
+
+def is_revoked(jti):
+    if not jti:
+        return False
+    _sync()
+    return jti in _revoked
+
+
+def revoke(jti, expires_at):
+    """
+    Revoke ``jti`` until ``expires_at`` (a datetime or UNIX timestamp).
+
+    Returns ``False`` if it was already revoked, which for a refresh token
+    means it is being reused.
+    """
+    from .models import RevokedToken
+    if not isinstance(expires_at, datetime):
+        expires_at = datetime.fromtimestamp(expires_at, tz=dt_timezone.utc)
+    try:
+        with transaction.atomic():
+            RevokedToken.objects.create(jti=jti, expires_at=expires_at)
+    except IntegrityError:
+        return False
+
+    def committed():
+        _revoked[jti] = expires_at.timestamp()
+        _bump_version()
+    transaction.on_commit(committed)
+    return True
+
+
+def prune(now=None):
+    """Delete revocations whose tokens have expired anyway."""
+    from .models import RevokedToken
+    deleted, _ = RevokedToken.objects.filter(expires_at__lte=now or timezone.now()).delete()
+    return deleted
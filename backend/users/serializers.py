@@ -1,6 +1,19 @@
 from rest_framework import serializers
 from django.contrib.auth.password_validation import validate_password
-from .models import User
+from django.core.exceptions import ValidationError as DjangoValidationError
+from django.utils.encoding import force_str
+from django.utils.http import urlsafe_base64_decode
+from rest_framework.exceptions import AuthenticationFailed
+from rest_framework_simplejwt.serializers import TokenObtainPairSerializer, TokenRefreshSerializer
+from rest_framework_simplejwt.settings import api_settings
+from rest_framework_simplejwt.tokens import AccessToken, RefreshToken
+from rest_framework_simplejwt.exceptions import TokenError
+from .authentication import VERSION_CLAIM, add_user_claims, get_token_user
+from .importing import invite_token_generator
+from .revocation import is_revoked, revoke
+from .models import User, DuplicateCandidate
+from .stats import stats_for
+from .thumbnails import thumbnail_urls
 from django.contrib.auth import get_user_model
 User = get_user_model()
 
@@ -9,13 +22,14 @@ class UserSerializer(serializers.ModelSerializer):
     """Serializer for User model."""
     
     full_name = serializers.SerializerMethodField()
+    profile_thumbnails = serializers.SerializerMethodField()
     
     class Meta:
         model = User
         fields = [
             'id', 'email', 'first_name', 'last_name', 'full_name',
             'role', 'phone_number', 'date_of_birth', 'gender',
-            'address', 'profile_picture', 'license_number',
+            'address', 'profile_picture', 'profile_thumbnails', 'license_number',
             'specialization', 'is_active', 'email_verified',
             'created_at', 'updated_at'
         ]
@@ -23,6 +37,9 @@ class UserSerializer(serializers.ModelSerializer):
     
     def get_full_name(self, obj):
         return obj.get_full_name()
+    
+    def get_profile_thumbnails(self, obj):
+        return thumbnail_urls(obj, self.context.get('request'))
 
 
 class UserRegistrationSerializer(serializers.ModelSerializer):
@@ -49,6 +66,73 @@ class UserRegistrationSerializer(serializers.ModelSerializer):
         return user
 
 
+class RoleTokenObtainPairSerializer(TokenObtainPairSerializer):
+    """Login serializer embedding role and token version claims."""
+    
+    @classmethod
+    def get_token(cls, user):
+        return add_user_claims(super().get_token(user), user)
+
+
+class VersionedTokenRefreshSerializer(TokenRefreshSerializer):
+    """
+    Refresh with revocation: revoked, outdated or unversioned refresh
+    tokens are refused, and with rotation the presented token is revoked
+    so it can be used only once.
+    """
+    
+    def validate(self, attrs):
+        refresh = self.token_class(attrs['refresh'])
+        jti = refresh[api_settings.JTI_CLAIM]
+        # Rotation would otherwise keep a token that no change can revoke alive
+        if is_revoked(jti) or VERSION_CLAIM not in refresh:
+            raise AuthenticationFailed('Token has been revoked', code='token_revoked')
+        user = get_token_user(refresh)
+        add_user_claims(refresh, user)
+        
+        data = {'access': str(refresh.access_token)}
+        
+        if api_settings.ROTATE_REFRESH_TOKENS:
+            # A concurrent refresh with the same token loses the race here
+            if api_settings.BLACKLIST_AFTER_ROTATION and not revoke(jti, refresh['exp']):
+                raise AuthenticationFailed('Token has been revoked', code='token_revoked')
+            refresh.set_jti()
+            refresh.set_exp()
+            refresh.set_iat()
+            data['refresh'] = str(refresh)
+        
+        return data
+
+
+class LogoutSerializer(serializers.Serializer):
+    """Tokens to revoke on logout; the access token is optional."""
+    
+    refresh = serializers.CharField()
+    access = serializers.CharField(required=False, allow_null=True, allow_blank=True)
+    
+    def validate_refresh(self, value):
+        try:
+            return RefreshToken(value)
+        except TokenError as exc:
+            raise serializers.ValidationError(str(exc))
+    
+    def validate_access(self, value):
+        if not value:
+            return None
+        try:
+            return AccessToken(value)
+        except TokenError:
+            # Already expired or invalid; nothing left to revoke
+            return None
+    
+    def validate(self, attrs):
+        access = attrs.get('access')
+        claim = api_settings.USER_ID_CLAIM
+        if access is not None and access.get(claim) != attrs['refresh'].get(claim):
+            raise serializers.ValidationError('Tokens belong to different users')
+        return attrs
+
+
 class ChangePasswordSerializer(serializers.Serializer):
     """Serializer for password change."""
     
@@ -62,10 +146,39 @@ class ChangePasswordSerializer(serializers.Serializer):
         return attrs
 
 
+class AcceptInviteSerializer(serializers.Serializer):
+    """Invite link parameters and the first password of an imported user."""
+    
+    uid = serializers.CharField()
+    token = serializers.CharField()
+    password = serializers.CharField(write_only=True)
+    password2 = serializers.CharField(write_only=True)
+    
+    def validate(self, attrs):
+        if attrs['password'] != attrs['password2']:
+            raise serializers.ValidationError({"password": "Password fields didn't match."})
+        try:
+            user = User.objects.get(pk=force_str(urlsafe_base64_decode(attrs['uid'])))
+        except (TypeError, ValueError, OverflowError, User.DoesNotExist):
+            user = None
+        # The token is tied to the password hash, so it stops working once
+        # a password has been set
+        if (user is None or user.has_usable_password()
+                or not invite_token_generator.check_token(user, attrs['token'])):
+            raise serializers.ValidationError({'token': 'Invalid or expired invite link.'})
+        try:
+            validate_password(attrs['password'], user)
+        except DjangoValidationError as exc:
+            raise serializers.ValidationError({'password': list(exc.messages)})
+        attrs['user'] = user
+        return attrs
+
+
 class UserProfileSerializer(serializers.ModelSerializer):
     """Detailed user profile serializer."""
     
     full_name = serializers.SerializerMethodField()
+    profile_thumbnails = serializers.SerializerMethodField()
     total_prescriptions = serializers.SerializerMethodField()
     
     class Meta:
@@ -73,7 +186,7 @@ class UserProfileSerializer(serializers.ModelSerializer):
         fields = [
             'id', 'email', 'first_name', 'last_name', 'full_name',
             'role', 'phone_number', 'date_of_birth', 'gender',
-            'address', 'profile_picture', 'license_number',
+            'address', 'profile_picture', 'profile_thumbnails', 'license_number',
             'specialization', 'is_active', 'email_verified',
             'total_prescriptions', 'created_at'
         ]
@@ -82,9 +195,51 @@ class UserProfileSerializer(serializers.ModelSerializer):
     def get_full_name(self, obj):
         return obj.get_full_name()
     
+    def get_profile_thumbnails(self, obj):
+        return thumbnail_urls(obj, self.context.get('request'))
+    
     def get_total_prescriptions(self, obj):
         if obj.is_patient:
-            return obj.prescriptions.count()
+            return stats_for(obj).prescriptions_total
         elif obj.is_doctor:
-            return obj.issued_prescriptions.count()
-        return 0
\ No newline at end of file
+            return stats_for(obj).prescriptions_issued
+        return 0
+
+
+class UserLookupSerializer(serializers.ModelSerializer):
+    """Compact user row for directory lookups."""
+    
+    full_name = serializers.SerializerMethodField()
+    
+    class Meta:
+        model = User
+        fields = ['id', 'full_name', 'email', 'phone_number', 'date_of_birth', 'role']
+    
+    def get_full_name(self, obj):
+        return obj.get_full_name()
+
+
+class DuplicateCandidateSerializer(serializers.ModelSerializer):
+    """Probable duplicate pair; only ``status`` can be changed."""
+    
+    user_a = UserLookupSerializer(read_only=True)
+    user_b = UserLookupSerializer(read_only=True)
+    
+    class Meta:
+        model = DuplicateCandidate
+        fields = [
+            'id', 'user_a', 'user_b', 'score', 'reasons', 'status',
+            'detected_at', 'reviewed_by', 'reviewed_at'
+        ]
+        read_only_fields = ['id', 'score', 'reasons', 'detected_at', 'reviewed_by', 'reviewed_at']
+
+
+class TimelineEventSerializer(serializers.Serializer):
+    """One row of the patient timeline."""
+    
+    timestamp = serializers.DateTimeField(source='ts')
+    type = serializers.CharField(source='kind')
+    id = serializers.IntegerField(source='object_id')
+    reference = serializers.CharField()
+    status = serializers.CharField(source='state')
+    amount = serializers.DecimalField(max_digits=12, decimal_places=2, allow_null=True)
@@ -0,0 +1,19 @@
+from django.db.models.signals import post_save, post_delete, pre_delete
+from .authentication import forget_user
+from .models import User
+from .stats import forget_cascaded_prescriptions
+
+
+def forget_cached_user(sender, instance, **kwargs):
+    forget_user(instance.pk)
+
+
+def update_stats_on_delete(sender, instance, **kwargs):
+    # Runs inside the delete's transaction, before the cascade
+    forget_cascaded_prescriptions(instance)
+
+
+def connect():
+    pre_delete.connect(update_stats_on_delete, sender=User, dispatch_uid='users-stats-delete')
+    post_save.connect(forget_cached_user, sender=User, dispatch_uid='users-forget-save')
+    post_delete.connect(forget_cached_user, sender=User, dispatch_uid='users-forget-delete')
@@ -0,0 +1,148 @@
+"""
+Maintenance of the ``UserStats`` counters.
+
+Prescription changes arrive as the same ``(before, after)`` link state
+pairs that feed ``prescriptions.relationships``; sale changes as
+``(before, after)`` pairs of :data:`Purchase`. ``None`` stands for "did
+not exist" (or "not linked to a customer"). Changes are folded into
+per-user deltas and applied with a single ``INSERT ... ON CONFLICT DO
+UPDATE`` in the caller's transaction, so the counters commit or roll
+back together with the change itself. Prescriptions deleted by the
+cascade of a user deletion are reported by a ``pre_delete`` handler.
+"""
+from collections import Counter, namedtuple
+from django.db import connection
+from .models import UserStats
+
+Purchase = namedtuple('Purchase', 'customer_id amount')
+
+STATUS_COUNTERS = {
+    'PENDING': 'prescriptions_pending',
+    'FILLED': 'prescriptions_filled',
+}
+COUNTERS = [
+    'prescriptions_total', 'prescriptions_pending', 'prescriptions_filled',
+    'prescriptions_issued', 'purchases_count', 'purchases_total',
+]
+
+
+def purchase(sale):
+    return Purchase(sale.customer_id, sale.total_amount) if sale.customer_id else None
+
+
+def apply_prescription_changes(changes):
+    """Apply ``(before, after)`` prescription link state pairs to the counters."""
+    apply_deltas(prescription_deltas(changes))
+
+
+def prescription_deltas(changes):
+    """Fold ``(before, after)`` prescription link state pairs into per-user deltas."""
+    deltas = {}
+    for before, after in changes:
+        if before == after:
+            continue
+        for state, sign in ((before, -1), (after, 1)):
+            if state is None:
+                continue
+            delta = deltas.setdefault(state.patient_id, Counter())
+            delta['prescriptions_total'] += sign
+            if state.status in STATUS_COUNTERS:
+                delta[STATUS_COUNTERS[state.status]] += sign
+            deltas.setdefault(state.doctor_id, Counter())['prescriptions_issued'] += sign
+    return deltas
+
+
+def apply_purchase_changes(changes):
+    """Apply ``(before, after)`` :data:`Purchase` pairs to the counters."""
+    deltas = {}
+    for before, after in changes:
+        if before == after:
+            continue
+        for state, sign in ((before, -1), (after, 1)):
+            if state is None:
+                continue
+            delta = deltas.setdefault(state.customer_id, Counter())
+            delta['purchases_count'] += sign
+            delta['purchases_total'] += sign * state.amount
+    apply_deltas(deltas)
+
+
+def apply_deltas(deltas):
+    """Add ``{user id: {counter: delta}}`` to the counters."""
+    rows = []
+    # Sorted so concurrent writers lock rows in the same order
+    for user_id in sorted(deltas):
+        delta = deltas[user_id]
+        if any(delta.values()):
+            rows.append([user_id, *(delta.get(name, 0) for name in COUNTERS)])
+    if rows:
+        _upsert(rows)
+
+
+def _upsert(rows):
+    qn = connection.ops.quote_name
+    table = qn(UserStats._meta.db_table)
+    columns = ['user_id', *COUNTERS]
+    placeholders = ', '.join(['(' + ', '.join(['%s'] * len(columns)) + ')'] * len(rows))
+    updates = [f'{qn(name)} = {table}.{qn(name)} + EXCLUDED.{qn(name)}' for name in COUNTERS]
+    sql = (
+        f'INSERT INTO {table} ({", ".join(qn(name) for name in columns)}) '
+        f'VALUES {placeholders} '
+        f'ON CONFLICT (user_id) DO UPDATE SET {", ".join(updates)}'
+    )
+    with connection.cursor() as cursor:
+        cursor.execute(sql, [value for row in rows for value in row])
+
+
+def forget_cascaded_prescriptions(user):
+    """
+    Take the prescriptions deleted along with ``user`` off the other
+    party's counters. The cascade bypasses ``apply_changes``; the user's
+    own counters and doctor-patient links are deleted with them.
+    """
+    from django.db.models import Q
+    from prescriptions.models import Prescription
+    from prescriptions.relationships import link_state
+    prescriptions = Prescription.objects.filter(Q(patient=user) | Q(doctor=user)).only(
+        'doctor_id', 'patient_id', 'status', 'issue_date'
+    )
+    deltas = prescription_deltas([(link_state(prescription), None) for prescription in prescriptions])
+    deltas.pop(user.pk, None)
+    apply_deltas(deltas)
+
+
+def stats_for(user):
+    """The user's counters; an unsaved all-zero row if they have none yet."""
+    return UserStats.objects.filter(user=user).first() or UserStats(user=user)
+
+
+def rebuild():
+    """Recompute every user's counters from the prescriptions and sales tables."""
+    from prescriptions.models import Prescription
+    from sales.models import Sale
+    qn = connection.ops.quote_name
+    table = qn(UserStats._meta.db_table)
+    prescriptions = qn(Prescription._meta.db_table)
+    sales = qn(Sale._meta.db_table)
+    with connection.cursor() as cursor:
+        cursor.execute(f'DELETE FROM {table}')
+        cursor.execute(
+            f'INSERT INTO {table} (user_id, {", ".join(qn(name) for name in COUNTERS)}) '
+            f'SELECT COALESCE(p.user_id, d.user_id, s.user_id), '
+            f'COALESCE(p.total, 0), COALESCE(p.pending, 0), COALESCE(p.filled, 0), '
+            f'COALESCE(d.issued, 0), COALESCE(s.count, 0), COALESCE(s.amount, 0) '
+            f'FROM ('
+            f"SELECT patient_id AS user_id, COUNT(*) AS total, "
+            f"COUNT(*) FILTER (WHERE status = 'PENDING') AS pending, "
+            f"COUNT(*) FILTER (WHERE status = 'FILLED') AS filled "
+            f'FROM {prescriptions} GROUP BY patient_id'
+            f') p '
+            f'FULL JOIN ('
+            f'SELECT doctor_id AS user_id, COUNT(*) AS issued FROM {prescriptions} GROUP BY doctor_id'
+            f') d ON d.user_id = p.user_id '
+            f'FULL JOIN ('
+            f'SELECT customer_id AS user_id, COUNT(*) AS count, SUM(total_amount) AS amount '
+            f'FROM {sales} WHERE customer_id IS NOT NULL GROUP BY customer_id'
+            f') s ON s.user_id = COALESCE(p.user_id, d.user_id)'
+        )
+        return cursor.rowcount
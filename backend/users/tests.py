@@ -1,3 +1,624 @@
-from django.test import TestCase
+import tempfile
+import time
+from contextlib import contextmanager
+from io import BytesIO, StringIO
+from datetime import date, datetime, timedelta, timezone as dt_timezone
+from unittest import mock
+from types import SimpleNamespace
+from django.core.cache import cache
+from django.core.files.storage import default_storage
+from django.core.files.uploadedfile import SimpleUploadedFile
+from django.core.management import call_command
+from django.test import RequestFactory, TestCase, override_settings
+from PIL import Image
+from rest_framework.exceptions import AuthenticationFailed
+from rest_framework.test import APIClient
+from rest_framework_simplejwt.tokens import AccessToken, RefreshToken
+from backend.metrics import render_metrics
+from prescriptions.tests import PrescriptionTestCase
+from sales.archive import archive_month
+from sales.tests import make_sale
+from sales.walkins import link_walkin_sales
+from prescriptions.models import Prescription
+from sales.models import Sale
+from . import dedup, directory, hashing, importing, revocation, stats, throttling, thumbnails, timeline
+from .authentication import CACHED_FIELDS, CachedJWTAuthentication, user_cache_key
+from .permissions import IsAdminOrPharmacist
+from .serializers import RoleTokenObtainPairSerializer
+from .models import DuplicateCandidate, User, UserStats
 
-# Create your tests here.
+STATE = ('_revoked', '_version', '_synced_at', '_checked_at', '_next_prune')
+
+
+class RevocationTests(TestCase):
+    
+    def setUp(self):
+        cache.clear()
+        self.processes = {}
+        self.expires = time.time() + 3600
+    
+    @contextmanager
+    def process(self, name):
+        """Run the block with the module state of process ``name``."""
+        saved = {attr: getattr(revocation, attr) for attr in STATE}
+        state = self.processes.setdefault(name, {
+            '_revoked': {}, '_version': None, '_synced_at': None, '_checked_at': 0.0, '_next_prune': 0.0,
+        })
+        for attr, value in state.items():
+            setattr(revocation, attr, value)
+        try:
+            yield
+        finally:
+            for attr in STATE:
+                state[attr] = getattr(revocation, attr)
+                setattr(revocation, attr, saved[attr])
+    
+    def revoke_elsewhere(self, jti):
+        with self.process('a'), self.captureOnCommitCallbacks(execute=True):
+            self.assertTrue(revocation.revoke(jti, self.expires))
+    
+    @override_settings(TOKEN_REVOCATION_SYNC_INTERVAL=0)
+    def test_revocation_reaches_other_process_through_shared_cache(self):
+        with override_settings(CACHES={'default': {
+            'BACKEND': 'django.core.cache.backends.filebased.FileBasedCache', 'LOCATION': tempfile.mkdtemp(),
+        }}):
+            with self.process('b'):
+                self.assertFalse(revocation.is_revoked('jti-1'))
+            self.revoke_elsewhere('jti-1')
+            with self.process('b'):
+                self.assertTrue(revocation.is_revoked('jti-1'))
+    
+    @override_settings(TOKEN_REVOCATION_SYNC_INTERVAL=0)
+    def test_revocation_reaches_other_process_without_shared_cache(self):
+        with self.process('b'):
+            self.assertFalse(revocation.is_revoked('jti-1'))
+            version = cache.get(revocation.VERSION_KEY)
+        self.revoke_elsewhere('jti-1')
+        # Process b's own cache never sees the bump
+        cache.set(revocation.VERSION_KEY, version, timeout=None)
+        with self.process('b'):
+            self.assertTrue(revocation.is_revoked('jti-1'))
+    
+    def test_other_processes_sync_once_per_interval(self):
+        with self.process('b'), mock.patch.object(revocation.time, 'monotonic', return_value=1000.0):
+            self.assertFalse(revocation.is_revoked('jti-1'))
+        self.revoke_elsewhere('jti-1')
+        with self.process('b'), mock.patch.object(revocation.time, 'monotonic', return_value=1004.0):
+            with self.assertNumQueries(0):
+                self.assertFalse(revocation.is_revoked('jti-1'))
+        with self.process('b'), mock.patch.object(revocation.time, 'monotonic', return_value=1005.0):
+            self.assertTrue(revocation.is_revoked('jti-1'))
+    
+    def test_revoking_twice_reports_reuse(self):
+        self.revoke_elsewhere('jti-1')
+        with self.process('a'):
+            self.assertFalse(revocation.revoke('jti-1', self.expires))
+
+
+@override_settings(TOKEN_REVOCATION_SYNC_INTERVAL=60)
+class AuthenticationTests(TestCase):
+    
+    def setUp(self):
+        cache.clear()
+        throttling._store = None
+        self.user = User.objects.create_user(email='ph@example.com', password='Corr3ct-Horse!', role='PHARMACIST',
+                                             first_name='Phar', last_name='Macist')
+    
+    def authenticate(self, token):
+        request = RequestFactory().get('/', HTTP_AUTHORIZATION=f'Bearer {token}')
+        return CachedJWTAuthentication().authenticate(request)
+    
+    def access(self):
+        return RoleTokenObtainPairSerializer.get_token(self.user).access_token
+    
+    def test_warm_cache_needs_no_query(self):
+        token = self.access()
+        self.authenticate(token)
+        with self.assertNumQueries(0):
+            user, validated = self.authenticate(token)
+            allowed = IsAdminOrPharmacist().has_permission(SimpleNamespace(user=user, auth=validated), None)
+        self.assertEqual((user.pk, user.email, allowed), (self.user.pk, self.user.email, True))
+        # The password hash stays out of the cache
+        self.assertEqual(sorted(map(str, cache.get(user_cache_key(self.user.pk)))),
+                         sorted(str(getattr(self.user, name)) for name in CACHED_FIELDS))
+    
+    def test_permissions_read_the_role_claim(self):
+        patient = SimpleNamespace(role='PATIENT')
+        self.assertTrue(IsAdminOrPharmacist().has_permission(
+            SimpleNamespace(user=patient, auth={'role': 'PHARMACIST'}), None))
+        self.assertFalse(IsAdminOrPharmacist().has_permission(SimpleNamespace(user=patient, auth=None), None))
+    
+    def test_password_role_and_activation_changes_revoke_tokens(self):
+        def set_password(user):
+            user.set_password('An0ther-Horse!')
+        
+        def set_role(user):
+            user.role = 'ADMIN'
+        
+        def deactivate(user):
+            user.is_active = False
+        
+        for change in (set_password, set_role, deactivate):
+            self.user.refresh_from_db()
+            token = self.access()
+            self.authenticate(token)
+            with self.captureOnCommitCallbacks(execute=True):
+                change(self.user)
+                self.user.save()
+            with self.assertRaises(AuthenticationFailed) as caught:
+                self.authenticate(token)
+            self.assertEqual(caught.exception.get_codes(), 'token_revoked', change.__name__)
+            self.user.is_active = True
+            self.user.save()
+    
+    def test_unversioned_access_tokens_are_checked_against_the_database(self):
+        token = AccessToken.for_user(self.user)
+        self.authenticate(token)
+        with self.assertNumQueries(1):
+            self.authenticate(token)
+        User.objects.filter(pk=self.user.pk).update(is_active=False)
+        with self.assertRaises(AuthenticationFailed):
+            self.authenticate(token)
+    
+    def test_refresh_rotation(self):
+        client = APIClient()
+        
+        def refresh(token):
+            return client.post('/api/auth/refresh/', {'refresh': str(token)}, format='json')
+        
+        issued = RoleTokenObtainPairSerializer.get_token(self.user)
+        response = refresh(issued)
+        self.assertEqual(response.status_code, 200)
+        rotated = RefreshToken(response.data['refresh'])
+        self.assertEqual((rotated['ver'], rotated['role']), (self.user.token_version, 'PHARMACIST'))
+        # Each refresh token works once
+        self.assertEqual(refresh(issued).status_code, 401)
+        # Tokens from before versioning cannot be rotated into new ones
+        self.assertEqual(refresh(RefreshToken.for_user(self.user)).status_code, 401)
+        with self.captureOnCommitCallbacks(execute=True):
+            self.user.set_password('An0ther-Horse!')
+            self.user.save()
+        self.assertEqual(refresh(rotated).status_code, 401)
+
+
+@override_settings(PASSWORD_HASH_WORKERS=0, PASSWORD_HASH_ITERATIONS=1000)
+class HashingTests(TestCase):
+    
+    def setUp(self):
+        cache.clear()
+        throttling._store = None
+        self.user = User.objects.create_user(email='ph@example.com', password='Corr3ct-Horse!', role='PHARMACIST',
+                                             first_name='Phar', last_name='Macist')
+    
+    def stored(self):
+        return User.objects.values_list('password', 'token_version').get(pk=self.user.pk)
+    
+    def test_outdated_hashes_are_upgraded_on_login(self):
+        password, version = self.stored()
+        self.assertTrue(password.startswith('pbkdf2_sha256$1000$'))
+        self.assertFalse(self.user.check_password('wrong'))
+        self.assertEqual(self.stored(), (password, version))
+        
+        cache.set(user_cache_key(self.user.pk), ['stale'])
+        with self.settings(PASSWORD_HASH_ITERATIONS=2000):
+            self.assertTrue(User.objects.get(pk=self.user.pk).check_password('Corr3ct-Horse!'))
+            upgraded, upgraded_version = self.stored()
+            self.assertTrue(upgraded.startswith('pbkdf2_sha256$2000$'))
+            # A rehash is not a password change: tokens stay valid
+            self.assertEqual(upgraded_version, version)
+            self.assertIsNone(cache.get(user_cache_key(self.user.pk)))
+            self.assertTrue(User.objects.get(pk=self.user.pk).check_password('Corr3ct-Horse!'))
+            self.assertEqual(self.stored()[0], upgraded)
+    
+    @override_settings(PASSWORD_HASH_WORKERS=1, PASSWORD_HASH_QUEUE_SIZE=1)
+    def test_pool_hashes_and_reports_when_full(self):
+        self.assertTrue(self.user.check_password('Corr3ct-Horse!'))
+        rejected = hashing.stats()['rejected']
+        with self.settings(PASSWORD_HASH_QUEUE_SIZE=0):
+            with self.assertRaises(hashing.HashingBusy):
+                self.user.check_password('Corr3ct-Horse!')
+            response = APIClient().post('/api/auth/login/', {'email': self.user.email, 'password': 'Corr3ct-Horse!'},
+                                        format='json')
+        self.assertEqual((response.status_code, response.data['detail'].code), (503, 'hashing_busy'))
+        self.assertEqual(hashing.stats()['rejected'], rejected + 2)
+        self.assertIn(f'medixhub_password_hash_rejected_total {rejected + 2}\n', render_metrics())
+
+
+class UserStatsTestCase(PrescriptionTestCase):
+    
+    def counters(self):
+        return {
+            row.user_id: tuple(getattr(row, name) for name in stats.COUNTERS)
+            for row in UserStats.objects.all()
+            if any(getattr(row, name) for name in stats.COUNTERS)
+        }
+    
+    def assertMatchesRebuild(self):
+        maintained = self.counters()
+        stats.rebuild()
+        self.assertEqual(maintained, self.counters())
+
+
+class UserStatsTests(UserStatsTestCase):
+    
+    def test_counters_follow_every_change(self):
+        admin = self.client_for(self.admin)
+        first = self.prescribe()
+        second = self.prescribe(quantity=1)
+        third = self.prescribe(doctor=self.other_doctor)
+        self.assertMatchesRebuild()
+        
+        self.assertEqual(admin.patch(f'/api/prescriptions/{first.pk}/', {'doctor_id': self.other_doctor.pk},
+                                     format='json').status_code, 200)
+        self.assertMatchesRebuild()
+        self.assertEqual(self.fill(first, 4).status_code, 200)
+        self.assertMatchesRebuild()
+        self.assertEqual(admin.post(f'/api/prescriptions/{second.pk}/cancel/').status_code, 200)
+        self.assertMatchesRebuild()
+        self.assertEqual(admin.delete(f'/api/prescriptions/{third.pk}/').status_code, 204)
+        self.assertMatchesRebuild()
+        
+        response = self.client_for(self.pharmacist).post('/api/sales/', {
+            'customer': self.patient.pk, 'items': [{'drug_id': self.drug.pk, 'quantity': 2}],
+            'amount_paid': '10.00', 'payment_method': 'CASH',
+        }, format='json')
+        self.assertEqual(response.status_code, 201, response.data)
+        self.assertMatchesRebuild()
+        self.assertEqual(self.counters()[self.patient.pk][4:], (1, 6))
+        
+        Sale.objects.update(sale_date=datetime(2020, 3, 10, tzinfo=dt_timezone.utc))
+        with override_settings(SALES_ARCHIVE_DIR=tempfile.mkdtemp()):
+            archive_month(date(2020, 3, 1))
+        self.assertMatchesRebuild()
+        
+        # The cascade takes the doctor's prescriptions off the patient's counters
+        self.other_doctor.delete()
+        self.assertMatchesRebuild()
+        self.assertEqual(self.counters()[self.patient.pk][:3], (1, 0, 0))
+        self.patient.delete()
+        self.assertMatchesRebuild()
+        self.assertEqual(self.counters(), {})
+
+
+class LoginThrottleTests(TestCase):
+    
+    def setUp(self):
+        throttling._store = None
+        self.client = APIClient()
+    
+    def login(self, email, **extra):
+        return self.client.post('/api/auth/login/', {'email': email, 'password': 'wrong'}, format='json', **extra)
+    
+    def test_login_is_limited_per_ip_and_email(self):
+        for _ in range(10):
+            self.assertEqual(self.login('a@example.com').status_code, 401)
+        self.assertEqual(self.login('A@example.com ').status_code, 429)
+        # Another account from the same address, and the same account from another one
+        self.assertEqual(self.login('b@example.com').status_code, 401)
+        self.assertEqual(self.login('a@example.com', REMOTE_ADDR='10.0.0.2').status_code, 401)
+    
+    def test_forwarded_for_is_ignored_without_proxies(self):
+        for i in range(10):
+            self.login('a@example.com', HTTP_X_FORWARDED_FOR=f'10.1.0.{i}')
+        self.assertEqual(self.login('a@example.com', HTTP_X_FORWARDED_FOR='10.1.1.1').status_code, 429)
+
+
+class ImportTests(TestCase):
+    
+    def setUp(self):
+        User.objects.create_user(email='known@example.com', password=None, role='PATIENT',
+                                 first_name='Kno', last_name='Wn', phone_number='+15550000001')
+    
+    def row(self, email, phone=''):
+        return {'email': email, 'first_name': 'Im', 'last_name': 'Ported', 'phone_number': phone}
+    
+    def test_duplicates_are_skipped(self):
+        rows = [
+            self.row('Known@EXAMPLE.com'),
+            self.row('new1@example.com', '1 (555) 000-0001'),
+            self.row('new2@example.com', '+15550000002'),
+            self.row('not-an-email'),
+            # Duplicates of rows in the previous chunk
+            self.row('NEW2@example.com'),
+            self.row('new3@example.com', '1 555 000 0002'),
+            self.row('new4@example.com'),
+        ]
+        chunks = []
+        created, duplicates, errors = importing.import_patients(rows, batch_size=3, on_created=chunks.append)
+        self.assertEqual((created, duplicates), (2, 4))
+        self.assertEqual([number for number, _ in errors], [4])
+        self.assertEqual([[user.email for user in chunk] for chunk in chunks],
+                         [['new2@example.com'], ['new4@example.com']])
+        imported = User.objects.get(email='new2@example.com')
+        self.assertEqual(imported.role, 'PATIENT')
+        self.assertFalse(imported.has_usable_password())
+    
+    def test_phone_match_can_be_turned_off(self):
+        rows = [self.row('new1@example.com', '+15550000001'), self.row('new2@example.com', '+15550000001')]
+        self.assertEqual(importing.import_patients(rows, match_phone=False)[:2], (2, 0))
+    
+    @override_settings(PASSWORD_RESET_TIMEOUT=60, PATIENT_INVITE_TIMEOUT=3600)
+    def test_invite_outlives_password_reset_timeout(self):
+        user = User.objects.get(email='known@example.com')
+        uid, token = importing.invite_token(user)
+        now = importing.invite_token_generator._now()
+        
+        def accept(later):
+            with mock.patch.object(importing.invite_token_generator, '_now', return_value=now + later):
+                return APIClient().post('/api/auth/accept-invite/', {
+                    'uid': uid, 'token': token, 'password': 'Corr3ct-Horse!', 'password2': 'Corr3ct-Horse!',
+                }, format='json')
+        
+        self.assertEqual(accept(timedelta(hours=2)).status_code, 400)
+        self.assertEqual(accept(timedelta(minutes=30)).status_code, 200)
+        # Setting the password uses the link up
+        self.assertEqual(accept(timedelta(minutes=31)).status_code, 400)
+
+
+class TimelineTests(PrescriptionTestCase):
+    
+    def setUp(self):
+        super().setUp()
+        # Ties on the timestamp across and within kinds exercise the whole keyset
+        self.ts = datetime(2026, 3, 1, 9, 30, tzinfo=dt_timezone.utc)
+        prescriptions = [self.prescribe(quantity=1) for _ in range(3)]
+        self.fill(prescriptions[0], 1)
+        Prescription.objects.filter(pk__in=[p.pk for p in prescriptions]).update(issue_date=self.ts)
+        Prescription.objects.filter(pk=prescriptions[0].pk).update(filled_date=self.ts)
+        for i in range(3):
+            Sale.objects.create(invoice_number=f'INV-T{i}', customer=self.patient, sold_by=self.pharmacist)
+        Sale.objects.update(sale_date=self.ts)
+        self.prescribe(quantity=1)
+        self.expected = sorted(
+            [(p.issue_date, 'PRESCRIBED', p.pk) for p in Prescription.objects.all()]
+            + [(self.ts, 'FILLED', prescriptions[0].pk)]
+            + [(sale.sale_date, 'PURCHASE', sale.pk) for sale in Sale.objects.all()],
+            reverse=True,
+        )
+    
+    def test_pages_cover_every_event_once(self):
+        for page_size in (1, 2, 3, 100):
+            seen, cursor = [], None
+            # Bounded, so a cursor that stops advancing fails instead of hanging
+            for _ in range(len(self.expected) + 1):
+                rows, cursor = timeline.timeline_page(self.patient.pk, cursor, page_size)
+                seen.extend((row['ts'], row['kind'], row['object_id']) for row in rows)
+                if cursor is None:
+                    break
+            self.assertEqual(seen, self.expected, page_size)
+    
+    def test_next_links_and_bad_cursors(self):
+        client = self.client_for(self.patient)
+        url, seen = f'/api/users/{self.patient.pk}/timeline/?page_size=3', []
+        for _ in range(len(self.expected)):
+            if not url:
+                break
+            response = client.get(url)
+            self.assertEqual(response.status_code, 200)
+            seen.extend((event['type'], event['id']) for event in response.data['results'])
+            url = response.data['next']
+        self.assertEqual(seen, [(kind, pk) for _, kind, pk in self.expected])
+        response = client.get(f'/api/users/{self.patient.pk}/timeline/?cursor=not-a-cursor')
+        self.assertEqual((response.status_code, response.data), (400, {'error': 'Invalid cursor'}))
+
+
+class LookupTests(TestCase):
+    
+    def setUp(self):
+        def patient(first, last, phone=''):
+            user = User.objects.create_user(email=f'{first}.{last}.{User.objects.count()}@example.com'.lower(),
+                                            password=None, role='PATIENT', first_name=first, last_name=last,
+                                            phone_number=phone)
+            return user.pk
+        
+        self.names = {
+            # Name prefix, three of them to tie on the key
+            patient('Anna', 'Lee'): 0, patient('Anna', 'Lee'): 0, patient('Anna', 'Lee'): 0, patient('Ann', 'Ortiz'): 0,
+            # Word prefix
+            patient('Lee', 'Annabel'): 1,
+            # Elsewhere in a word
+            patient('Joanna', 'Bell'): 2, patient('Hannah', 'Ray'): 2,
+        }
+        patient('Bob', 'Stone', '+15550001234')
+        staff = User.objects.create_user(email='ph@example.com', password=None, role='PHARMACIST',
+                                         first_name='Phar', last_name='Macist')
+        self.client = APIClient()
+        self.client.force_authenticate(staff)
+    
+    def pages(self, term, page_size):
+        seen, cursor = [], None
+        for _ in range(User.objects.count()):
+            users, cursor = directory.lookup_page(User.objects.filter(role='PATIENT'), term, cursor, page_size)
+            seen.extend(users)
+            if cursor is None:
+                break
+        return seen
+    
+    def test_pages_follow_rank_then_name(self):
+        expected = sorted(
+            User.objects.filter(pk__in=self.names),
+            key=lambda user: (self.names[user.pk], user.search_name, user.pk),
+        )
+        for page_size in (1, 2, 3, 100):
+            self.assertEqual([user.pk for user in self.pages('ann', page_size)],
+                             [user.pk for user in expected], page_size)
+        self.assertEqual([user.last_name for user in self.pages('0001234', 1)], ['Stone'])
+    
+    def test_next_links_and_bad_input(self):
+        url, seen = '/api/users/lookup/?q=ANN&page_size=2', []
+        for _ in range(len(self.names)):
+            if not url:
+                break
+            response = self.client.get(url)
+            self.assertEqual(response.status_code, 200)
+            seen.extend(user['id'] for user in response.data['results'])
+            url = response.data['next']
+        self.assertEqual(sorted(seen), sorted(self.names))
+        self.assertEqual(len(seen), len(set(seen)))
+        for query, error in [
+            ('q=a', 'Search term must contain at least 2 characters'),
+            ('q=ann&cursor=not-a-cursor', 'Invalid cursor'),
+        ]:
+            response = self.client.get(f'/api/users/lookup/?{query}')
+            self.assertEqual((response.status_code, response.data), (400, {'error': error}), query)
+
+
+class DuplicateTests(UserStatsTestCase):
+    
+    def make_patient(self, email, first, last, phone='', dob=None):
+        return User.objects.create_user(email=email, password=None, role='PATIENT', first_name=first,
+                                        last_name=last, phone_number=phone, date_of_birth=dob)
+    
+    def walkin(self, name, phone):
+        sale = make_sale(self.drug)
+        Sale.objects.filter(pk=sale.pk).update(customer_name=name, customer_phone=phone)
+        return sale.pk
+    
+    def test_soundex(self):
+        for name, code in [('Robert', 'R163'), ('Rupert', 'R163'), ('Ashcraft', 'A261'), ('Tymczak', 'T522'),
+                           ('Pfister', 'P236'), ('Lee', 'L000'), ('ángel maría', 'A524'), ('Zoë', 'Z000'),
+                           ('', ''), (None, ''), ('  ', ''), ('李', ''), ("O'Brien", 'O165')]:
+            self.assertEqual(dedup.soundex(name), code, name)
+    
+    def test_only_records_sharing_a_key_are_compared(self):
+        records = [
+            dedup.to_record(1, 'Jon', 'Smith', '15550001111', date(1990, 1, 1)),
+            # Shares every key with the first record but is compared once
+            dedup.to_record(2, 'John', 'Smyth', '0015550001111', date(1990, 1, 1)),
+            dedup.to_record(3, 'Mary', 'Jones', '', None),
+            dedup.to_record(4, 'Maria', 'Jonas', '', None),
+            dedup.to_record(5, 'Peter', 'Parker', '', date(1990, 1, 1)),
+            dedup.to_record(6, '', '', '123', None),
+        ]
+        candidates, counts = dedup.find_candidates(records)
+        self.assertEqual(counts, {'records': 6, 'blocks': 8, 'skipped_blocks': 0, 'comparisons': 2})
+        self.assertEqual([(a, b, reasons) for a, b, _, reasons in candidates],
+                         [(1, 2, ['name_sound', 'phone', 'date_of_birth'])])
+        
+        candidates, counts = dedup.find_candidates(records, threshold=0)
+        self.assertEqual([(a, b, reasons) for a, b, _, reasons in candidates],
+                         [(1, 2, ['name_sound', 'phone', 'date_of_birth']), (3, 4, ['name_sound'])])
+        
+        candidates, counts = dedup.find_candidates(records, max_block_size=1)
+        self.assertEqual((candidates, counts['skipped_blocks'], counts['comparisons']), ([], 5, 0))
+    
+    def test_command_refreshes_pending_candidates(self):
+        first = self.make_patient('a@example.com', 'Jon', 'Smith', '+1 555 000 1111', date(1990, 1, 1))
+        second = self.make_patient('b@example.com', 'John', 'Smith', '555-000-1111', date(1990, 1, 1))
+        third = self.make_patient('c@example.com', 'Jane', 'Doe', '+1 555 000 2222')
+        fourth = self.make_patient('d@example.com', 'Jane', 'Doe', '555 000 2222')
+        call_command('find_duplicate_patients', stdout=StringIO())
+        self.assertEqual(sorted(DuplicateCandidate.objects.values_list('user_a', 'user_b', 'status')),
+                         [(first.pk, second.pk, 'PENDING'), (third.pk, fourth.pk, 'PENDING')])
+        
+        DuplicateCandidate.objects.filter(user_a=first).update(status='DISMISSED')
+        User.objects.filter(pk=fourth.pk).update(first_name='Jim', last_name='Beam', phone_normalized='')
+        call_command('find_duplicate_patients', stdout=StringIO())
+        self.assertEqual(list(DuplicateCandidate.objects.values_list('user_a', 'user_b', 'status')),
+                         [(first.pk, second.pk, 'DISMISSED')])
+    
+    def test_linking_walkin_sales(self):
+        patient = self.make_patient('a@example.com', 'Jon', 'Smith', '+1 (555) 000-1111')
+        self.make_patient('b@example.com', 'Ann', 'Lee', '555 000 2222')
+        self.make_patient('c@example.com', 'Bob', 'Lee', '+1 555 000 2222')
+        matching = self.walkin('JOHN SMITH', '555-000-1111')
+        other_name = self.walkin('Alice', '0015550001111')
+        shared = self.walkin('Ann Lee', '5550002222')
+        self.walkin('Jon Smith', '')
+        self.walkin('Jon Smith', '12')
+        
+        self.assertEqual(link_walkin_sales(dry_run=True), (1, 4))
+        self.assertFalse(Sale.objects.filter(customer__isnull=False).exists())
+        
+        from reports.jobs import data_version
+        version = data_version()
+        with self.captureOnCommitCallbacks(execute=True):
+            self.assertEqual(link_walkin_sales(), (1, 4))
+        self.assertNotEqual(data_version(), version)
+        self.assertEqual(list(Sale.objects.filter(customer__isnull=False).values_list('id', 'customer')),
+                         [(matching, patient.pk)])
+        self.assertEqual(self.counters()[patient.pk][4:], (1, 3))
+        self.assertMatchesRebuild()
+        
+        self.assertEqual(link_walkin_sales(require_name=False), (1, 3))
+        self.assertEqual(Sale.objects.get(pk=other_name).customer_id, patient.pk)
+        self.assertEqual(self.counters()[patient.pk][4:], (2, 6))
+        self.assertMatchesRebuild()
+        
+        # By hand; sales that are already linked are skipped
+        response = self.client_for(self.pharmacist).post('/api/sales/link_customer/', {
+            'customer': patient.pk, 'sales': [shared, matching],
+        }, format='json')
+        self.assertEqual(response.data, {'linked': 1, 'skipped': 1})
+        self.assertEqual(self.counters()[patient.pk][4:], (3, 9))
+        self.assertMatchesRebuild()
+
+
+def picture(name='me.jpg', color='red', size=(400, 300)):
+    output = BytesIO()
+    Image.new('RGB', size, color).save(output, 'JPEG')
+    return SimpleUploadedFile(name, output.getvalue(), content_type='image/jpeg')
+
+
+@override_settings(MEDIA_ROOT=tempfile.mkdtemp(), PROFILE_THUMBNAIL_SIZES={'small': 64, 'medium': 256})
+class ThumbnailTests(TestCase):
+    
+    def setUp(self):
+        self.user = User.objects.create_user(email='pic@example.com', password=None, role='ADMIN')
+        self.client = APIClient()
+        self.client.force_authenticate(self.user)
+    
+    @contextmanager
+    def rendering(self):
+        """Run thumbnail jobs inline when the block's transaction commits."""
+        executor = SimpleNamespace(submit=lambda fn, *args: fn(*args))
+        with mock.patch.object(thumbnails, '_get_executor', return_value=executor), \
+                mock.patch.object(thumbnails, 'close_old_connections'), \
+                self.captureOnCommitCallbacks(execute=True):
+            yield
+    
+    def upload(self, image):
+        response = self.client.patch('/api/users/profile/', {'profile_picture': image}, format='multipart')
+        self.assertEqual(response.status_code, 200, response.data)
+        return response
+    
+    def test_render_sizes(self):
+        source = default_storage.save('profiles/wide.jpg', picture())
+        names = thumbnails.render(source)
+        self.assertEqual(set(names), {'small', 'medium'})
+        for name, size in [('small', 64), ('medium', 256)]:
+            self.assertRegex(names[name], r'^profiles/thumbs/[0-9a-f]{20}\.webp$')
+            with default_storage.open(names[name]) as handle, Image.open(handle) as image:
+                self.assertEqual((image.format, image.size), ('WEBP', (size, size)))
+        # Same pixels, same files
+        self.assertEqual(thumbnails.render(default_storage.save('profiles/copy.jpg', picture())), names)
+    
+    def test_upload_renders_thumbnails(self):
+        with self.rendering():
+            response = self.upload(picture())
+        self.assertIsNone(response.data['profile_thumbnails'])
+        
+        self.user.refresh_from_db()
+        self.assertEqual(self.user.profile_thumbnails['source'], self.user.profile_picture.name)
+        data = self.client.get('/api/users/profile/').data
+        self.assertEqual(data['profile_thumbnails'], {
+            name: f"http://testserver/media/{self.user.profile_thumbnails[name]}" for name in ('small', 'medium')
+        })
+        self.assertEqual(self.client.get(f'/api/users/{self.user.pk}/').data['profile_thumbnails'],
+                         data['profile_thumbnails'])
+        
+        # A new picture hides the old thumbnails, and a late job for the old one writes nothing
+        old = self.user.profile_picture.name
+        with mock.patch.object(thumbnails, 'schedule') as schedule:
+            self.assertIsNone(self.upload(picture('new.jpg', color='blue')).data['profile_thumbnails'])
+        self.user.refresh_from_db()
+        schedule.assert_called_once_with(self.user.pk, self.user.profile_picture.name)
+        self.assertEqual(self.user.profile_thumbnails, {})
+        self.assertFalse(thumbnails.generate(self.user.pk, old))
+        
+        # The command renders what the pool missed
+        call_command('generate_thumbnails', stdout=StringIO())
+        self.user.refresh_from_db()
+        self.assertNotEqual(self.client.get('/api/users/profile/').data['profile_thumbnails'],
+                            data['profile_thumbnails'])
+        self.assertEqual(self.user.profile_thumbnails['source'], self.user.profile_picture.name)
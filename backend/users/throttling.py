@@ -0,0 +1,169 @@
+"""
+Token-bucket request throttling.
+
+Buckets are tracked with GCRA (the generic cell rate algorithm), which
+behaves exactly like a token bucket refilled continuously at ``num/period``
+with capacity ``num`` but needs a single float per bucket: the time at
+which the bucket will be full again. A throttling decision is therefore
+one read, a little arithmetic and one write.
+
+Rates come from ``REST_FRAMEWORK['DEFAULT_THROTTLE_RATES']`` in DRF's
+``num/period`` format. A scope can be given a different rate per role
+with a ``<scope>.<role>`` key, e.g. ``'reports.admin'``.
+
+The store is chosen by ``THROTTLE_STORE``. :class:`LocalBucketStore`
+keeps buckets in a plain per-process dict without locking, so a limit
+applies to each worker process separately and two threads racing on the
+same bucket may occasionally both be admitted. :class:`CacheBucketStore`
+shares buckets between processes through the default cache.
+
+Anonymous requests are keyed on the client IP from DRF's ``get_ident``,
+which trusts ``X-Forwarded-For`` only as far as ``NUM_PROXIES`` allows.
+"""
+import math
+import time
+from functools import lru_cache
+from django.conf import settings
+from django.core.cache import cache
+from django.utils.module_loading import import_string
+from rest_framework.settings import api_settings
+from rest_framework.throttling import BaseThrottle
+
+PERIODS = {'s': 1, 'm': 60, 'h': 3600, 'd': 86400}
+
+
+@lru_cache(maxsize=None)
+def parse_rate(rate):
+    """``'120/min'`` -> ``(seconds per request, period in seconds)``."""
+    if rate is None:
+        return None
+    num, period = rate.split('/')
+    duration = PERIODS[period[0]]
+    return duration / int(num), duration
+
+
+def rate_for(scope, role=None):
+    rates = api_settings.DEFAULT_THROTTLE_RATES
+    rate = rates.get(f'{scope}.{role.lower()}') if role else None
+    return parse_rate(rate or rates.get(scope))
+
+
+class LocalBucketStore:
+    """Per-process buckets in a dict; full buckets are dropped when it grows."""
+    
+    max_keys = 100_000
+    
+    def __init__(self):
+        self._full_at = {}
+        self.clock = time.monotonic
+    
+    def hit(self, key, interval, period):
+        """Take one token from ``key``; return 0 or the seconds to wait."""
+        now = self.clock()
+        full_at = max(self._full_at.get(key, now), now) + interval
+        if full_at - now > period:
+            return full_at - now - period
+        self._full_at[key] = full_at
+        if len(self._full_at) > self.max_keys:
+            self.prune(now)
+        return 0
+    
+    def prune(self, now=None):
+        now = self.clock() if now is None else now
+        for key in [key for key, full_at in list(self._full_at.items()) if full_at <= now]:
+            self._full_at.pop(key, None)
+
+
+class CacheBucketStore:
+    """
+    Buckets shared through the default cache. Reads and writes are not
+    atomic, so concurrent requests on one bucket can slightly exceed it.
+    """
+    
+    prefix = 'throttle:'
+    
+    def __init__(self):
+        self.clock = time.time
+    
+    def hit(self, key, interval, period):
+        now = self.clock()
+        key = self.prefix + key
+        full_at = max(cache.get(key, now), now) + interval
+        if full_at - now > period:
+            return full_at - now - period
+        cache.set(key, full_at, timeout=math.ceil(full_at - now))
+        return 0
+
+
+_store = None
+
+
+def get_store():
+    global _store
+    if _store is None:
+        _store = import_string(settings.THROTTLE_STORE)()
+    return _store
+
+
+def consume(scope, ident, role=None):
+    """
+    Charge one request by ``ident`` to ``scope``. Returns 0 if it is
+    allowed (or the scope has no rate) and the seconds to wait otherwise.
+    """
+    rate = rate_for(scope, role)
+    if rate is None:
+        return 0
+    return get_store().hit(f'{scope}:{ident}', *rate)
+
+
+class BucketThrottle(BaseThrottle):
+    """Base class: subclasses pick the scope for a request."""
+    
+    delay = 0
+    
+    def get_scope(self, request, view):
+        raise NotImplementedError
+    
+    def get_key(self, request):
+        """The bucket key for the caller and the role whose rate applies."""
+        user = request.user
+        if user and user.is_authenticated:
+            return f'user:{user.pk}', user.role
+        return f'ip:{self.get_ident(request)}', None
+    
+    def allow_request(self, request, view):
+        scope = self.get_scope(request, view)
+        if scope is None:
+            return True
+        self.delay = consume(scope, *self.get_key(request))
+        return not self.delay
+    
+    def wait(self):
+        return self.delay or None
+
+
+class UserBucketThrottle(BucketThrottle):
+    """Overall limit per user (scope ``user``) or per client IP (``anon``)."""
+    
+    def get_scope(self, request, view):
+        return 'user' if request.user and request.user.is_authenticated else 'anon'
+
+
+class ScopedBucketThrottle(BucketThrottle):
+    """Limit per endpoint class, taken from the view's ``throttle_scope``."""
+    
+    def get_scope(self, request, view):
+        return getattr(view, 'throttle_scope', None)
+
+
+class LoginBucketThrottle(ScopedBucketThrottle):
+    """
+    Scoped limit keyed on the client IP plus the submitted email, so
+    guesses at one account are limited without locking out everyone
+    else behind the same address. ``anon`` still caps the IP overall.
+    """
+    
+    def get_key(self, request):
+        key, role = super().get_key(request)
+        email = request.data.get('email') if hasattr(request.data, 'get') else None
+        return f'{key}:email:{str(email or "").strip().lower()[:254]}', role
@@ -0,0 +1,104 @@
+"""
+Profile picture thumbnails.
+
+When a user's ``profile_picture`` changes, square thumbnails in the
+``PROFILE_THUMBNAIL_SIZES`` are rendered on a small background pool once
+the transaction commits. Each rendition is stored under the hash of its
+own bytes, so its URL never changes meaning and can be cached forever.
+``User.profile_thumbnails`` maps size names to storage names plus the
+``source`` picture they were made from; a job whose picture has since
+been replaced writes nothing. ``generate_thumbnails`` renders whatever
+the pool missed (e.g. after a restart).
+"""
+import hashlib
+import io
+import logging
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from django.conf import settings
+from django.core.cache import cache
+from django.core.files.base import ContentFile
+from django.core.files.storage import default_storage
+from django.db import close_old_connections, transaction
+from PIL import Image, ImageOps
+
+logger = logging.getLogger(__name__)
+
+THUMBNAIL_DIR = 'profiles/thumbs'
+
+_executor = None
+_executor_lock = threading.Lock()
+
+
+def _get_executor():
+    global _executor
+    if _executor is None:
+        with _executor_lock:
+            if _executor is None:
+                _executor = ThreadPoolExecutor(
+                    max_workers=settings.PROFILE_THUMBNAIL_WORKERS,
+                    thread_name_prefix='thumbnail',
+                )
+    return _executor
+
+
+def schedule(user_id, source):
+    """Render thumbnails of ``source`` for ``user_id`` after the current transaction commits."""
+    transaction.on_commit(lambda: _get_executor().submit(_generate_in_background, user_id, source))
+
+
+def _generate_in_background(user_id, source):
+    close_old_connections()
+    try:
+        generate(user_id, source)
+    except Exception:
+        logger.exception('Could not render thumbnails for user %s', user_id)
+    finally:
+        close_old_connections()
+
+
+def render(source):
+    """``{size name: storage name}`` for every configured size of ``source``."""
+    fmt = settings.PROFILE_THUMBNAIL_FORMAT
+    largest = max(settings.PROFILE_THUMBNAIL_SIZES.values())
+    with default_storage.open(source, 'rb') as handle:
+        image = Image.open(handle)
+        # Lets JPEG decode at a reduced scale instead of at full size
+        image.draft('RGB', (largest * 2, largest * 2))
+        image = ImageOps.exif_transpose(image).convert('RGB')
+
+    names = {}
+    for name, size in settings.PROFILE_THUMBNAIL_SIZES.items():
+        output = io.BytesIO()
+        ImageOps.fit(image, (size, size), Image.Resampling.LANCZOS).save(output, fmt, quality=82)
+        content = output.getvalue()
+        digest = hashlib.sha256(content).hexdigest()[:20]
+        path = f'{THUMBNAIL_DIR}/{digest}.{fmt.lower()}'
+        if not default_storage.exists(path):
+            path = default_storage.save(path, ContentFile(content))
+        names[name] = path
+    return names
+
+
+def generate(user_id, source):
+    """Render and record thumbnails; returns False if ``source`` is no longer current."""
+    from .authentication import user_cache_key
+    from .models import User
+    thumbnails = {**render(source), 'source': source}
+    updated = User.objects.filter(pk=user_id, profile_picture=source).update(profile_thumbnails=thumbnails)
+    if updated:
+        cache.delete(user_cache_key(user_id))
+    return bool(updated)
+
+
+def thumbnail_urls(user, request=None):
+    """``{size name: url}`` of the user's current thumbnails, or ``None`` if not ready."""
+    thumbnails = user.profile_thumbnails or {}
+    if not user.profile_picture or thumbnails.get('source') != user.profile_picture.name:
+        return None
+    urls = {}
+    for name in settings.PROFILE_THUMBNAIL_SIZES:
+        if name in thumbnails:
+            url = default_storage.url(thumbnails[name])
+            urls[name] = request.build_absolute_uri(url) if request else url
+    return urls
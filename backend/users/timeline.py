@@ -0,0 +1,93 @@
+"""
+Patient medication timeline.
+
+Prescriptions issued, prescriptions filled and purchases are merged into
+one stream ordered by ``(ts, kind, id)`` descending. Each source is a
+branch of a ``UNION ALL`` that reads only a covering index on
+``(patient, ts, id)`` and is limited to one page on its own, so a page
+costs one query no matter how long the history is. Pages are addressed
+with an opaque keyset cursor holding the last row's sort key.
+"""
+import base64
+import json
+from datetime import datetime
+from django.db.models import CharField, DecimalField, F, Q, Value
+from django.db.models.functions import Cast
+from prescriptions.models import Prescription
+from sales.models import Sale
+
+PAGE_SIZE = 50
+MAX_PAGE_SIZE = 200
+
+# All projected columns are annotations so every branch selects them in
+# the same order
+FIELDS = ('ts', 'kind', 'object_id', 'reference', 'state', 'amount')
+
+TS_FIELDS = {'PRESCRIBED': 'issue_date', 'FILLED': 'filled_date', 'PURCHASE': 'sale_date'}
+
+
+def _branches(user_id):
+    """``{kind: queryset}`` with every branch projected onto ``FIELDS``."""
+    # A bare NULL is typed text by PostgreSQL, which cannot UNION with numeric
+    amount = Cast(Value(None), DecimalField(max_digits=12, decimal_places=2))
+    return {
+        'PRESCRIBED': Prescription.objects.filter(patient_id=user_id).annotate(
+            ts=F('issue_date'), kind=Value('PRESCRIBED', output_field=CharField()),
+            object_id=F('id'), reference=F('prescription_number'), state=F('status'), amount=amount,
+        ),
+        'FILLED': Prescription.objects.filter(patient_id=user_id, filled_date__isnull=False).annotate(
+            ts=F('filled_date'), kind=Value('FILLED', output_field=CharField()),
+            object_id=F('id'), reference=F('prescription_number'), state=F('status'), amount=amount,
+        ),
+        'PURCHASE': Sale.objects.filter(customer_id=user_id).annotate(
+            ts=F('sale_date'), kind=Value('PURCHASE', output_field=CharField()),
+            object_id=F('id'), reference=F('invoice_number'),
+            state=F('payment_method'), amount=F('total_amount'),
+        ),
+    }
+
+
+def _after(kind, ts_field, cursor):
+    """Rows of branch ``kind`` that sort after ``cursor`` in descending order."""
+    ts, cursor_kind, object_id = cursor
+    if kind < cursor_kind:
+        return Q(**{f'{ts_field}__lte': ts})
+    if kind > cursor_kind:
+        return Q(**{f'{ts_field}__lt': ts})
+    return Q(**{f'{ts_field}__lt': ts}) | Q(**{ts_field: ts, 'id__lt': object_id})
+
+
+def timeline_page(user_id, cursor=None, page_size=PAGE_SIZE):
+    """Return ``(events, next_cursor)`` for one page of the timeline."""
+    decoded = decode_cursor(cursor) if cursor else None
+    branches = []
+    for kind, queryset in _branches(user_id).items():
+        if decoded:
+            queryset = queryset.filter(_after(kind, TS_FIELDS[kind], decoded))
+        branches.append(
+            queryset.order_by(f'-{TS_FIELDS[kind]}', '-id').values(*FIELDS)[:page_size + 1]
+        )
+
+    first, *rest = branches
+    rows = list(first.union(*rest, all=True).order_by('-ts', '-kind', '-object_id')[:page_size + 1])
+
+    next_cursor = None
+    if len(rows) > page_size:
+        rows = rows[:page_size]
+        last = rows[-1]
+        next_cursor = encode_cursor(last['ts'], last['kind'], last['object_id'])
+    return rows, next_cursor
+
+
+def encode_cursor(ts, kind, object_id):
+    payload = json.dumps([ts.isoformat(), kind, object_id]).encode()
+    return base64.urlsafe_b64encode(payload).decode()
+
+
+def decode_cursor(cursor):
+    """Parse a cursor from :func:`encode_cursor`; raises ``ValueError`` if malformed."""
+    try:
+        ts, kind, object_id = json.loads(base64.urlsafe_b64decode(cursor.encode()))
+        return datetime.fromisoformat(ts), str(kind), int(object_id)
+    except (TypeError, ValueError, UnicodeDecodeError) as exc:
+        raise ValueError('Invalid cursor') from exc
@@ -1,16 +1,23 @@
-from rest_framework import viewsets, status, permissions
+from rest_framework import mixins, viewsets, status, permissions
 from rest_framework.decorators import action
 from rest_framework.response import Response
-from rest_framework_simplejwt.views import TokenObtainPairView
+from rest_framework.views import APIView
+from rest_framework_simplejwt.settings import api_settings
+from rest_framework_simplejwt.views import TokenObtainPairView, TokenRefreshView
 from django_filters.rest_framework import DjangoFilterBackend
 from rest_framework.filters import SearchFilter, OrderingFilter
-from .models import User
+from .models import User, DuplicateCandidate
 from .serializers import (
     UserSerializer, UserRegistrationSerializer,
-    ChangePasswordSerializer, UserProfileSerializer
+    ChangePasswordSerializer, UserProfileSerializer, TimelineEventSerializer, UserLookupSerializer,
+    DuplicateCandidateSerializer,
+    RoleTokenObtainPairSerializer, LogoutSerializer, AcceptInviteSerializer
 )
-from .permissions import IsAdminOrReadOnly
+from .revocation import revoke
+from .permissions import IsAdmin, IsAdminOrReadOnly
+from .throttling import LoginBucketThrottle, UserBucketThrottle
 from django.contrib.auth import get_user_model
+from django.utils import timezone
 User = get_user_model()
 
 
@@ -25,6 +32,8 @@ class UserViewSet(viewsets.ModelViewSet):
     search_fields = ['email', 'first_name', 'last_name', 'phone_number']
     ordering_fields = ['created_at', 'first_name', 'last_name']
     ordering = ['-created_at']
+    # Set per action
+    throttle_scope = None
     
     def get_serializer_class(self):
         if self.action == 'create':
@@ -47,7 +56,7 @@ class UserViewSet(viewsets.ModelViewSet):
         serializer.save()
         return Response(serializer.data)
     
-    @action(detail=False, methods=['post'])
+    @action(detail=False, methods=['post'], permission_classes=[permissions.IsAuthenticated])
     def change_password(self, request):
         """Change user password."""
         serializer = ChangePasswordSerializer(data=request.data)
@@ -62,11 +71,76 @@ class UserViewSet(viewsets.ModelViewSet):
                 status=status.HTTP_400_BAD_REQUEST
             )
         
-        # Set new password
+        # Set new password; this revokes every token issued so far
         user.set_password(serializer.validated_data['new_password'])
         user.save()
         
-        return Response({'message': 'Password changed successfully'})
+        refresh = RoleTokenObtainPairSerializer.get_token(user)
+        return Response({
+            'message': 'Password changed successfully',
+            'refresh': str(refresh),
+            'access': str(refresh.access_token),
+        })
+    
+    @action(detail=True, methods=['get'])
+    def timeline(self, request, pk=None):
+        """Prescriptions, fills and purchases of a patient, newest first."""
+        from rest_framework.utils.urls import replace_query_param
+        from prescriptions.models import Prescription
+        from .timeline import PAGE_SIZE, MAX_PAGE_SIZE, timeline_page
+        
+        patient = self.get_object()
+        user = request.user
+        allowed = (
+            user == patient or user.is_admin or user.is_pharmacist
+            or (user.is_doctor and Prescription.objects.filter(doctor=user, patient=patient).exists())
+        )
+        if not allowed:
+            return Response(
+                {'error': 'You do not have access to this timeline'},
+                status=status.HTTP_403_FORBIDDEN
+            )
+        
+        try:
+            page_size = min(int(request.query_params.get('page_size', PAGE_SIZE)), MAX_PAGE_SIZE)
+            events, next_cursor = timeline_page(patient.pk, request.query_params.get('cursor'), max(page_size, 1))
+        except ValueError as exc:
+            return Response({'error': str(exc)}, status=status.HTTP_400_BAD_REQUEST)
+        
+        return Response({
+            'next': replace_query_param(request.build_absolute_uri(), 'cursor', next_cursor) if next_cursor else None,
+            'results': TimelineEventSerializer(events, many=True).data,
+        })
+    
+    @action(detail=False, methods=['get'], throttle_scope='pos')
+    def lookup(self, request):
+        """Ranked name or phone lookup for staff (``?q=``, default ``role=PATIENT``)."""
+        from rest_framework.utils.urls import replace_query_param
+        from .directory import PAGE_SIZE, MAX_PAGE_SIZE, lookup_page
+        
+        if request.user.is_patient:
+            return Response(
+                {'error': 'Staff access required'},
+                status=status.HTTP_403_FORBIDDEN
+            )
+        
+        queryset = User.objects.filter(is_active=True)
+        role = request.query_params.get('role', 'PATIENT')
+        if role:
+            queryset = queryset.filter(role=role)
+        
+        try:
+            page_size = min(int(request.query_params.get('page_size', PAGE_SIZE)), MAX_PAGE_SIZE)
+            users, next_cursor = lookup_page(
+                queryset, request.query_params.get('q', ''), request.query_params.get('cursor'), max(page_size, 1)
+            )
+        except ValueError as exc:
+            return Response({'error': str(exc)}, status=status.HTTP_400_BAD_REQUEST)
+        
+        return Response({
+            'next': replace_query_param(request.build_absolute_uri(), 'cursor', next_cursor) if next_cursor else None,
+            'results': UserLookupSerializer(users, many=True).data,
+        })
     
     @action(detail=False, methods=['get'])
     def stats(self, request):
@@ -86,4 +160,72 @@ class UserViewSet(viewsets.ModelViewSet):
         for role_code, role_name in User.ROLE_CHOICES:
             stats['by_role'][role_name] = User.objects.filter(role=role_code).count()
         
-        return Response(stats)
\ No newline at end of file
+        return Response(stats)
+
+
+class DuplicateCandidateViewSet(mixins.ListModelMixin, mixins.RetrieveModelMixin,
+                                mixins.UpdateModelMixin, viewsets.GenericViewSet):
+    """Review queue of probable duplicate patients found by ``find_duplicate_patients``."""
+    
+    queryset = DuplicateCandidate.objects.select_related('user_a', 'user_b')
+    serializer_class = DuplicateCandidateSerializer
+    permission_classes = [permissions.IsAuthenticated, IsAdmin]
+    filter_backends = [DjangoFilterBackend, OrderingFilter]
+    filterset_fields = ['status']
+    ordering_fields = ['score', 'detected_at']
+    ordering = ['-score', 'id']
+    
+    def perform_update(self, serializer):
+        serializer.save(reviewed_by=self.request.user, reviewed_at=timezone.now())
+
+
+class LoginView(TokenObtainPairView):
+    throttle_classes = [UserBucketThrottle, LoginBucketThrottle]
+    throttle_scope = 'auth'
+
+
+class RefreshView(TokenRefreshView):
+    throttle_scope = 'auth'
+
+
+class LogoutView(APIView):
+    """Revoke the caller's refresh token (and access token, if given)."""
+    
+    authentication_classes = []
+    permission_classes = [permissions.AllowAny]
+    throttle_scope = 'auth'
+    
+    def post(self, request):
+        serializer = LogoutSerializer(data=request.data)
+        serializer.is_valid(raise_exception=True)
+        
+        for token in (serializer.validated_data['refresh'], serializer.validated_data.get('access')):
+            if token is not None:
+                revoke(token[api_settings.JTI_CLAIM], token['exp'])
+        
+        return Response({'message': 'Logged out successfully'})
+
+
+class AcceptInviteView(APIView):
+    """Set the first password of an imported patient and log them in."""
+    
+    authentication_classes = []
+    permission_classes = [permissions.AllowAny]
+    throttle_scope = 'auth'
+    
+    def post(self, request):
+        serializer = AcceptInviteSerializer(data=request.data)
+        serializer.is_valid(raise_exception=True)
+        
+        user = serializer.validated_data['user']
+        user.set_password(serializer.validated_data['password'])
+        # Following the emailed link proves the address
+        user.email_verified = True
+        user.save()
+        
+        refresh = RoleTokenObtainPairSerializer.get_token(user)
+        return Response({
+            'message': 'Account activated successfully',
+            'refresh': str(refresh),
+            'access': str(refresh.access_token),
+        })
\ No newline at end of file
@@ -11,6 +11,7 @@ interface User {
   role: string;
   full_name: string;
   profile_picture?: string;
+  profile_thumbnails?: { small?: string; medium?: string } | null;
 }
 
 interface AuthContextType {
@@ -93,6 +94,11 @@ export const AuthProvider: React.FC<AuthProviderProps> = ({ children }) => {
   };
 
   const logout = () => {
+    const refreshToken = localStorage.getItem('refresh_token');
+    if (refreshToken) {
+      // Revoke server-side; local logout proceeds regardless
+      authAPI.logout(refreshToken, localStorage.getItem('access_token')).catch(() => {});
+    }
     localStorage.removeItem('access_token');
     localStorage.removeItem('refresh_token');
     setUser(null);
@@ -37,8 +37,12 @@ api.interceptors.response.use(
           refresh: refreshToken,
         });
 
-        const { access } = response.data;
+        const { access, refresh } = response.data;
         localStorage.setItem('access_token', access);
+        // Refresh tokens are single-use when rotation is enabled
+        if (refresh) {
+          localStorage.setItem('refresh_token', refresh);
+        }
 
         originalRequest.headers.Authorization = `Bearer ${access}`;
         return api(originalRequest);
@@ -70,6 +74,9 @@ export const authAPI = {
   
   changePassword: (data: any) =>
     api.post('/users/change_password/', data),
+  
+  logout: (refresh: string, access?: string | null) =>
+    axios.post(`${API_URL}/auth/logout/`, { refresh, access }),
 };
 
 // Users API
@@ -91,6 +98,9 @@ export const usersAPI = {
   
   getStats: () =>
     api.get('/users/stats/'),
+  
+  lookup: (q: string, params?: any) =>
+    api.get('/users/lookup/', { params: { q, ...params } }),
 };
 
 // Drugs API